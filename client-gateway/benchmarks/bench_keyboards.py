@@ -0,0 +1,69 @@
+"""Microbenchmark for reply markups: built per message vs. cached JSON.
+
+Times what a send pays for its reply_markup before the HTTP request: building the
+keyboard objects, to_dict() and json.dumps (what python-telegram-bot does for a
+TelegramObject), against handing over a pre-serialized static markup or rendering a
+per-trip template.
+
+    python benchmarks/bench_keyboards.py [--rounds 100000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+from telegram.request._requestparameter import RequestParameter
+
+from keyboards import MarkupRegistry
+
+
+def passenger_menu():
+    return ReplyKeyboardMarkup([
+        [KeyboardButton("\U0001F695 Замовити таксі"), KeyboardButton("\U0001F4B0 Тарифи")],
+        [KeyboardButton("\U0001F504 Змінити роль")],
+    ], resize_keyboard=True)
+
+
+def trip_offer(trip_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Прийняти", callback_data=f"accept_trip_{trip_id}"),
+        InlineKeyboardButton("❌ Відхилити", callback_data=f"decline_trip_{trip_id}"),
+    ]])
+
+
+def wire(markup):
+    return RequestParameter.from_input('reply_markup', markup).json_value
+
+
+def timed(label, rounds, make):
+    started = time.perf_counter()
+    for n in range(rounds):
+        wire(make(n))
+    per_call = (time.perf_counter() - started) / rounds * 1e6
+    print(f"{label:<28} {per_call:6.2f} us/message")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=100000)
+    args = parser.parse_args()
+
+    registry = MarkupRegistry()
+    registry.static('passenger', passenger_menu())
+    registry.template('trip_offer', trip_offer('{trip_id}'))
+    assert json.loads(wire(registry['passenger'])) == passenger_menu().to_dict()
+
+    built = timed("static, built per message", args.rounds, lambda n: passenger_menu())
+    cached = timed("static, cached", args.rounds, lambda n: registry['passenger'])
+    print(f"  saved {built - cached:.2f} us/message ({built / cached:.0f}x)")
+    built = timed("per-trip, built per message", args.rounds, lambda n: trip_offer(f"trip-{n}"))
+    rendered = timed("per-trip, template", args.rounds, lambda n: registry.render('trip_offer', trip_id=f"trip-{n}"))
+    print(f"  saved {built - rendered:.2f} us/message ({built / rendered:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Event-loop lag while handlers log: direct file handlers vs. the queued pipeline.
+
+Simulated handlers log a few INFO lines per step while a probe task measures how late
+the loop wakes it up. The file handler fsyncs every record, and --stall adds a pause
+every --stall-every records, like a slow disk or a log rotation.
+
+    python benchmarks/bench_logging.py [--handlers 200] [--steps 20] [--stall 0.02]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+import log_pipeline
+
+
+class SlowDiskHandler(logging.FileHandler):
+    def __init__(self, path, stall, stall_every):
+        super().__init__(path, encoding='utf-8')
+        self.stall = stall
+        self.stall_every = stall_every
+        self.count = 0
+
+    def emit(self, record):
+        super().emit(record)
+        os.fsync(self.stream.fileno())
+        self.count += 1
+        if self.count % self.stall_every == 0:
+            time.sleep(self.stall)
+
+
+async def probe(lags, interval=0.001):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def handler(logger, chat_id, steps):
+    for step in range(steps):
+        logger.info("process step %s for chat_id=%s pickup=%s", step, chat_id, "вул. Хрещатик, 1")
+        await asyncio.sleep(0)
+
+
+async def scenario(logger, handlers, steps):
+    lags = []
+    probe_task = asyncio.create_task(probe(lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(logger, n, steps) for n in range(handlers)))
+    elapsed = time.perf_counter() - started
+    probe_task.cancel()
+    lags.sort()
+    return elapsed, lags[int(len(lags) * 0.99)] if lags else 0.0, lags[-1] if lags else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--handlers', type=int, default=200)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--stall', type=float, default=0.02)
+    parser.add_argument('--stall-every', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('direct', 'pipeline'):
+            logger = logging.getLogger(f'bench.{mode}')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            disk = SlowDiskHandler(os.path.join(tmp, f'{mode}.log'), args.stall, args.stall_every)
+            disk.setFormatter(log_pipeline.JsonFormatter())
+            if mode == 'direct':
+                logger.addHandler(disk)
+            else:
+                queue_handler = log_pipeline.install(logger, [disk], queue_size=100000)
+            elapsed, p99, worst = asyncio.run(scenario(logger, args.handlers, args.steps))
+            if mode == 'pipeline':
+                queue_handler.listener.stop()
+            print(f"{mode:<9} {args.handlers * args.steps} records in {elapsed * 1000:7.1f} ms"
+                  f"  loop lag p99 {p99 * 1000:6.2f} ms  max {worst * 1000:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Cost of recording a metric: counter increments and histogram observations.
+
+    python benchmarks/bench_metrics.py [--n 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+import metrics
+
+
+def per_call_ns(fn, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=1000000)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    counter = registry.counter('sent_total', 'Sent')
+    labelled = registry.counter('calls_total', 'Calls', ('method', 'code'))
+    histogram = registry.histogram('latency_seconds', 'Latency', ('handler', 'state'))
+    child = labelled.labels('sendMessage', '200')
+    hist_child = histogram.labels('process_pickup_step', 'PICKUP')
+
+    baseline = per_call_ns(lambda: None, args.n)
+    cases = {
+        'counter.inc()': counter.inc,
+        'child.inc()': child.inc,
+        'labels(...).inc()': lambda: labelled.labels('sendMessage', '200').inc(),
+        'histogram child.observe()': lambda: hist_child.observe(0.012),
+        'labels(...).observe()': lambda: histogram.labels('process_pickup_step', 'PICKUP').observe(0.012),
+    }
+    for name, fn in cases.items():
+        print(f"{name:<28} {per_call_ns(fn, args.n) - baseline:7.1f} ns")
+
+
+if __name__ == '__main__':
+    main()
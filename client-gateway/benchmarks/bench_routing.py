@@ -0,0 +1,98 @@
+"""Routing benchmark: regex handler chain vs. UpdateRouter.
+
+Replays a mix of button presses, callback queries and free text through
+Application-style dispatch (first handler whose check_update matches) and times
+the lookup only. --extra adds that many more buttons to both setups to show how
+the chain's cost grows with the number of handlers while the router's does not.
+
+    python benchmarks/bench_routing.py [--rounds 200000] [--extra 0]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import CallbackQueryHandler, MessageHandler, filters
+
+from routing import UpdateRouter
+
+BUTTONS = ["\U0001F504 Змінити роль", "\U0001F464 Пасажир", "\U0001F4B0 Тарифи", "\U0001F697 Водій",
+           "\U0001F4CB Мої замовлення"]
+PREFIXES = ["order_", "accept_trip_", "decline_trip_"]
+
+
+async def noop(update, context):
+    pass
+
+
+def chain(buttons, prefixes):
+    handlers = [MessageHandler(filters.Regex(f"^{re.escape(text)}$"), noop) for text in buttons]
+    handlers += [CallbackQueryHandler(noop, pattern=f"^{prefix}") for prefix in prefixes]
+    return handlers
+
+
+def router(buttons, prefixes):
+    routed = UpdateRouter()
+    for text in buttons:
+        routed.on_text(text, noop)
+    for prefix in prefixes:
+        routed.on_callback(prefix, noop)
+    return [routed]
+
+
+def updates(buttons, count, rng):
+    chat, user, now = Chat(1, 'private'), User(1, 'p', False), datetime.datetime.now()
+    made = []
+    for n in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            made.append(Update(n, message=Message(n, now, chat, text=rng.choice(buttons))))
+        elif kind < 0.8:
+            data = rng.choice(["order_confirm", f"accept_trip_{n}", f"decline_trip_{n}"])
+            made.append(Update(n, callback_query=CallbackQuery(str(n), user, 'c', data=data)))
+        else:
+            made.append(Update(n, message=Message(n, now, chat, text="вул. Хрещатик, 1")))
+    return made
+
+
+def dispatch(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+def timed(label, handlers, sample, rounds):
+    started = time.perf_counter()
+    for n in range(rounds):
+        dispatch(handlers, sample[n % len(sample)])
+    per_update = (time.perf_counter() - started) / rounds * 1e6
+    print(f"{label:<14} {per_update:6.2f} us/update")
+    return per_update
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=200000)
+    parser.add_argument('--extra', type=int, default=0)
+    args = parser.parse_args()
+
+    buttons = BUTTONS + [f"Кнопка {n}" for n in range(args.extra)]
+    sample = updates(BUTTONS, 1000, random.Random(5))
+    for update in sample:
+        assert (dispatch(chain(buttons, PREFIXES), update) is None) == (dispatch(router(buttons, PREFIXES), update) is None)
+
+    print(f"{len(buttons)} buttons, {len(PREFIXES)} callback prefixes")
+    regex = timed("regex chain", chain(buttons, PREFIXES), sample, args.rounds)
+    routed = timed("router", router(buttons, PREFIXES), sample, args.rounds)
+    print(f"  {regex / routed:.1f}x faster")
+
+
+if __name__ == '__main__':
+    main()
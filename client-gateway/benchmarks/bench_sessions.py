@@ -0,0 +1,63 @@
+"""Memory per active session: plain dicts vs. slotted records.
+
+Builds N sessions the way the gateway holds them (an in-progress order, a role and a
+recent submit result per chat) in MemoryStores, once with the old dict shapes and
+once with records.Order / records.Role / records.SubmitResult, and reports the
+traced heap per session.
+
+    python benchmarks/bench_sessions.py [--sessions 50000]
+"""
+import os
+import sys
+import uuid
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+from records import Order, Role, Step, SubmitResult
+from session_store import MemoryStore
+
+
+def dict_session(chat_id, pickup, dropoff, request_id):
+    order = {'pickup': pickup, 'dropoff': dropoff, 'comment': 'Не вказано', '_in_progress': True,
+             'request_id': request_id}
+    result = {'success': True, 'trip_id': request_id, 'request_id': request_id, 'status': 'PENDING',
+              'error': None, 'raw_response': None}
+    return order, 'passenger', result
+
+
+def record_session(chat_id, pickup, dropoff, request_id):
+    order = Order(pickup=pickup, dropoff=dropoff, comment='Не вказано', step=Step.COMMENT, request_id=request_id)
+    result = SubmitResult(success=True, trip_id=request_id, request_id=request_id, status='PENDING')
+    return order, Role.PASSENGER, result
+
+
+def measure(make, sessions, inputs):
+    stores = [MemoryStore(name, maxsize=sessions) for name in ('orders', 'roles', 'results')]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for chat_id, (pickup, dropoff, request_id) in enumerate(inputs):
+        for store, value in zip(stores, make(chat_id, pickup, dropoff, request_id)):
+            store[chat_id] = value
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=50000)
+    args = parser.parse_args()
+
+    # Address and id strings are allocated up front: both layouts reference the same ones.
+    inputs = [(f"вул. Хрещатик, {n % 300}", f"вул. Саксаганського, {n % 170}", f"REQ-{n}-{uuid.uuid4().hex[:12]}")
+              for n in range(args.sessions)]
+    dicts = measure(dict_session, args.sessions, inputs)
+    slotted = measure(record_session, args.sessions, inputs)
+    print(f"{args.sessions} sessions (order + role + submit result, store overhead included)")
+    print(f"dicts:   {dicts:7.0f} bytes/session")
+    print(f"records: {slotted:7.0f} bytes/session  ({1 - slotted / dicts:.0%} less)")
+
+
+if __name__ == '__main__':
+    main()
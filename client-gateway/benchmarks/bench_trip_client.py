@@ -0,0 +1,96 @@
+"""Upstream load of a status-polling storm: direct GET /trips/{id} vs. trip_client.TripClient.
+
+N passengers each poll one of M trips every interval seconds for a while; a few
+trips change status on the way (and publish an event that invalidates the cache).
+Reports lookups/s as seen by passengers and the requests/s that reach the Trip
+Service, with how many of those were 304s.
+
+    python benchmarks/bench_trip_client.py [--passengers 2000] [--trips 200] [--seconds 5]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+from trip_client import TripClient
+
+
+class FakeTripService:
+    def __init__(self, trips, latency):
+        self.latency = latency
+        self.trips = {trip_id: ['PENDING', 1] for trip_id in trips}
+        self.requests = 0
+        self.not_modified = 0
+
+    def advance(self, trip_id, status):
+        self.trips[trip_id] = [status, self.trips[trip_id][1] + 1]
+
+    async def get(self, url, headers=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        status, version = self.trips[url.rsplit('/', 1)[1]]
+        etag = f'"v{version}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            self.not_modified += 1
+            return httpx.Response(304, headers={'ETag': etag})
+        return httpx.Response(200, json={'id': url, 'status': status}, headers={'ETag': etag})
+
+
+async def storm(args, cached):
+    trips = [f"trip-{n}" for n in range(args.trips)]
+    service = FakeTripService(trips, args.latency)
+    client = TripClient(service, ttl=args.ttl) if cached else None
+    rng = random.Random(7)
+    lookups = 0
+    deadline = time.monotonic() + args.seconds
+
+    async def passenger(trip_id):
+        nonlocal lookups
+        await asyncio.sleep(rng.uniform(0, args.interval))
+        while time.monotonic() < deadline:
+            if client is not None:
+                await client.get(trip_id)
+            else:
+                await service.get(f"/trips/{trip_id}")
+            lookups += 1
+            await asyncio.sleep(args.interval)
+
+    async def dispatcher():
+        while time.monotonic() < deadline:
+            await asyncio.sleep(args.interval)
+            trip_id = rng.choice(trips)
+            service.advance(trip_id, 'CONFIRMED')
+            if client is not None:
+                client.invalidate(trip_id)
+
+    started = time.monotonic()
+    await asyncio.gather(dispatcher(), *(passenger(trips[p % len(trips)]) for p in range(args.passengers)))
+    elapsed = time.monotonic() - started
+    return lookups / elapsed, service.requests / elapsed, service.not_modified
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--passengers', type=int, default=2000)
+    parser.add_argument('--trips', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls of one passenger')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=0.02, help='Trip Service response time')
+    parser.add_argument('--ttl', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{args.passengers} passengers polling {args.trips} trips every {args.interval}s for {args.seconds}s")
+    direct_rate, direct_upstream, _ = asyncio.run(storm(args, cached=False))
+    rate, upstream, not_modified = asyncio.run(storm(args, cached=True))
+    print(f"direct: {direct_rate:8.0f} lookups/s  {direct_upstream:8.0f} upstream req/s")
+    print(f"cached: {rate:8.0f} lookups/s  {upstream:8.0f} upstream req/s"
+          f"  ({direct_upstream / upstream if upstream else float('inf'):.0f}x fewer, {not_modified} were 304)")
+
+
+if __name__ == '__main__':
+    main()
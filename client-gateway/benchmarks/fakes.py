@@ -0,0 +1,139 @@
+"""Fake Telegram Bot API and Trip Service for the load test.
+
+Both run on bot/httpserver.py in a thread with their own event loop, so their work
+does not show up as latency in the gateway's loop.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import itertools
+import threading
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+from httpserver import HTTPServer, Response
+
+BOT_METHODS = (
+    'getMe', 'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'answerCallbackQuery',
+    'deleteMessage', 'setWebhook', 'deleteWebhook', 'getWebhookInfo', 'setMyCommands',
+)
+
+
+def request_params(request):
+    """Bot API parameters of a call; PTB posts them form-encoded with JSON values for objects."""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        return request.json() or {}
+    return {key: values[-1] for key, values in parse_qs(request.body.decode()).items()}
+
+
+class FakeBotAPI:
+    """Answers the Bot API methods the gateway calls and counts them."""
+
+    def __init__(self, token, latency=0.0, rng=random):
+        self.token = token
+        self.latency = latency
+        self.rng = rng
+        self.calls = {}
+        self.last_message = {}
+        self._message_ids = itertools.count(1000)
+
+    def install(self, server):
+        for name in BOT_METHODS:
+            server.route('POST', f"/bot{self.token}/{name}", self._method(name))
+
+    def _method(self, name):
+        async def handle(request):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.latency:
+                await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+            return Response.json({'ok': True, 'result': self.result(name, request_params(request))})
+        return handle
+
+    def result(self, name, params):
+        if name == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Taxi', 'username': 'loadtest_bot',
+                    'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if name in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            chat_id = int(params.get('chat_id') or 0)
+            message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+            if name == 'sendMessage':
+                self.last_message[chat_id] = message_id
+            return {'message_id': message_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        if name == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+
+class FakeTripService:
+    """POST /trips with configurable latency and injected 503s.
+
+    Remembers Idempotency-Keys and counts requests that carry trace headers.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rng=random):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.requests = 0
+        self.errors = 0
+        self.replayed = 0
+        self.traced = 0
+        self.trips = {}
+
+    def install(self, server):
+        server.route('POST', '/trips', self.create_trip)
+
+    async def create_trip(self, request):
+        self.requests += 1
+        if request.headers.get('traceparent') and request.headers.get('x-correlation-id'):
+            self.traced += 1
+        if self.latency:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return Response(503, 'injected failure')
+        key = request.headers.get('idempotency-key') or f"anon-{self.requests}"
+        if key in self.trips:
+            self.replayed += 1
+        else:
+            self.trips[key] = json.loads(request.body)
+        return Response.json({'id': f"TRIP-{key}", 'status': 'PENDING'}, status=201)
+
+    def stats(self):
+        return {'requests': self.requests, 'injected_errors': self.errors,
+                'trips': len(self.trips), 'replayed': self.replayed, 'traced': self.traced}
+
+
+class FakeServers:
+    """Runs an HTTPServer per fake in a background thread; start() returns their base URLs."""
+
+    def __init__(self, *fakes):
+        self.fakes = fakes
+        self.servers = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fake-services', daemon=True)
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def start(self):
+        self._thread.start()
+        urls = []
+        for fake in self.fakes:
+            server = HTTPServer('127.0.0.1', 0)
+            fake.install(server)
+            self._call(server.start())
+            self.servers.append(server)
+            urls.append(f"http://127.0.0.1:{server.port}")
+        return urls
+
+    def stop(self):
+        for server in self.servers:
+            self._call(server.stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
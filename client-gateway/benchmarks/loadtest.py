@@ -0,0 +1,288 @@
+"""End-to-end load test: the real gateway wiring against a fake Bot API and Trip Service.
+
+Builds the application with main.build_application() (passenger and driver handlers,
+router, outbound scheduler, trip submitter, outbox), points it at fakes.py, and drives
+--chats simulated passengers through /start -> role -> order -> pickup -> dropoff ->
+comment -> confirm, --concurrency of them at a time. Reports updates/sec, p50/p99
+handler latency (overall and per step) and RSS growth per session, and writes the
+results to benchmarks/results/ as JSON. With --baseline, a drop in throughput or a
+rise in p99 beyond --tolerance is reported and the exit code is 1.
+
+    python benchmarks/loadtest.py [--chats 2000] [--concurrency 200] [--trip-latency 0.05]
+                                  [--trip-error-rate 0.02] [--baseline results/baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import tempfile
+import itertools
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'bot')
+sys.path.insert(0, BOT_DIR)
+from fakes import FakeBotAPI, FakeTripService, FakeServers
+
+TOKEN = '123456:LOADTEST'
+STEPS = ('start', 'role', 'order', 'pickup', 'dropoff', 'comment', 'confirm')
+COMMENTS = ('Під\'їзд 2', 'З дитячим кріслом', 'Подзвоніть, як будете')
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def gazetteer_addresses():
+    import addresses
+    with open(addresses.DEFAULT_GAZETTEER, encoding='utf-8') as f:
+        lines = [line.split('\t')[0].strip() for line in f if line.strip() and not line.startswith('#')]
+    return [line for line in lines if len(line) > 5]
+
+
+def configure_env(args, bot_api_url, trip_url, tmp):
+    """Point main at the fakes; must run before main is imported."""
+    os.environ.update({
+        'BOT_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': bot_api_url,
+        'TRIP_SERVICE_URL': trip_url,
+        'BOT_MODE': 'polling',
+        'SESSION_STORE': 'memory',
+        'TRIP_EVENTS_BROKER': 'local',
+        'FARE_PROVIDER': 'local',
+        'METRICS_PORT': '0',
+        'TRACE_SAMPLE_RATE': str(args.trace_sample_rate),
+        'TRACE_EXPORT_PATH': args.spans or os.path.join(tmp, 'spans.jsonl'),
+        'LOG_DIR': tmp,
+        'OUTBOX_DB_PATH': os.path.join(tmp, 'outbox.db'),
+        'OUTBOUND_GLOBAL_RATE': str(args.send_rate),
+        'OUTBOUND_CHAT_RATE': str(args.send_rate),
+        'OUTBOUND_CHAT_BURST': '10',
+        'TRIP_SERVICE_MAX_CONNECTIONS': str(args.concurrency),
+        'TRIP_SERVICE_MAX_KEEPALIVE': str(args.concurrency),
+    })
+
+
+class Simulator:
+    """Feeds Updates for simulated chats through the application's update processor and times each one."""
+
+    def __init__(self, application, buttons, bot_api, addresses, rng):
+        self.application = application
+        self.buttons = buttons
+        self.bot_api = bot_api
+        self.addresses = addresses
+        self.rng = rng
+        self.latencies = {step: [] for step in STEPS}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f"Passenger {chat_id}"}
+
+    def message(self, chat_id, text):
+        message = {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': self._user(chat_id), 'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback(self, chat_id, data):
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._update_ids)), 'from': self._user(chat_id), 'chat_instance': str(chat_id),
+            'data': data, 'message': {
+                'message_id': self.bot_api.last_message.get(chat_id, 1), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': 1, 'is_bot': True, 'first_name': 'Taxi'},
+                'text': 'confirm',
+            },
+        }}
+
+    async def feed(self, step, data):
+        from telegram import Update
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        # The way Application dispatches fetched updates: through its update processor.
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def passenger(self, chat_id, think):
+        pickup, dropoff = self.rng.sample(self.addresses, 2)
+        comment = self.rng.choice(COMMENTS + (self.buttons['BTN_SKIP'],))
+        script = (
+            ('start', self.message(chat_id, '/start')),
+            ('role', self.message(chat_id, self.buttons['BTN_PASSENGER'])),
+            ('order', self.message(chat_id, self.buttons['BTN_ORDER_TAXI'])),
+            ('pickup', self.message(chat_id, pickup)),
+            ('dropoff', self.message(chat_id, dropoff)),
+            ('comment', self.message(chat_id, comment)),
+        )
+        for step, data in script:
+            await self.feed(step, data)
+            if think:
+                await asyncio.sleep(self.rng.uniform(0, think))
+        await self.feed('confirm', self.callback(chat_id, 'order_confirm'))
+
+    async def run(self, chats, concurrency, think, first_chat_id=10 ** 9):
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(chat_id):
+            async with limit:
+                await self.passenger(chat_id, think)
+
+        await asyncio.gather(*(one(first_chat_id + n) for n in range(chats)))
+
+
+async def probe(lags, interval=0.01):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def run_load(args, bot_api, trips):
+    import main
+
+    main.logger.setLevel(args.log_level)
+    application = main.build_application()
+    errors = []
+
+    async def count_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(count_error)
+    simulator = Simulator(application, main.BUTTONS, bot_api, gazetteer_addresses(), random.Random(args.seed))
+
+    async with application:
+        await main.on_startup(application)
+        await application.start()
+        rss_before = rss_bytes()
+        lags = []
+        probe_task = asyncio.create_task(probe(lags))
+        started = time.perf_counter()
+        await simulator.run(args.chats, args.concurrency, args.think)
+        elapsed = time.perf_counter() - started
+        probe_task.cancel()
+        rss_after = rss_bytes()
+        await application.stop()
+        gateway = {
+            'trip_submitter': main.trip_submitter.stats(),
+            'outbox': main.trip_outbox.stats(),
+            'outbound': main.sender.stats(),
+            'updates': main.update_sequencer.stats(),
+            'router_routed': next(h for h in application.handlers[0] if hasattr(h, 'routed')).routed,
+        }
+        await main.on_shutdown(application)
+
+    all_latencies = [value for values in simulator.latencies.values() for value in values]
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'updates': len(all_latencies),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_sec': round(len(all_latencies) / elapsed, 1),
+        'latency_ms': {'p50': ms(percentile(all_latencies, 0.5)), 'p99': ms(percentile(all_latencies, 0.99)),
+                       'max': ms(max(all_latencies, default=0))},
+        'steps_ms': {step: {'p50': ms(percentile(values, 0.5)), 'p99': ms(percentile(values, 0.99))}
+                     for step, values in simulator.latencies.items()},
+        'loop_lag_ms': {'p99': ms(percentile(lags, 0.99)), 'max': ms(max(lags, default=0))},
+        'rss_per_session_bytes': max(0, rss_after - rss_before) // max(1, args.chats),
+        'handler_errors': len(errors),
+        'error_samples': errors[:5],
+        'bot_api_calls': dict(bot_api.calls),
+        'trip_service': trips.stats(),
+        'gateway': gateway,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against baseline, as human-readable lines."""
+    problems = []
+    changed = sorted(key for key, value in baseline.get('config', {}).items()
+                     if results['config'].get(key) != value)
+    if changed:
+        problems.append(f"baseline was run with different settings ({', '.join(changed)}); not comparable")
+        return problems
+    old, new = baseline['updates_per_sec'], results['updates_per_sec']
+    if new < old * (1 - tolerance):
+        problems.append(f"updates/sec {new} < baseline {old}")
+    old, new = baseline['latency_ms']['p99'], results['latency_ms']['p99']
+    if new > old * (1 + tolerance):
+        problems.append(f"p99 latency {new} ms > baseline {old} ms")
+    old, new = baseline.get('rss_per_session_bytes'), results['rss_per_session_bytes']
+    if old and new > old * (1 + tolerance):
+        problems.append(f"RSS per session {new} B > baseline {old} B")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--think', type=float, default=0.0, help='max random pause between a chat\'s steps, s')
+    parser.add_argument('--bot-latency', type=float, default=0.005, help='mean fake Bot API latency, s')
+    parser.add_argument('--trip-latency', type=float, default=0.05, help='mean fake Trip Service latency, s')
+    parser.add_argument('--trip-error-rate', type=float, default=0.0, help='share of /trips calls answered 503')
+    parser.add_argument('--send-rate', type=float, default=100000, help='outbound scheduler rate limits, msg/s')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--trace-sample-rate', type=float, default=0.1)
+    parser.add_argument('--spans', help='keep sampled spans in this JSONL file (for scripts/trace_report.py)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default=os.path.join(BENCH_DIR, 'results'))
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bot_api = FakeBotAPI(TOKEN, latency=args.bot_latency, rng=rng)
+    trips = FakeTripService(latency=args.trip_latency, error_rate=args.trip_error_rate, rng=rng)
+    fakes = FakeServers(bot_api, trips)
+    bot_api_url, trip_url = fakes.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_env(args, bot_api_url, trip_url, tmp)
+        try:
+            results = asyncio.run(run_load(args, bot_api, trips))
+        finally:
+            fakes.stop()
+
+    results['config'] = {key: value for key, value in vars(args).items() if key not in ('out', 'baseline', 'spans')}
+    results['timestamp'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    print(f"{results['updates']} updates from {args.chats} chats in {results['elapsed_s']} s"
+          f"  {results['updates_per_sec']} updates/s")
+    print(f"handler latency p50 {results['latency_ms']['p50']} ms  p99 {results['latency_ms']['p99']} ms"
+          f"  max {results['latency_ms']['max']} ms  loop lag p99 {results['loop_lag_ms']['p99']} ms")
+    for step, latency in results['steps_ms'].items():
+        print(f"  {step:<8} p50 {latency['p50']:8.3f} ms  p99 {latency['p99']:8.3f} ms")
+    print(f"RSS per session {results['rss_per_session_bytes']} B  handler errors {results['handler_errors']}"
+          f"  trips {results['trip_service']}")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"loadtest-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"results saved to {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
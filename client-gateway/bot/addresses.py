@@ -0,0 +1,203 @@
+import os
+import re
+import mmap
+import bisect
+import logging
+from array import array
+
+logger = logging.getLogger('drive_ops')
+
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.txt')
+
+ABBREVIATIONS = {
+    'вулиця': 'вул', 'проспект': 'просп', 'бульвар': 'бул', 'площа': 'пл',
+    'провулок': 'пров', 'узвіз': 'узв', 'набережна': 'наб',
+}
+_PUNCTUATION = re.compile(r"[^\w']+")
+_NUMBER = re.compile(r"\d+")
+
+
+def address_key(text):
+    """Matching key: lowercase, no punctuation, street types abbreviated."""
+    words = _PUNCTUATION.sub(' ', (text or '').lower().replace('’', "'").replace('ʼ', "'")).split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+def numbers(key):
+    """House and building numbers in a key; a typo fix must never change them."""
+    return _NUMBER.findall(key)
+
+
+def word_suffixes(key):
+    """key and its tails from each word on, so a prefix can match any word: 'вул хрещатик 1', 'хрещатик 1', '1'."""
+    words = key.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AddressIndex:
+    """Autocomplete and fuzzy matching over known addresses.
+
+    Entries come from a gazetteer file and from addresses of successful orders. Prefix
+    lookups bisect a sorted array of matching keys (one per word start, so 'хрещ' finds
+    'вул. Хрещатик, 1'); typo-tolerant lookups score shared trigrams. The gazetteer is
+    memory-mapped and only read on the first lookup, and its display strings are decoded
+    from the mapping when a suggestion is returned.
+    """
+
+    def __init__(self, path=DEFAULT_GAZETTEER, max_learned=50000, prefix_scan=256, max_posting=5000):
+        self.path = path
+        self.max_learned = max_learned
+        self.prefix_scan = prefix_scan
+        self.max_posting = max_posting
+        self._loaded = False
+        self._map = None
+        self._spans = array('Q')
+        self._learned = []
+        self._weights = array('d')
+        self._gram_counts = array('H')
+        self._by_key = {}
+        self._sorted_keys = []
+        self._sorted_ids = []
+        self._postings = {}
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._weights)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        entries = []
+        offset = 0
+        for raw in iter(self._map.readline, b''):
+            line = raw.rstrip(b'\r\n')
+            if line and not line.startswith(b'#'):
+                text, _, weight = line.partition(b'\t')
+                key = address_key(text.decode('utf-8'))
+                if key and key not in self._by_key:
+                    entry_id = len(self._weights)
+                    self._by_key[key] = entry_id
+                    self._spans.extend((offset, len(text)))
+                    self._weights.append(float(weight or 1))
+                    entries.extend((suffix, entry_id) for suffix in word_suffixes(key))
+                    self._index_trigrams(key, entry_id)
+            offset += len(raw)
+        entries.sort()
+        self._sorted_keys = [key for key, _ in entries]
+        self._sorted_ids = [entry_id for _, entry_id in entries]
+        logger.info("Address index loaded %s entries from %s", len(self._weights), self.path)
+
+    def _index_trigrams(self, key, entry_id):
+        grams = trigrams(key)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('I')
+            posting.append(entry_id)
+
+    def text(self, entry_id):
+        gazetteer_size = len(self._spans) // 2
+        if entry_id < gazetteer_size:
+            offset, length = self._spans[2 * entry_id], self._spans[2 * entry_id + 1]
+            return self._map[offset:offset + length].decode('utf-8')
+        return self._learned[entry_id - gazetteer_size]
+
+    def learn(self, address):
+        """Remember an address from a successful order, or make a known one rank higher."""
+        self._ensure_loaded()
+        key = address_key(address)
+        if not key:
+            return
+        entry_id = self._by_key.get(key)
+        if entry_id is not None:
+            self._weights[entry_id] += 1
+            return
+        if len(self._learned) >= self.max_learned:
+            return
+        entry_id = len(self._weights)
+        self._by_key[key] = entry_id
+        self._learned.append(address.strip())
+        self._weights.append(1.0)
+        for suffix in word_suffixes(key):
+            position = bisect.bisect_left(self._sorted_keys, suffix)
+            self._sorted_keys.insert(position, suffix)
+            self._sorted_ids.insert(position, entry_id)
+        self._index_trigrams(key, entry_id)
+
+    def _prefix(self, key, k):
+        lo = bisect.bisect_left(self._sorted_keys, key)
+        hi = bisect.bisect_left(self._sorted_keys, key + '\uffff', lo, min(lo + self.prefix_scan, len(self._sorted_keys)))
+        ids = dict.fromkeys(self._sorted_ids[lo:hi])
+        return sorted(ids, key=lambda entry_id: -self._weights[entry_id])[:k]
+
+    def _fuzzy(self, key, k, min_score):
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None or len(posting) > self.max_posting:
+                continue
+            for entry_id in posting:
+                shared[entry_id] = shared.get(entry_id, 0) + 1
+        scored = []
+        for entry_id, common in shared.items():
+            score = common / (len(grams) + self._gram_counts[entry_id] - common)
+            if score >= min_score:
+                scored.append((score, self._weights[entry_id], entry_id))
+        scored.sort(reverse=True)
+        return [(entry_id, score) for score, _, entry_id in scored[:k]]
+
+    def suggest(self, text, k=3, min_score=0.3):
+        """Up to k known addresses for text: prefix matches first, then closest spellings."""
+        self._ensure_loaded()
+        key = address_key(text)
+        if not key:
+            return []
+        ids = self._prefix(key, k)
+        if len(ids) < k:
+            ids += [entry_id for entry_id, _ in self._fuzzy(key, k, min_score) if entry_id not in ids]
+        return [self.text(entry_id) for entry_id in ids[:k]]
+
+    def normalize(self, text, min_score=0.75, candidates=3):
+        """The canonical spelling of text if it is a known address or a near-certain typo of one.
+
+        A typo match is only taken when it has the same numbers as text: 'Хрещатик, 10'
+        is never turned into 'Хрещатик, 1'. Otherwise None, and the caller offers suggest().
+        """
+        self._ensure_loaded()
+        key = address_key(text)
+        if not key:
+            return None
+        entry_id = self._by_key.get(key)
+        if entry_id is not None:
+            return self.text(entry_id)
+        wanted = numbers(key)
+        for entry_id, _ in self._fuzzy(key, candidates, min_score):
+            if numbers(address_key(self.text(entry_id))) == wanted:
+                return self.text(entry_id)
+        return None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def stats(self):
+        return {
+            'loaded': self._loaded,
+            'gazetteer_entries': len(self._spans) // 2,
+            'learned_entries': len(self._learned),
+            'trigrams': len(self._postings),
+        }
@@ -0,0 +1,215 @@
+import os
+import time
+import sqlite3
+import logging
+
+from session_store import DEFAULT_DB_PATH, DEFAULT_DB_TIMEOUT, DEFAULT_REDIS_TIMEOUT, RespConnection
+
+logger = logging.getLogger('drive_ops')
+
+WON = 'won'
+REPEAT = 'repeat'
+LOST = 'lost'
+
+
+class Claim:
+    __slots__ = ('trip_id', 'driver_id', 'holder', 'outcome', 'latency')
+
+    def __init__(self, trip_id, driver_id, holder, outcome, latency):
+        self.trip_id = trip_id
+        self.driver_id = driver_id
+        self.holder = holder
+        self.outcome = outcome
+        self.latency = latency
+
+    @property
+    def won(self):
+        return self.outcome == WON
+
+    @property
+    def lost(self):
+        return self.outcome == LOST
+
+
+class ClaimRegistry:
+    """First-accept-wins arbitration per trip_id.
+
+    Backends implement _try_claim as a single compare-and-set: store driver_id for
+    trip_id only if nothing is stored yet, and return whoever holds the trip after
+    the call plus whether this call stored it. Claims expire after ttl so abandoned
+    trips do not pin memory forever.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.won = 0
+        self.repeated = 0
+        self.lost = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _try_claim(self, trip_id, driver_id):
+        raise NotImplementedError
+
+    def holder(self, trip_id):
+        raise NotImplementedError
+
+    def release(self, trip_id):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def claim(self, trip_id, driver_id):
+        trip_id, driver_id = str(trip_id), str(driver_id)
+        started = time.perf_counter()
+        holder, fresh = self._try_claim(trip_id, driver_id)
+        latency = time.perf_counter() - started
+
+        if holder != driver_id:
+            outcome = LOST
+            self.lost += 1
+        elif fresh:
+            outcome = WON
+            self.won += 1
+        else:
+            outcome = REPEAT
+            self.repeated += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return Claim(trip_id, driver_id, holder, outcome, latency)
+
+    def stats(self):
+        total = self.won + self.repeated + self.lost
+        return {
+            'backend': type(self).__name__,
+            'won': self.won,
+            'repeated': self.repeated,
+            'lost': self.lost,
+            'contention_ratio': self.lost / total if total else 0.0,
+            'claim_latency_avg_ms': (self.latency_total / total * 1000) if total else 0.0,
+            'claim_latency_max_ms': self.latency_max * 1000,
+        }
+
+
+class MemoryClaims(ClaimRegistry):
+    """Claims for a single gateway process; the check-and-set never awaits, so handlers cannot interleave."""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, ttl=3600, clock=time.monotonic):
+        super().__init__(ttl)
+        self.clock = clock
+        self._claims = {}
+        self._calls = 0
+
+    def _try_claim(self, trip_id, driver_id):
+        now = self.clock()
+        self._calls += 1
+        if self._calls % self.PURGE_EVERY == 0:
+            self._purge_expired(now)
+        current = self._claims.get(trip_id)
+        if current is not None and current[1] > now:
+            return current[0], False
+        self._claims[trip_id] = (driver_id, now + self.ttl)
+        return driver_id, True
+
+    def _purge_expired(self, now):
+        for trip_id in [t for t, (_, expires_at) in self._claims.items() if expires_at <= now]:
+            del self._claims[trip_id]
+
+    def holder(self, trip_id):
+        current = self._claims.get(str(trip_id))
+        if current is None or current[1] <= self.clock():
+            return None
+        return current[0]
+
+    def release(self, trip_id):
+        self._claims.pop(str(trip_id), None)
+
+
+class SQLiteClaims(ClaimRegistry):
+    """Claims in the session SQLite file, shared by all gateway workers on one host."""
+
+    def __init__(self, path=DEFAULT_DB_PATH, ttl=3600, clock=time.time, timeout=DEFAULT_DB_TIMEOUT):
+        super().__init__(ttl)
+        self.clock = clock
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trip_claims ("
+            " trip_id TEXT PRIMARY KEY, driver_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _try_claim(self, trip_id, driver_id):
+        now = self.clock()
+        self._conn.execute("DELETE FROM trip_claims WHERE trip_id = ? AND expires_at <= ?", (trip_id, now))
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO trip_claims (trip_id, driver_id, expires_at) VALUES (?, ?, ?)",
+            (trip_id, driver_id, now + self.ttl),
+        )
+        if cur.rowcount == 1:
+            return driver_id, True
+        return self.holder(trip_id), False
+
+    def holder(self, trip_id):
+        row = self._conn.execute(
+            "SELECT driver_id FROM trip_claims WHERE trip_id = ? AND expires_at > ?", (str(trip_id), self.clock())
+        ).fetchone()
+        return row[0] if row else None
+
+    def release(self, trip_id):
+        self._conn.execute("DELETE FROM trip_claims WHERE trip_id = ?", (str(trip_id),))
+
+    def close(self):
+        self._conn.close()
+
+
+class RedisClaims(ClaimRegistry):
+    """Claims via SET NX on a Redis-protocol server, correct across hosts."""
+
+    def __init__(self, connection=None, ttl=3600, prefix='drive_ops'):
+        super().__init__(ttl)
+        self.conn = connection or RespConnection()
+        self.prefix = f"{prefix}:claims:"
+
+    def _try_claim(self, trip_id, driver_id):
+        if self.conn.execute('SET', self.prefix + trip_id, driver_id, 'NX', 'EX', int(self.ttl)) == 'OK':
+            return driver_id, True
+        return self.holder(trip_id), False
+
+    def holder(self, trip_id):
+        return self.conn.execute('GET', self.prefix + str(trip_id))
+
+    def release(self, trip_id):
+        self.conn.execute('DEL', self.prefix + str(trip_id))
+
+    def close(self):
+        self.conn.close()
+
+
+def from_env(ttl=3600, workers=1):
+    """Registry picked by CLAIM_STORE (default SESSION_STORE); workers is the number of gateway processes."""
+    backend = os.getenv('CLAIM_STORE') or os.getenv('SESSION_STORE', 'memory')
+    backend = backend.lower()
+    ttl = float(os.getenv('CLAIM_TTL', ttl))
+    if backend == 'memory' and workers > 1:
+        # Each worker would arbitrate alone, and two drivers could both win one trip.
+        raise ValueError(f"CLAIM_STORE=memory cannot arbitrate between {workers} gateway workers, use sqlite or redis")
+
+    if backend == 'sqlite':
+        registry = SQLiteClaims(os.getenv('SESSION_DB_PATH', DEFAULT_DB_PATH), ttl=ttl,
+                                timeout=float(os.getenv('SESSION_DB_TIMEOUT', DEFAULT_DB_TIMEOUT)))
+    elif backend == 'redis':
+        conn = RespConnection.from_url(os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+                                       timeout=float(os.getenv('REDIS_TIMEOUT', DEFAULT_REDIS_TIMEOUT)))
+        registry = RedisClaims(conn, ttl=ttl)
+    elif backend == 'memory':
+        registry = MemoryClaims(ttl=ttl)
+    else:
+        raise ValueError(f"Unknown CLAIM_STORE backend: {backend}")
+
+    logger.info("Trip claims: backend=%s ttl=%s", type(registry).__name__, ttl)
+    return registry
@@ -1,10 +1,24 @@
 import logging
-import re
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from telegram.ext import ContextTypes
+import fanout
+from outbound import PRIORITY_CONFIRMATION
+from keyboards import markups
+from records import Role
+from routing import UpdateRouter
 
 logger = logging.getLogger('drive_ops')
 
+TRIP_TAKEN_TEXT = "\u26D4 Замовлення вже прийняв інший водій."
+TRIP_ACCEPT_FAILED_TEXT = "\u26A0\uFE0F Не вдалося прийняти замовлення {trip_id}. Спробуйте ще раз."
+
+TRIP_OFFER_MARKUP = markups.template('trip_offer', InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("\u2705 Прийняти", callback_data="accept_trip_{trip_id}"),
+        InlineKeyboardButton("\u274C Відхилити", callback_data="decline_trip_{trip_id}")
+    ]
+]))
+
 
 def register_handlers(application, user_orders, user_roles, buttons, keyboards, helpers):
     
@@ -13,18 +27,28 @@ def register_handlers(application, user_orders, user_roles, buttons, keyboards,
     
     driver_menu = keyboards['driver_menu']
     
+    offers = helpers.get('offers')
+    claims = helpers.get('claims')
+    forward_assignment = helpers.get('forward_assignment')
+    safe_send = helpers['safe_send']
+    safe_edit_message_text = helpers['safe_edit_message_text']
+    
     async def select_driver_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        user_roles[chat_id] = 'driver'
-        await update.message.reply_text(
+        await user_roles.aset(chat_id, Role.DRIVER)
+        await safe_send(
+            chat_id,
             "\u2705 Ви обрали роль: Таксист\n\nОберіть опцію:",
+            context,
             reply_markup=driver_menu()
         )
 
     async def show_driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
+        await safe_send(
+            update.effective_chat.id,
             "\U0001F4ED У вас немає нових замовлень\n\n"
-            "\U0001F4A1 Нові замовлення з'являться тут автоматично."
+            "\U0001F4A1 Нові замовлення з'являться тут автоматично.",
+            context
         )
 
     async def accept_trip(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -33,14 +57,54 @@ def register_handlers(application, user_orders, user_roles, buttons, keyboards,
         
         trip_id = query.data.replace('accept_trip_', '')
         chat_id = query.message.chat.id
+        message_id = query.message.message_id
         
+        if claims is not None:
+            try:
+                claim = claims.claim(trip_id, chat_id)
+            except Exception as e:
+                logger.exception("Claiming trip %s for driver %s failed: %s", trip_id, chat_id, e)
+                await accept_failed(chat_id, message_id, trip_id, context)
+                return
+            if claim.lost:
+                logger.info(
+                    "Driver %s lost trip %s to driver %s (claim %.1fms)",
+                    chat_id, trip_id, claim.holder, claim.latency * 1000
+                )
+                await safe_edit_message_text(chat_id, message_id, TRIP_TAKEN_TEXT, context)
+                if offers is not None:
+                    offers.mark(trip_id, chat_id, fanout.WITHDRAWN)
+                return
+            if not claim.won:
+                return
+        
+        # The driver is told the trip is theirs only once the Driver Service has it.
+        if forward_assignment is not None and not await forward_assignment(trip_id, chat_id):
+            if claims is not None:
+                try:
+                    claims.release(trip_id)
+                except Exception as e:
+                    logger.exception("Releasing the claim on trip %s failed: %s", trip_id, e)
+            await accept_failed(chat_id, message_id, trip_id, context)
+            return
+
         logger.info("Driver %s accepted trip %s", chat_id, trip_id)
         
-        await query.edit_message_text(
-            text=f"\u2705 Ви прийняли замовлення {trip_id}\n\nЗв'яжіться з клієнтом.",
+        await safe_edit_message_text(
+            chat_id, message_id, f"\u2705 Ви прийняли замовлення {trip_id}\n\nЗв'яжіться з клієнтом.", context,
+            priority=PRIORITY_CONFIRMATION,
             parse_mode='Markdown'
         )
+        
+        if offers is not None:
+            withdrawn = await offers.resolve(trip_id, chat_id)
+            logger.info("Trip %s withdrawn from %s other drivers", trip_id, withdrawn)
     
+    async def accept_failed(chat_id, message_id, trip_id, context):
+        # The offer buttons stay, so the driver can try again.
+        await safe_edit_message_text(chat_id, message_id, TRIP_ACCEPT_FAILED_TEXT.format(trip_id=trip_id), context,
+                                     reply_markup=TRIP_OFFER_MARKUP.render(trip_id=trip_id))
+
     async def decline_trip(update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
@@ -50,18 +114,25 @@ def register_handlers(application, user_orders, user_roles, buttons, keyboards,
         
         logger.info("Driver %s declined trip %s", chat_id, trip_id)
         
-        await query.edit_message_text(
-            text=f"\u274C Ви відхилили замовлення {trip_id}",
+        if offers is not None:
+            offers.decline(trip_id, chat_id)
+        
+        await safe_edit_message_text(
+            chat_id, query.message.message_id, f"\u274C Ви відхилили замовлення {trip_id}", context,
             parse_mode='Markdown'
         )
 
-    application.add_handler(MessageHandler(filters.Regex(f"^{re.escape(BTN_DRIVER)}$"), select_driver_role))
-    application.add_handler(MessageHandler(filters.Regex(f"^{re.escape(BTN_MY_ORDERS)}$"), show_driver_orders))
-    application.add_handler(CallbackQueryHandler(accept_trip, pattern="^accept_trip_"))
-    application.add_handler(CallbackQueryHandler(decline_trip, pattern="^decline_trip_"))
+    router = helpers.get('router')
+    if router is None:
+        router = UpdateRouter()
+        application.add_handler(router)
+    router.on_text(BTN_DRIVER, select_driver_role)
+    router.on_text(BTN_MY_ORDERS, show_driver_orders)
+    router.on_callback("accept_trip_", accept_trip)
+    router.on_callback("decline_trip_", decline_trip)
 
 
-async def notify_new_order(bot, driver_chat_id, order_info):
+def build_trip_offer(order_info):
     trip_id = order_info.get('trip_id', 'N/A')
     pickup = order_info.get('pickup', 'Не вказано')
     dropoff = order_info.get('dropoff', 'Не вказано')
@@ -77,12 +148,11 @@ async def notify_new_order(bot, driver_chat_id, order_info):
     if comment:
         text += f"\U0001F4AC **Коментар:** {comment}\n"
     
-    markup = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("\u2705 Прийняти", callback_data=f"accept_trip_{trip_id}"),
-            InlineKeyboardButton("\u274C Відхилити", callback_data=f"decline_trip_{trip_id}")
-        ]
-    ])
+    return text, TRIP_OFFER_MARKUP.render(trip_id=trip_id)
+
+
+async def notify_new_order(bot, driver_chat_id, order_info):
+    text, markup = build_trip_offer(order_info)
     
     try:
         await bot.send_message(driver_chat_id, text, parse_mode='Markdown', reply_markup=markup)
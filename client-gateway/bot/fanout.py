@@ -0,0 +1,193 @@
+import time
+import asyncio
+import logging
+
+import driver
+import outbound
+from session_store import MemoryStore
+
+logger = logging.getLogger('drive_ops')
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+DECLINED = 'declined'
+ACCEPTED = 'accepted'
+WITHDRAWN = 'withdrawn'
+
+# Nobody can take the trip any more once every recipient is in one of these.
+CLOSED = (FAILED, CANCELLED, DECLINED, WITHDRAWN)
+
+
+class OfferResult:
+    __slots__ = ('chat_id', 'status', 'message_id', 'error', 'latency')
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.status = PENDING
+        self.message_id = None
+        self.error = None
+        self.latency = None
+
+    def as_dict(self):
+        return {
+            'chat_id': self.chat_id,
+            'status': self.status,
+            'message_id': self.message_id,
+            'error': self.error,
+            'latency': self.latency,
+        }
+
+
+class TripOffer:
+    """One trip offered to many drivers; the text and keyboard are built once and shared.
+
+    Cancelling drops offers still queued in the sender. An offer already on its way to
+    the Bot API cannot be stopped; if it lands after withdraw(), it is retracted then.
+    """
+
+    def __init__(self, bot, order_info, driver_chat_ids, sender=None, concurrency=20):
+        self.bot = bot
+        self.sender = sender
+        self.trip_id = str(order_info.get('trip_id', 'N/A'))
+        self.text, self.markup = driver.build_trip_offer(order_info)
+        self.results = {chat_id: OfferResult(chat_id) for chat_id in dict.fromkeys(driver_chat_ids)}
+        self.cancelled = False
+        self.withdraw_text = None
+        self._late = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = []
+
+    async def _send_one(self, result):
+        async with self._semaphore:
+            if self.cancelled:
+                result.status = CANCELLED
+                return
+            started = time.perf_counter()
+
+            async def send():
+                message = await self.bot.send_message(
+                    result.chat_id, self.text, parse_mode='Markdown', reply_markup=self.markup)
+                self._delivered(result, message)
+                return message
+
+            try:
+                if self.sender is not None:
+                    message = await self.sender.submit(result.chat_id, send, priority=outbound.PRIORITY_NOTIFICATION)
+                else:
+                    message = await send()
+            except asyncio.CancelledError:
+                if result.status == PENDING:
+                    result.status = CANCELLED
+                raise
+            except Exception as e:
+                result.status = FAILED
+                result.error = str(e)
+                logger.warning("Failed to offer trip %s to driver %s: %s", self.trip_id, result.chat_id, e)
+            else:
+                result.latency = time.perf_counter() - started
+
+    def _delivered(self, result, message):
+        result.message_id = getattr(message, 'message_id', None)
+        if self.withdraw_text is not None and result.status != ACCEPTED:
+            # The send was already under way when the trip was taken.
+            result.status = SENT
+            self._late.append(asyncio.ensure_future(self._retract(result, self.withdraw_text)))
+        elif result.status in (PENDING, CANCELLED):
+            result.status = SENT
+
+    async def run(self):
+        self._tasks = [asyncio.ensure_future(self._send_one(result)) for result in self.results.values()]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for result in self.results.values():
+            if result.status == PENDING:
+                result.status = CANCELLED
+        return self.results
+
+    def cancel(self):
+        self.cancelled = True
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+
+    def mark(self, chat_id, status):
+        result = self.results.get(chat_id)
+        if result is not None:
+            result.status = status
+
+    async def _retract(self, result, text):
+        def call():
+            return self.bot.edit_message_text(chat_id=result.chat_id, message_id=result.message_id, text=text)
+
+        try:
+            if self.sender is not None:
+                await self.sender.submit(result.chat_id, call, priority=outbound.PRIORITY_NOTIFICATION,
+                                         coalesce_key=('edit', result.chat_id, result.message_id))
+            else:
+                await call()
+            result.status = WITHDRAWN
+        except Exception as e:
+            logger.warning("Failed to withdraw offer %s from driver %s: %s", self.trip_id, result.chat_id, e)
+
+    async def withdraw(self, winner_chat_id, text):
+        self.withdraw_text = text
+        self.cancel()
+        self.mark(winner_chat_id, ACCEPTED)
+        delivered = [r for r in self.results.values() if r.status == SENT and r.message_id is not None]
+        await asyncio.gather(*(self._retract(result, text) for result in delivered))
+        return len(delivered)
+
+    def closed(self):
+        return all(result.status in CLOSED for result in self.results.values())
+
+    def summary(self):
+        counts = {}
+        for result in self.results.values():
+            counts[result.status] = counts.get(result.status, 0) + 1
+        return counts
+
+
+class OfferFanout:
+    """Tracks active trip offers so an accept from one driver can stop and retract the rest.
+
+    An offer is dropped once it is resolved, once every recipient has declined or could
+    not be reached, or after offer_ttl seconds, whichever comes first.
+    """
+
+    def __init__(self, sender=None, concurrency=20, offer_ttl=600, max_offers=10000, clock=time.monotonic):
+        self.sender = sender
+        self.concurrency = concurrency
+        self.active = MemoryStore('trip_offers', maxsize=max_offers, ttl=offer_ttl, clock=clock)
+
+    async def offer(self, bot, order_info, driver_chat_ids):
+        offer = TripOffer(bot, order_info, driver_chat_ids, self.sender, self.concurrency)
+        self.active[offer.trip_id] = offer
+        started = time.perf_counter()
+        await offer.run()
+        logger.info(
+            "Trip %s offered to %s drivers in %.3fs: %s",
+            offer.trip_id, len(offer.results), time.perf_counter() - started, offer.summary()
+        )
+        self._evict_if_closed(offer)
+        return offer
+
+    def _evict_if_closed(self, offer):
+        if offer.closed() and self.active.get(offer.trip_id) is offer:
+            del self.active[offer.trip_id]
+            logger.info("Trip %s offer closed without a taker: %s", offer.trip_id, offer.summary())
+
+    def mark(self, trip_id, chat_id, status):
+        offer = self.active.get(str(trip_id))
+        if offer is not None:
+            offer.mark(chat_id, status)
+            self._evict_if_closed(offer)
+
+    def decline(self, trip_id, chat_id):
+        self.mark(trip_id, chat_id, DECLINED)
+
+    async def resolve(self, trip_id, winner_chat_id, text=None):
+        offer = self.active.pop(str(trip_id), None)
+        if offer is None:
+            return 0
+        return await offer.withdraw(winner_chat_id, text or driver.TRIP_TAKEN_TEXT)
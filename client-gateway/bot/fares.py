@@ -0,0 +1,198 @@
+import os
+import re
+import math
+import logging
+
+import http_client
+from session_store import MemoryStore
+
+logger = logging.getLogger('drive_ops')
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class Tariff:
+    __slots__ = ('name', 'emoji', 'per_km')
+
+    def __init__(self, name, emoji, per_km):
+        self.name = name
+        self.emoji = emoji
+        self.per_km = per_km
+
+    def price(self, km):
+        return int(math.ceil(km * self.per_km))
+
+
+TARIFFS = [
+    Tariff('Стандарт', '\U0001F695', per_km=15),
+    Tariff('Комфорт', '\U0001F3E2', per_km=25),
+]
+
+
+def rates_text(tariffs=TARIFFS):
+    return "\n".join(f"{t.emoji} Тариф '{t.name}': {t.per_km} грн/км" for t in tariffs)
+
+
+def normalize_address(address):
+    return re.sub(r"\s+", " ", (address or '').strip().lower())
+
+
+def haversine_km(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(h, 1.0)))
+
+
+class LocalProvider:
+    """Offline stand-in for geocoding and routing.
+
+    Only known landmarks resolve, to their real coordinates; any other address gives
+    None, so no quote is made up for it. Road distance is the straight line times
+    road_factor.
+    """
+
+    LANDMARKS = {
+        'аеропорт бориспіль': (50.3450, 30.8947),
+        'аеропорт': (50.3450, 30.8947),
+        'аеропорт жуляни': (50.4017, 30.4497),
+        'жуляни': (50.4017, 30.4497),
+        'вокзал': (50.4406, 30.4887),
+        'центральний вокзал': (50.4406, 30.4887),
+        'залізничний вокзал': (50.4406, 30.4887),
+        'вул. хрещатик, 1': (50.4501, 30.5234),
+        'майдан незалежності': (50.4501, 30.5234),
+    }
+    def __init__(self, road_factor=1.3):
+        self.road_factor = road_factor
+
+    async def geocode(self, address):
+        return self.LANDMARKS.get(normalize_address(address))
+
+    async def route_km(self, origin, destination):
+        return haversine_km(origin, destination) * self.road_factor
+
+    async def aclose(self):
+        pass
+
+
+class HttpProvider:
+    """Nominatim-compatible geocoding and OSRM-compatible routing over pooled HTTP clients."""
+
+    def __init__(self, geocoder_url, router_url, config=None):
+        self.geocoder = http_client.PooledClient(geocoder_url, config)
+        self.router = http_client.PooledClient(router_url, config)
+
+    async def geocode(self, address):
+        resp = await self.geocoder.get('/search', params={'q': address, 'format': 'json', 'limit': 1})
+        resp.raise_for_status()
+        results = resp.json()
+        if not results:
+            return None
+        return float(results[0]['lat']), float(results[0]['lon'])
+
+    async def route_km(self, origin, destination):
+        coords = f"{origin[1]},{origin[0]};{destination[1]},{destination[0]}"
+        resp = await self.router.get(f"/route/v1/driving/{coords}", params={'overview': 'false'})
+        resp.raise_for_status()
+        return resp.json()['routes'][0]['distance'] / 1000
+
+    async def aclose(self):
+        await self.geocoder.aclose()
+        await self.router.aclose()
+
+
+def provider_from_env():
+    """The configured provider, or None when FARE_PROVIDER is unset and quotes are off."""
+    backend = os.getenv('FARE_PROVIDER', '').lower()
+    if not backend or backend == 'none':
+        logger.info("Fare quotes disabled: FARE_PROVIDER is not set")
+        return None
+    if backend == 'http':
+        return HttpProvider(
+            os.getenv('GEOCODER_URL', 'https://nominatim.openstreetmap.org'),
+            os.getenv('ROUTER_URL', 'https://router.project-osrm.org'),
+            http_client.PoolConfig.from_env('FARE_PROVIDER'),
+        )
+    if backend == 'local':
+        return LocalProvider(road_factor=float(os.getenv('FARE_ROAD_FACTOR', 1.3)))
+    raise ValueError(f"Unknown FARE_PROVIDER backend: {backend}")
+
+
+class FareQuote:
+    __slots__ = ('km', 'prices')
+
+    def __init__(self, km, prices):
+        self.km = km
+        self.prices = prices
+
+    def text(self):
+        lines = [f"\U0001F4CF Відстань: ~{self.km:.1f} км"]
+        lines += [f"{t.emoji} {t.name}: ~{price} грн" for t, price in self.prices]
+        return "\n".join(lines)
+
+
+class FareEstimator:
+    """Price quotes for pickup/dropoff pairs with memoized geocoding and route distances.
+
+    Both caches are bounded LRU stores with a TTL, so popular routes (airport, station)
+    are answered without calling the provider at all.
+    """
+
+    def __init__(self, provider, tariffs=TARIFFS, cache_size=10000, cache_ttl=24 * 3600):
+        self.provider = provider
+        self.tariffs = tariffs
+        self.points = MemoryStore('fare_points', maxsize=cache_size, ttl=cache_ttl)
+        self.routes = MemoryStore('fare_routes', maxsize=cache_size, ttl=cache_ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def _point(self, address):
+        key = normalize_address(address)
+        point = self.points.get(key)
+        if point is not None:
+            self.hits += 1
+            return point
+        self.misses += 1
+        point = await self.provider.geocode(address)
+        if point is not None:
+            self.points[key] = point
+        return point
+
+    async def route_km(self, pickup, dropoff):
+        key = (normalize_address(pickup), normalize_address(dropoff))
+        km = self.routes.get(key)
+        if km is not None:
+            self.hits += 1
+            return km
+        self.misses += 1
+        origin = await self._point(pickup)
+        destination = await self._point(dropoff)
+        if origin is None or destination is None:
+            return None
+        km = await self.provider.route_km(origin, destination)
+        self.routes[key] = km
+        return km
+
+    async def estimate(self, pickup, dropoff):
+        """A FareQuote, or None when the addresses cannot be resolved or the provider fails."""
+        try:
+            km = await self.route_km(pickup, dropoff)
+        except Exception as e:
+            logger.warning("Fare estimate failed for %r -> %r: %s", pickup, dropoff, e)
+            return None
+        if km is None:
+            return None
+        return FareQuote(km, [(t, t.price(km)) for t in self.tariffs])
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'cache_hit_ratio': self.hits / lookups if lookups else 0.0,
+            'cached_points': len(self.points),
+            'cached_routes': len(self.routes),
+        }
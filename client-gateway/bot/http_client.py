@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import httpx
+
+logger = logging.getLogger('drive_ops')
+
+
+class PoolConfig:
+    def __init__(self, max_connections=100, max_keepalive=20, keepalive_expiry=30.0,
+                 timeout=10.0, connect_timeout=3.0, pool_timeout=5.0):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+
+    @classmethod
+    def from_env(cls, prefix='TRIP_SERVICE'):
+        def env(name, default, cast=float):
+            value = os.getenv(f"{prefix}_{name}")
+            return cast(value) if value not in (None, '') else default
+
+        return cls(
+            max_connections=env('MAX_CONNECTIONS', 100, int),
+            max_keepalive=env('MAX_KEEPALIVE', 20, int),
+            keepalive_expiry=env('KEEPALIVE_EXPIRY', 30.0),
+            timeout=env('TIMEOUT', 10.0),
+            connect_timeout=env('CONNECT_TIMEOUT', 3.0),
+            pool_timeout=env('POOL_TIMEOUT', 5.0),
+        )
+
+
+class PooledClient:
+    """Application-scoped httpx client with keep-alive pooling and pool metrics.
+
+    The metrics are counted from each request's own trace events, so they do not
+    depend on httpx internals: a request that starts a TCP connect opened a new
+    connection, any other request reused a pooled one.
+    """
+
+    def __init__(self, base_url='', config=None):
+        self.base_url = base_url
+        self.config = config or PoolConfig()
+        self._client = None
+        self.requests_total = 0
+        self.requests_in_flight = 0
+        self.connections_opened = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    @property
+    def started(self):
+        return self._client is not None
+
+    async def start(self):
+        if self._client is not None:
+            return
+        cfg = self.config
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=cfg.max_connections,
+                max_keepalive_connections=cfg.max_keepalive,
+                keepalive_expiry=cfg.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(cfg.timeout, connect=cfg.connect_timeout, pool=cfg.pool_timeout),
+        )
+        logger.info(
+            "HTTP pool started: base_url=%s max_connections=%s max_keepalive=%s",
+            self.base_url, cfg.max_connections, cfg.max_keepalive
+        )
+
+    async def aclose(self):
+        if self._client is None:
+            return
+        client, self._client = self._client, None
+        await client.aclose()
+        logger.info("HTTP pool closed: %s", self.stats())
+
+    async def request(self, method, url, **kwargs):
+        if self._client is None:
+            await self.start()
+
+        started = time.perf_counter()
+        waited = None
+
+        async def trace(event, info):
+            nonlocal waited
+            if event == 'connection.connect_tcp.started':
+                self.connections_opened += 1
+            if waited is None and (event == 'connection.connect_tcp.started'
+                                   or event.endswith('.send_request_headers.started')):
+                waited = time.perf_counter() - started
+
+        extensions = dict(kwargs.pop('extensions', None) or {})
+        extensions['trace'] = trace
+        self.requests_total += 1
+        self.requests_in_flight += 1
+        try:
+            return await self._client.request(method, url, extensions=extensions, **kwargs)
+        finally:
+            self.requests_in_flight -= 1
+            if waited is not None:
+                self.queue_wait_total += waited
+                self.queue_wait_max = max(self.queue_wait_max, waited)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        reused = max(self.requests_total - self.connections_opened, 0)
+        return {
+            'requests_in_flight': self.requests_in_flight,
+            'connections_opened_total': self.connections_opened,
+            'requests_total': self.requests_total,
+            'reuse_ratio': reused / self.requests_total if self.requests_total else 0.0,
+            'queue_wait_avg_ms': (self.queue_wait_total / self.requests_total * 1000) if self.requests_total else 0.0,
+            'queue_wait_max_ms': self.queue_wait_max * 1000,
+        }
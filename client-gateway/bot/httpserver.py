@@ -0,0 +1,127 @@
+import json
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger('drive_ops')
+
+REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+    403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+    429: 'Too Many Requests', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class Response:
+    def __init__(self, status=200, body=b'', content_type='text/plain; charset=utf-8', headers=None):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data, status=200, headers=None):
+        return cls(status, json.dumps(data, ensure_ascii=False), 'application/json', headers)
+
+
+class HTTPServer:
+    """Small asyncio HTTP/1.1 server with keep-alive, enough for internal endpoints and webhooks."""
+
+    def __init__(self, host='127.0.0.1', port=0, max_body=1024 * 1024, max_head=64 * 1024):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.max_head = max_head
+        self.routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=self.max_head)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        """The next request, None once the peer is gone, or a Response for a request we cannot parse."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            return Response(431, 'Request header too large')
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return Response(400, 'Malformed request line')
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > self.max_body:
+            return Request(method, target, headers, None)
+        body = await reader.readexactly(length) if length else b''
+        return Request(method, target, headers, body)
+
+    async def _dispatch(self, request):
+        if request.body is None:
+            return Response(413, 'Payload too large')
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            allowed = any(path == request.path for _, path in self.routes)
+            return Response(405 if allowed else 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.exception("HTTP handler failed for %s %s: %s", request.method, request.path, e)
+            return Response(500)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    # The rest of the stream cannot be framed; answer and drop the connection.
+                    response, keep_alive = request, False
+                else:
+                    response = await self._dispatch(request)
+                    keep_alive = request.headers.get('connection', '').lower() != 'close' and request.body is not None
+                head = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}",
+                        f"Content-Type: {response.content_type}",
+                        f"Content-Length: {len(response.body)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head.extend(f"{name}: {value}" for name, value in response.headers.items())
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,67 @@
+import re
+import json
+
+
+class CachedMarkup(str):
+    """A reply markup already serialized to its Bot API JSON.
+
+    python-telegram-bot passes str parameters through untouched, so handing one of these
+    to send_message/edit_message_text skips building the TelegramObject tree and its
+    to_dict() + json.dumps on every send.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, markup):
+        return cls(json.dumps(markup.to_dict()))
+
+    def to_dict(self):
+        return json.loads(self)
+
+
+class MarkupTemplate:
+    """A markup with {name} placeholders, serialized once and filled in per message."""
+
+    _FIELD = re.compile(r"\{(\w+)\}")
+
+    def __init__(self, markup):
+        self._parts = self._FIELD.split(json.dumps(markup.to_dict()))
+
+    def render(self, **values):
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = json.dumps(str(values[parts[i]]))[1:-1]
+        return CachedMarkup(''.join(parts))
+
+
+class MarkupRegistry:
+    """Named static keyboards and per-trip templates, each built and serialized once."""
+
+    def __init__(self):
+        self._static = {}
+        self._templates = {}
+
+    def static(self, name, markup):
+        cached = self._static[name] = CachedMarkup.of(markup)
+        return cached
+
+    def template(self, name, markup):
+        template = self._templates[name] = MarkupTemplate(markup)
+        return template
+
+    def __getitem__(self, name):
+        return self._static[name]
+
+    def render(self, name, **values):
+        return self._templates[name].render(**values)
+
+    def stats(self):
+        return {
+            'static': len(self._static),
+            'templates': len(self._templates),
+            'static_bytes': sum(len(markup.encode()) for markup in self._static.values()),
+        }
+
+
+markups = MarkupRegistry()
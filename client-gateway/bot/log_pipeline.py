@@ -0,0 +1,163 @@
+import copy
+import json
+import queue
+import atexit
+import logging
+import datetime
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}.
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, fields passed via extra, and exc."""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets one in `every` records below WARNING through from the given loggers, counted per call site."""
+
+    def __init__(self, loggers, every=10):
+        super().__init__()
+        self.loggers = tuple(loggers)
+        self.every = every
+        self._counters = {}
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if self.every <= 1 or record.levelno >= logging.WARNING or not record.name.startswith(self.loggers):
+            return True
+        counter = self._counters.get(record.msg)
+        if counter is None:
+            counter = self._counters[record.msg] = itertools.count()
+        if next(counter) % self.every == 0:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler over a bounded queue that never blocks the caller.
+
+    When the queue is full a record below WARNING is dropped; a WARNING or worse
+    evicts the oldest queued record instead, so problems still reach the log.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.capacity = maxsize
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Render the message now (arguments may change after the call) but leave the JSON
+        # encoding and the writing to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        with self._lock:
+            self.dropped += 1
+            if record.levelno < logging.WARNING:
+                return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                pass
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.capacity, 'dropped': self.dropped}
+
+
+class _Listener(QueueListener):
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+    def enqueue_sentinel(self):
+        # The queue may be full at shutdown; wait for the writer thread to make room.
+        self.queue.put(self._sentinel)
+
+
+def install(logger, handlers, queue_size=10000, sampled_loggers=(), sample_every=10):
+    """Route logger through a bounded queue to handlers written by a background thread.
+
+    Returns the queue handler (for stats); the listener is stopped, and the queue
+    flushed, at interpreter exit.
+    """
+    queue_handler = DroppingQueueHandler(queue_size)
+    if sampled_loggers:
+        queue_handler.addFilter(SamplingFilter(sampled_loggers, sample_every))
+    listener = _Listener(queue_handler.queue, *handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_handler.listener = listener
+    return queue_handler
+
+
+def _queue_handlers(logger):
+    return [h for h in logger.handlers if isinstance(h, DroppingQueueHandler) and h.listener is not None]
+
+
+def share(logger, log_queue):
+    """Move the pipeline install() set up on logger onto log_queue (a multiprocessing queue).
+
+    Child processes then forward() into it, and this process's listener stays the only
+    writer of the handlers.
+    """
+    for queue_handler in _queue_handlers(logger):
+        old = queue_handler.listener
+        queue_handler.queue = log_queue
+        old.stop()
+        listener = _Listener(log_queue, *old.handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        queue_handler.listener = listener
+
+
+def forward(logger, log_queue):
+    """In a child process: send logger's records to log_queue, which the parent share()d, instead of writing them here.
+
+    The queue handler and its filters stay, so sampling and drop counting still happen
+    in the child; its own listener is stopped once what it holds is written.
+    """
+    for queue_handler in _queue_handlers(logger):
+        old = queue_handler.listener
+        queue_handler.queue = log_queue
+        queue_handler.listener = None
+        old.stop()
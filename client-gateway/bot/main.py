@@ -3,52 +3,134 @@ import sys
 import logging
 from logging.handlers import RotatingFileHandler
 import time
-<<<<<<< HEAD
-import re
-import httpx
+import asyncio
+import multiprocessing
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-=======
-import requests
-import telebot
-from telebot import types
->>>>>>> main
+from telegram.ext import Application, CommandHandler, ContextTypes
 from dotenv import load_dotenv
 import passenger
 import driver
+import http_client
+import session_store
+import webhook
+import outbound
+import sharding
+import fanout
+import claims
+import trip_events
+import trip_client
+import fares
+import addresses
+import trip_submit
+import outbox
+import keyboards
+import routing
+import records
+import log_pipeline
+import metrics
+import tracing
+import sequencing
+
+# Before any os.getenv below: the log pipeline and tracing are configured from .env too.
+load_dotenv()
 
-LOG_DIR = os.path.join(os.path.dirname(__file__), 'logs')
+LOG_DIR = os.getenv('LOG_DIR', os.path.join(os.path.dirname(__file__), 'logs'))
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, 'bot.log')
 
 logger = logging.getLogger('drive_ops')
+step_logger = logging.getLogger('drive_ops.steps')
 logger.setLevel(logging.INFO)
 
 log_format = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
 
-file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8')
-file_handler.setFormatter(log_format)
-logger.addHandler(file_handler)
-
 console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_format)
-logger.addHandler(console_handler)
+console_handler.setFormatter(log_pipeline.JsonFormatter() if os.getenv('LOG_FORMAT') == 'json' else log_format)
+log_handlers = [console_handler]
+if multiprocessing.parent_process() is None:
+    # Gateway shards forward their records to the front process (sharding.worker_main),
+    # so only one process ever writes and rotates bot.log.
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8')
+    file_handler.setFormatter(log_pipeline.JsonFormatter())
+    log_handlers.insert(0, file_handler)
+
+# Handlers only enqueue; a background thread formats and writes, so disk stalls never block the event loop.
+log_queue = log_pipeline.install(
+    logger, log_handlers,
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+    sampled_loggers=('drive_ops.steps',),
+    sample_every=int(os.getenv('LOG_STEP_SAMPLE_EVERY', 10)),
+)
 
-load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 TRIP_SERVICE_URL = os.getenv('TRIP_SERVICE_URL', 'http://localhost:8080')
+DRIVER_SERVICE_URL = os.getenv('DRIVER_SERVICE_URL')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+GATEWAY_WORKERS = int(os.getenv('GATEWAY_WORKERS', 1))
+SHARD_STATS_PORT = int(os.getenv('SHARD_STATS_PORT', 9100))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
 
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN is not set in the environment or .env file.")
     sys.exit("ERROR: BOT_TOKEN is not configured.")
 
-<<<<<<< HEAD
-=======
-bot = telebot.TeleBot(BOT_TOKEN)
-
->>>>>>> main
-user_orders = {}
-user_roles = {}
+span_collector = tracing.JsonlCollector(
+    os.getenv('TRACE_EXPORT_PATH', os.path.join(LOG_DIR, 'spans.jsonl')),
+    maxsize=int(os.getenv('TRACE_QUEUE_SIZE', 10000)),
+) if TRACE_SAMPLE_RATE > 0 else None
+tracing.tracer.configure(span_collector, TRACE_SAMPLE_RATE)
+
+sender = outbound.SendScheduler(
+    global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', 30)),
+    chat_rate=float(os.getenv('OUTBOUND_CHAT_RATE', 1)),
+    chat_burst=int(os.getenv('OUTBOUND_CHAT_BURST', 3)),
+    max_queue=int(os.getenv('OUTBOUND_MAX_QUEUE', 10000)),
+)
+update_sequencer = sequencing.ChatSequencer(
+    max_running=int(os.getenv('UPDATE_CONCURRENCY', 64)),
+    max_pending=int(os.getenv('UPDATE_MAX_PENDING', 10000)),
+)
+offers = fanout.OfferFanout(
+    sender,
+    concurrency=int(os.getenv('FANOUT_CONCURRENCY', 20)),
+    offer_ttl=float(os.getenv('FANOUT_OFFER_TTL', 600)),
+)
+trip_http = http_client.PooledClient(TRIP_SERVICE_URL, http_client.PoolConfig.from_env('TRIP_SERVICE'))
+driver_http = http_client.PooledClient(DRIVER_SERVICE_URL or '', http_client.PoolConfig.from_env('DRIVER_SERVICE'))
+trip_claims = claims.from_env(workers=GATEWAY_WORKERS)
+trip_submitter = trip_submit.TripSubmitter(
+    trip_http,
+    breaker=trip_submit.CircuitBreaker(
+        failure_threshold=int(os.getenv('TRIP_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.getenv('TRIP_BREAKER_RESET', 30)),
+    ),
+    max_attempts=int(os.getenv('TRIP_SUBMIT_ATTEMPTS', 3)),
+    backoff_base=float(os.getenv('TRIP_SUBMIT_BACKOFF', 0.2)),
+    backoff_max=float(os.getenv('TRIP_SUBMIT_BACKOFF_MAX', 2.0)),
+)
+trips = trip_client.TripClient(
+    trip_http,
+    ttl=float(os.getenv('TRIP_CACHE_TTL', 2.0)),
+    keep=float(os.getenv('TRIP_CACHE_KEEP', 600)),
+    maxsize=int(os.getenv('TRIP_CACHE_SIZE', 10000)),
+)
+fare_provider = fares.provider_from_env()
+fare_estimator = fares.FareEstimator(
+    fare_provider,
+    cache_size=int(os.getenv('FARE_CACHE_SIZE', 10000)),
+    cache_ttl=float(os.getenv('FARE_CACHE_TTL', 24 * 3600)),
+) if fare_provider is not None else None
+address_index = addresses.AddressIndex(
+    os.getenv('ADDRESS_GAZETTEER', addresses.DEFAULT_GAZETTEER),
+    max_learned=int(os.getenv('ADDRESS_MAX_LEARNED', 50000)),
+)
+
+user_orders = session_store.from_env('orders', ttl=24 * 3600, record=records.Order)
+user_roles = session_store.from_env('roles', ttl=90 * 24 * 3600)
+conversations = session_store.from_env('conversations', ttl=24 * 3600)
 
 BTN_PASSENGER = "\U0001F64B Я замовник таксі"
 BTN_DRIVER = "\U0001F697 Я таксист"
@@ -68,54 +150,43 @@ BUTTONS = {
     'BTN_CHANGE_ROLE': BTN_CHANGE_ROLE,
 }
 
-def role_selection_menu():
-<<<<<<< HEAD
-    keyboard = [[KeyboardButton(BTN_PASSENGER), KeyboardButton(BTN_DRIVER)]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-
-def passenger_menu():
-    keyboard = [
+ROLE_SELECTION_MENU = keyboards.markups.static('role_selection', ReplyKeyboardMarkup(
+    [[KeyboardButton(BTN_PASSENGER), KeyboardButton(BTN_DRIVER)]],
+    resize_keyboard=True, one_time_keyboard=True,
+))
+PASSENGER_MENU = keyboards.markups.static('passenger', ReplyKeyboardMarkup(
+    [
         [KeyboardButton(BTN_ORDER_TAXI), KeyboardButton(BTN_RATES)],
         [KeyboardButton(BTN_CHANGE_ROLE)]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def driver_menu():
-    keyboard = [
+    ],
+    resize_keyboard=True,
+))
+DRIVER_MENU = keyboards.markups.static('driver', ReplyKeyboardMarkup(
+    [
         [KeyboardButton(BTN_MY_ORDERS)],
         [KeyboardButton(BTN_CHANGE_ROLE)]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    ],
+    resize_keyboard=True,
+))
+SKIP_MENU = keyboards.markups.static('skip', ReplyKeyboardMarkup(
+    [[KeyboardButton(BTN_SKIP)]],
+    resize_keyboard=True, one_time_keyboard=True,
+))
 
-def skip_menu():
-    keyboard = [[KeyboardButton(BTN_SKIP)]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-=======
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    markup.add(types.KeyboardButton(BTN_PASSENGER), types.KeyboardButton(BTN_DRIVER))
-    return markup
+def role_selection_menu():
+    return ROLE_SELECTION_MENU
 
 def passenger_menu():
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(types.KeyboardButton(BTN_ORDER_TAXI), types.KeyboardButton(BTN_RATES))
-    markup.add(types.KeyboardButton(BTN_CHANGE_ROLE))
-    return markup
+    return PASSENGER_MENU
 
 def driver_menu():
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(types.KeyboardButton(BTN_MY_ORDERS))
-    markup.add(types.KeyboardButton(BTN_CHANGE_ROLE))
-    return markup
+    return DRIVER_MENU
 
 def skip_menu():
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    markup.add(types.KeyboardButton(BTN_SKIP))
-    return markup
->>>>>>> main
+    return SKIP_MENU
 
-def get_user_menu(chat_id):
-    role = user_roles.get(chat_id, 'passenger')
-    return driver_menu() if role == 'driver' else passenger_menu()
+def get_user_menu(role):
+    return driver_menu() if role == records.Role.DRIVER else passenger_menu()
 
 KEYBOARDS = {
     'role_selection_menu': role_selection_menu,
@@ -128,234 +199,295 @@ KEYBOARDS = {
 def is_valid_address(address):
     return address is not None and len(address) > 5
 
-<<<<<<< HEAD
-async def safe_send(chat_id, text, context, **kwargs):
-    try:
-        return await context.bot.send_message(chat_id, text, **kwargs)
-=======
-def safe_send(chat_id, text, **kwargs):
+async def safe_send(chat_id, text, context, priority=outbound.PRIORITY_DEFAULT, **kwargs):
     try:
-        return bot.send_message(chat_id, text, **kwargs)
->>>>>>> main
+        return await sender.submit(
+            chat_id,
+            lambda: context.bot.send_message(chat_id, text, **kwargs),
+            priority=priority,
+        )
     except Exception as e:
         logger.exception("Failed to send message to %s: %s", chat_id, e)
         return None
 
-<<<<<<< HEAD
-async def safe_edit_message_text(chat_id, message_id, text, context, **kwargs):
+async def safe_edit_message_text(chat_id, message_id, text, context, priority=outbound.PRIORITY_DEFAULT, **kwargs):
     try:
-        return await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
-=======
-def safe_edit_message_text(chat_id, message_id, text, **kwargs):
-    try:
-        return bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
->>>>>>> main
+        return await sender.submit(
+            chat_id,
+            lambda: context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs),
+            priority=priority,
+            coalesce_key=('edit', chat_id, message_id),
+        )
     except Exception as e:
         logger.exception("Failed to edit message %s/%s: %s", chat_id, message_id, e)
         return None
 
-<<<<<<< HEAD
-async def submit_trip_request(chat_id, order):
-=======
-def validate_address_and_retry(chat_id, address, error_message, retry_handler):
-    if is_valid_address(address):
-        return True
-    msg = safe_send(chat_id, error_message)
-    if msg is not None:
-        try:
-            bot.register_next_step_handler(msg, retry_handler)
-        except Exception:
-            logger.exception("Failed to register next step handler for %s", chat_id)
-            safe_send(chat_id, "Виникла внутрішня помилка. Спробуйте ще раз.")
-    return False
+async def safe_edit_message_reply_markup(chat_id, message_id, reply_markup, context, priority=outbound.PRIORITY_DEFAULT):
+    try:
+        return await sender.submit(
+            chat_id,
+            lambda: context.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup),
+            priority=priority,
+            coalesce_key=('markup', chat_id, message_id),
+        )
+    except Exception as e:
+        logger.exception("Failed to edit markup of message %s/%s: %s", chat_id, message_id, e)
+        return None
 
-def submit_trip_request(chat_id, order):
->>>>>>> main
-    payload = {
+def trip_payload(chat_id, order):
+    return {
         'pickup': order.get('pickup'),
         'dropoff': order.get('dropoff'),
         'comment': order.get('comment'),
         'source': 'telegram_bot',
         'user_chat_id': chat_id,
-<<<<<<< HEAD
         'passenger_id': order.get('passenger_id') or str(chat_id),
-=======
->>>>>>> main
     }
-    logger.info(
+
+async def submit_trip_request(chat_id, order):
+    payload = trip_payload(chat_id, order)
+    step_logger.info(
         "Trip request payload: chat_id=%s pickup=%s dropoff=%s comment=%s",
         chat_id, payload['pickup'], payload['dropoff'], payload['comment']
     )
 
-    request_id = f"REQ-{chat_id}-{int(time.time())}"
-    
+    request_id = order.get('request_id') or f"REQ-{chat_id}-{int(time.time())}"
+    return await trip_submitter.submit(request_id, payload)
+
+def queue_trip_request(request_id, chat_id, message_id, order):
+    trip_outbox.add(request_id, chat_id, message_id, trip_payload(chat_id, order))
+
+async def report_queued_trip(entry, result, context):
+    chat_id, message_id = entry['chat_id'], entry['message_id']
+    if result is not None and result.get('success'):
+        status = result.get('status', 'PENDING').upper()
+        text = passenger.format_trip_status(result['trip_id'], status)
+        if trip_status is not None:
+            trip_status.watch(result['trip_id'], chat_id, message_id, status)
+    else:
+        text = passenger.format_trip_failure(result or {'request_id': entry['request_id']})
+    await safe_edit_message_text(chat_id, message_id, text, context,
+                                 priority=outbound.PRIORITY_CONFIRMATION, parse_mode='Markdown')
+
+async def forward_assignment(trip_id, driver_chat_id):
+    if not DRIVER_SERVICE_URL:
+        logger.warning("DRIVER_SERVICE_URL is not set, trip %s assignment not forwarded", trip_id)
+        return False
+
+    payload = {
+        'trip_id': trip_id,
+        'driver_id': str(driver_chat_id),
+        'source': 'telegram_bot',
+    }
     try:
-<<<<<<< HEAD
-        url = f"{TRIP_SERVICE_URL}/trips"
-        logger.info("Sending trip request to %s", url)
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post(url, json=payload)
-=======
-        url = f"{TRIP_SERVICE_URL}/requests"
-        logger.info("Sending trip request to %s", url)
-        
-        resp = requests.post(url, json=payload, timeout=10)
->>>>>>> main
-        
-        if resp.status_code in (200, 201):
-            data = resp.json()
-            trip_id = data.get('id') or data.get('trip_id') or request_id
-            status = data.get('status', 'pending')
-            
-            logger.info(
-                "Trip request success: trip_id=%s status=%s",
-                trip_id, status
-            )
-            
-            return {
-                'success': True,
-                'trip_id': trip_id,
-                'request_id': request_id,
-                'status': status,
-                'error': None,
-                'raw_response': data,
-            }
-        else:
-            logger.error(
-                "Trip request failed: status_code=%s response=%s",
-                resp.status_code, resp.text
-            )
-            return {
-                'success': False,
-                'trip_id': None,
-                'request_id': request_id,
-                'status': 'error',
-                'error': {
-                    'status_code': resp.status_code,
-                    'message': resp.text or 'Unknown error',
-                },
-                'raw_response': None,
-            }
-<<<<<<< HEAD
-    except httpx.TimeoutException:
-=======
-    except requests.exceptions.Timeout:
->>>>>>> main
-        logger.error("Trip request timeout for chat_id=%s", chat_id)
-        return {
-            'success': False,
-            'trip_id': None,
-            'request_id': request_id,
-            'status': 'error',
-            'error': {
-                'status_code': 504,
-                'message': 'Сервіс не відповідає. Спробуйте пізніше.',
-            },
-            'raw_response': None,
-        }
-<<<<<<< HEAD
-    except httpx.ConnectError:
-=======
-    except requests.exceptions.ConnectionError:
->>>>>>> main
-        logger.error("Trip request connection error for chat_id=%s", chat_id)
-        return {
-            'success': False,
-            'trip_id': None,
-            'request_id': request_id,
-            'status': 'error',
-            'error': {
-                'status_code': 503,
-                'message': 'Сервіс недоступний. Спробуйте пізніше.',
-            },
-            'raw_response': None,
-        }
+        resp = await driver_http.post(f"{DRIVER_SERVICE_URL}/assignments", json=payload)
+        if resp.status_code in (200, 201, 202):
+            logger.info("Trip %s assignment to driver %s forwarded", trip_id, driver_chat_id)
+            return True
+        logger.error(
+            "Trip assignment forward failed: trip_id=%s status_code=%s response=%s",
+            trip_id, resp.status_code, resp.text
+        )
     except Exception as e:
-        logger.exception("Trip request unexpected error for chat_id=%s: %s", chat_id, e)
-        return {
-            'success': False,
-            'trip_id': None,
-            'request_id': request_id,
-            'status': 'error',
-            'error': {
-                'status_code': 500,
-                'message': str(e),
-            },
-            'raw_response': None,
-        }
-
-HELPERS = {
+        logger.exception("Trip assignment forward error for trip_id=%s: %s", trip_id, e)
+    return False
+
+trip_events_broker = trip_events.broker_from_env()
+trip_status = trip_events.TripStatusNotifier(
+    trip_events_broker,
+    safe_edit_message_text,
+    passenger.format_trip_status,
+    coalesce_window=float(os.getenv('TRIP_STATUS_COALESCE', 1.0)),
+    markup=passenger.trip_status_markup,
+) if trip_events_broker is not None else None
+if trip_status is not None:
+    trip_status.listeners.append(trips.handle_event)
+
+trip_outbox = outbox.TripOutbox(
+    trip_submitter.submit,
+    report_queued_trip,
+    os.getenv('OUTBOX_DB_PATH', outbox.DEFAULT_OUTBOX_PATH),
+    concurrency=int(os.getenv('OUTBOX_CONCURRENCY', 4)),
+    max_age=float(os.getenv('OUTBOX_MAX_AGE', 600)),
+    timeout=float(os.getenv('SESSION_DB_TIMEOUT', session_store.DEFAULT_DB_TIMEOUT)),
+)
+
+HANDLER_SECONDS = metrics.registry.histogram(
+    'gateway_handler_seconds', 'Update handler latency by callback and conversation state', ('handler', 'state'))
+HANDLER_ERRORS = metrics.registry.counter(
+    'gateway_handler_errors_total', 'Update handlers that raised, by callback and conversation state', ('handler', 'state'))
+HELPER_SECONDS = metrics.registry.histogram('gateway_helper_seconds', 'Handler helper latency', ('helper',))
+TELEGRAM_SECONDS = metrics.registry.histogram(
+    'gateway_telegram_request_seconds', 'Bot API call latency by method and status code', ('method', 'code'))
+TELEGRAM_FLOOD_WAITS = metrics.registry.counter('gateway_telegram_flood_waits_total', 'Bot API calls answered with 429')
+LOOP_LAG_SECONDS = metrics.registry.histogram(
+    'gateway_event_loop_lag_seconds', 'How late the event loop wakes a periodic probe',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+# From the stores' insert/delete counters: len() would scan Redis or SQLite on every scrape.
+metrics.registry.gauge('gateway_active_orders', 'Orders being filled in or confirmed', fn=lambda: user_orders.active)
+metrics.registry.gauge('gateway_active_conversations', 'Order conversations in progress', fn=lambda: conversations.active)
+metrics.registry.collect('gateway_outbound', sender.stats)
+metrics.registry.collect('gateway_updates', update_sequencer.stats)
+metrics.registry.collect('gateway_trip_submit', trip_submitter.stats)
+metrics.registry.collect('gateway_trip_http', trip_http.stats)
+metrics.registry.collect('gateway_trip_cache', trips.stats)
+metrics.registry.collect('gateway_outbox', trip_outbox.stats)
+if trip_status is not None:
+    metrics.registry.collect('gateway_trip_status', trip_status.stats)
+metrics.registry.collect('gateway_claims', trip_claims.stats)
+if fare_estimator is not None:
+    metrics.registry.collect('gateway_fares', fare_estimator.stats)
+metrics.registry.collect('gateway_log_queue', log_queue.stats)
+metrics.registry.collect('gateway_tracing', tracing.tracer.stats)
+
+loop_lag = metrics.LoopLagMonitor(LOOP_LAG_SECONDS)
+metrics_http = metrics.metrics_server(metrics.registry, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+HELPERS = metrics.instrument_helpers({
     'safe_send': safe_send,
     'safe_edit_message_text': safe_edit_message_text,
-<<<<<<< HEAD
+    'safe_edit_message_reply_markup': safe_edit_message_reply_markup,
     'submit_trip_request': submit_trip_request,
+    'queue_trip_request': queue_trip_request,
     'is_valid_address': is_valid_address,
-}
+    'offers': offers,
+    'claims': trip_claims,
+    'forward_assignment': forward_assignment,
+    'trip_status': trip_status,
+    'trips': trips,
+    'fares': fare_estimator,
+    'addresses': address_index,
+}, HELPER_SECONDS)
 
 async def start_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    user_roles.pop(chat_id, None)
-    user_orders.pop(chat_id, None)
-    await update.message.reply_text(
-=======
-    'validate_address_and_retry': validate_address_and_retry,
-    'submit_trip_request': submit_trip_request,
-}
-
-@bot.message_handler(commands=['start'])
-def start_message(message):
-    chat_id = message.chat.id
-    user_roles.pop(chat_id, None)
-    user_orders.pop(chat_id, None)
-    bot.send_message(
+    await user_roles.apop(chat_id)
+    await user_orders.apop(chat_id)
+    await safe_send(
         chat_id,
->>>>>>> main
         "\U0001F696 Вітаємо у службі таксі!\n\nОберіть вашу роль:",
+        context,
+        priority=outbound.PRIORITY_MENU,
         reply_markup=role_selection_menu()
     )
 
-<<<<<<< HEAD
 async def change_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    user_roles.pop(chat_id, None)
-    user_orders.pop(chat_id, None)
-    await update.message.reply_text(
-=======
-@bot.message_handler(func=lambda message: message.text == BTN_CHANGE_ROLE)
-def change_role(message):
-    chat_id = message.chat.id
-    user_roles.pop(chat_id, None)
-    user_orders.pop(chat_id, None)
-    bot.send_message(
+    await user_roles.apop(chat_id)
+    await user_orders.apop(chat_id)
+    await safe_send(
         chat_id,
->>>>>>> main
         "\U0001F504 Оберіть нову роль:",
+        context,
+        priority=outbound.PRIORITY_MENU,
         reply_markup=role_selection_menu()
     )
 
-<<<<<<< HEAD
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+async def on_startup(application):
+    await trip_http.start()
+    sender.start()
+    if trip_status is not None:
+        trip_status.start(application)
+    trip_outbox.start(application)
+    loop_lag.start()
+    if span_collector is not None and sharding.current_shard is not None:
+        # One spans file per shard: several processes appending to one file interleave lines.
+        root, ext = os.path.splitext(span_collector.path)
+        span_collector.path = f"{root}.shard{sharding.current_shard}{ext}"
+    if metrics_http is not None:
+        if sharding.current_shard is not None:
+            # Every shard is its own process with its own numbers: shard N serves METRICS_PORT + N.
+            metrics_http.port = METRICS_PORT + sharding.current_shard
+        try:
+            await metrics_http.start()
+        except OSError as e:
+            logger.warning("Metrics endpoint not started on %s:%s: %s", METRICS_HOST, metrics_http.port, e)
+
+async def on_shutdown(application):
+    if metrics_http is not None:
+        await metrics_http.stop()
+    await loop_lag.stop()
+    await trip_outbox.stop()
+    logger.info("Trip outbox: %s", trip_outbox.stats())
+    trip_outbox.close()
+    if trip_status is not None:
+        await trip_status.stop()
+        logger.info("Trip status push stopped: %s", trip_status.stats())
+    await sender.stop()
+    logger.info("Outbound scheduler stopped: %s", sender.stats())
+    logger.info("Trip submissions: %s", trip_submitter.stats())
+    await trip_http.aclose()
+    await driver_http.aclose()
+    logger.info("Trip claims: %s", trip_claims.stats())
+    trip_claims.close()
+    if fare_estimator is not None:
+        logger.info("Fare estimator: %s", fare_estimator.stats())
+        await fare_estimator.aclose()
+    logger.info("Address index: %s", address_index.stats())
+    address_index.close()
+    user_orders.close()
+    user_roles.close()
+    conversations.close()
+    logger.info("Tracing: %s", tracing.tracer.stats())
+    if span_collector is not None:
+        span_collector.close()
+    logger.info("Log queue: %s", log_queue.stats())
+
+def build_application(update_queue_size=0):
+    builder = Application.builder().application_class(tracing.TracedApplication).token(BOT_TOKEN).request(
+        metrics.TelegramRequest(TELEGRAM_SECONDS, TELEGRAM_FLOOD_WAITS, connection_pool_size=256)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = (
+        builder
+        .update_queue(asyncio.Queue(maxsize=update_queue_size))
+        .concurrent_updates(update_sequencer)
+        .persistence(session_store.ConversationPersistence(conversations))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
+    router = routing.UpdateRouter()
+    router.on_text(BTN_CHANGE_ROLE, change_role)
     application.add_handler(CommandHandler("start", start_message))
-    application.add_handler(MessageHandler(filters.Regex(f"^{re.escape(BTN_CHANGE_ROLE)}$"), change_role))
-    
-    passenger.register_handlers(application, user_orders, user_roles, BUTTONS, KEYBOARDS, HELPERS)
-    driver.register_handlers(application, user_orders, user_roles, BUTTONS, KEYBOARDS, HELPERS)
-    
+    application.add_handler(router)
+
+    helpers = {**HELPERS, 'router': router}
+    passenger.register_handlers(application, user_orders, user_roles, BUTTONS, KEYBOARDS, helpers)
+    driver.register_handlers(application, user_orders, user_roles, BUTTONS, KEYBOARDS, helpers)
+    metrics.instrument_handlers(application, HANDLER_SECONDS, HANDLER_ERRORS)
+    return application
+
+def main():
     print("Бот запущений...")
     print("Модулі завантажено: passenger, driver")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
-if __name__ == "__main__":
-    main()
-=======
-passenger.register_handlers(bot, user_orders, user_roles, BUTTONS, KEYBOARDS, HELPERS)
-driver.register_handlers(bot, user_orders, user_roles, BUTTONS, KEYBOARDS, HELPERS)
+    if GATEWAY_WORKERS > 1:
+        config = webhook.WebhookConfig.from_env() if BOT_MODE == 'webhook' else None
+        application = build_application()
+        allowed = webhook.allowed_updates(application)
+        shard_logs = multiprocessing.get_context('spawn').Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+        log_pipeline.share(logger, shard_logs)
+        dispatcher = sharding.ShardDispatcher(
+            build_application, GATEWAY_WORKERS,
+            max_in_flight=int(os.getenv('SHARD_MAX_IN_FLIGHT', 256)),
+            log_queue=shard_logs,
+        )
+        logger.info("Starting %s gateway shards (%s ingress)", GATEWAY_WORKERS, BOT_MODE)
+        asyncio.run(sharding.serve(dispatcher, application.bot, allowed, config, SHARD_STATS_PORT))
+    elif BOT_MODE == 'webhook':
+        config = webhook.WebhookConfig.from_env()
+        application = build_application(config.queue_size)
+        allowed = webhook.allowed_updates(application)
+        logger.info("Starting in webhook mode on %s:%s%s", config.listen, config.port, config.path)
+        webhook.run_webhook(application, config, allowed)
+    else:
+        application = build_application()
+        allowed = webhook.allowed_updates(application)
+        logger.info("Starting in polling mode, allowed_updates=%s", allowed)
+        application.run_polling(allowed_updates=allowed)
 
 if __name__ == "__main__":
-    print("Бот запущений...")
-    print("Модулі завантажено: passenger, driver")
-    bot.infinity_polling()
->>>>>>> main
+    main()
@@ -0,0 +1,370 @@
+import time
+import asyncio
+import inspect
+import logging
+import functools
+from bisect import bisect_left
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+import httpserver
+import tracing
+
+logger = logging.getLogger('drive_ops')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # Buckets are stored non-cumulative; render() adds them up at scrape time.
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    """A metric family; labels(...) returns the child that holds the numbers.
+
+    Children are plain slotted objects, so inc()/observe() on a child kept in a
+    variable is one attribute update. Unlabelled metrics forward to their only child.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _labels(self.labelnames, values), child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+
+class Gauge(_Metric):
+    """A gauge set by the code, or read from fn() at scrape time when fn is given."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.value = value
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def dec(self, amount=1):
+        self._default.value -= amount
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                self._default.value = self.fn()
+            except Exception as e:
+                logger.warning("Gauge %s could not be read: %s", self.name, e)
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            total = 0
+            for bound, count in zip(self.bounds + (float('inf'),), child.counts):
+                total += count
+                yield f"{self.name}_bucket", _labels(self.labelnames, values, f'le="{_number(bound)}"'), total
+            yield f"{self.name}_sum", _labels(self.labelnames, values), child.sum
+            yield f"{self.name}_count", _labels(self.labelnames, values), total
+
+
+class Registry:
+    """Named metrics plus stats() sources, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), fn=None):
+        return self._register(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self, prefix, stats):
+        """Expose the numbers in stats() (nested dicts flattened with _) as {prefix}_* gauges."""
+        self._collectors[prefix] = stats
+
+    def _collected(self):
+        lines = []
+        for prefix, stats in list(self._collectors.items()):
+            try:
+                data = stats()
+            except Exception as e:
+                logger.warning("Stats for %s could not be collected: %s", prefix, e)
+                continue
+            stack = [(prefix, data)]
+            while stack:
+                name, value = stack.pop()
+                if isinstance(value, dict):
+                    stack.extend((f"{name}_{key}", item) for key, item in value.items())
+                elif isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_number(float(value))}")
+        return lines
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        lines.extend(self._collected())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed(fn, histogram, errors=None):
+    """Wrap coroutine function fn to observe its duration in histogram (a child) and count errors."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def _state_name(state):
+    return getattr(state, 'name', None) or str(state)
+
+
+def instrument_handlers(application, latency, errors):
+    """Time every handler callback in application, labelled by callback name and conversation state.
+
+    latency is a Histogram and errors a Counter, both labelled (handler, state).
+    Handlers nested in a ConversationHandler get the state they are registered
+    under ('entry' and 'fallback' for the entry points and fallbacks); buttons on
+    an UpdateRouter are labelled 'router'.
+    """
+
+    def wrap(handler, state):
+        callback = handler.callback
+        if getattr(callback, 'timed', False):
+            return
+        name = getattr(callback, '__name__', type(handler).__name__)
+        handler.callback = timed(callback, latency.labels(name, state), errors.labels(name, state))
+
+    def wrap_router(router):
+        def wrap_route(callback):
+            if getattr(callback, 'timed', False):
+                return callback
+            name = getattr(callback, '__name__', 'route')
+            return timed(callback, latency.labels(name, 'router'), errors.labels(name, 'router'))
+        router.wrap_callbacks(wrap_route)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for entry in handler.entry_points:
+                    wrap(entry, 'entry')
+                for state, state_handlers in handler.states.items():
+                    for state_handler in state_handlers:
+                        wrap(state_handler, _state_name(state))
+                for fallback in handler.fallbacks:
+                    wrap(fallback, 'fallback')
+            elif hasattr(handler, 'wrap_callbacks'):
+                wrap_router(handler)
+            else:
+                wrap(handler, 'none')
+
+
+def instrument_helpers(helpers, latency):
+    """helpers with each coroutine function wrapped to record its duration, labelled by key."""
+    return {
+        name: timed(helper, latency.labels(name)) if inspect.iscoroutinefunction(helper) else helper
+        for name, helper in helpers.items()
+    }
+
+
+class TelegramRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call by method and status code and counts 429s.
+
+    Each call is also a 'bot_api.<method>' span under the update being handled.
+    """
+
+    __slots__ = ('latency', 'flood_waits')
+
+    def __init__(self, latency, flood_waits, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.flood_waits = flood_waits
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        code = 'error'
+        try:
+            with tracing.tracer.span(f"bot_api.{api_method}") as span:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+                span.set('code', code)
+            return code, payload
+        finally:
+            self.latency.labels(api_method, str(code)).observe(time.perf_counter() - started)
+            if code == 429:
+                self.flood_waits.inc()
+
+
+class LoopLagMonitor:
+    """Sleeps interval at a time and records how late the event loop wakes it up."""
+
+    def __init__(self, histogram, interval=0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self.last = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - expected)
+            self.histogram.observe(self.last)
+
+
+def metrics_server(registry, host='127.0.0.1', port=9101):
+    server = httpserver.HTTPServer(host, port)
+
+    async def scrape(request):
+        return httpserver.Response(200, registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    server.route('GET', '/metrics', scrape)
+    return server
@@ -0,0 +1,309 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import contextvars
+from datetime import timedelta
+from telegram.error import RetryAfter
+
+logger = logging.getLogger('drive_ops')
+
+PRIORITY_CONFIRMATION = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_DEFAULT = 2
+PRIORITY_MENU = 3
+
+
+class SendDropped(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Job:
+    __slots__ = ('chat_id', 'send', 'priority', 'coalesce_key', 'future', 'attempts', 'enqueued_at', 'seq', 'context',
+                 'waiters', 'taken')
+
+    def __init__(self, chat_id, send, priority, coalesce_key, future, enqueued_at):
+        self.seq = None
+        self.chat_id = chat_id
+        self.send = send
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = enqueued_at
+        self.waiters = 1
+        self.taken = False
+        # The submitter's context, so the send runs under its trace span.
+        self.context = contextvars.copy_context()
+
+
+class SendScheduler:
+    """Outbound Bot API scheduler with global and per-chat token buckets and priority lanes.
+
+    Calls are queued as zero-argument coroutine factories. Pending calls that share a
+    coalesce_key (e.g. edits of one message) collapse into the latest one, and 429
+    responses pause the affected chat for retry_after before the call is retried.
+
+    Each chat keeps its own priority queue. A chat whose bucket is empty waits in a heap
+    keyed by the time its next token arrives; once that time passes, the chat's first
+    call moves to the ready heap, ordered by priority. Picking the next call therefore
+    never walks past rate-limited chats.
+    """
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, max_queue=10000,
+                 max_retries=3, max_in_flight=30, clock=time.monotonic):
+        self.clock = clock
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._chat_buckets = {}
+        self._chats = {}
+        self._ready = []
+        self._waiting = []
+        self._waiting_chats = set()
+        self._depth = 0
+        self._seq = itertools.count()
+        self._pending_keys = {}
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._task = None
+        self._started_at = clock()
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, self.clock)
+        return bucket
+
+    def _push(self, job):
+        if job.seq is None:
+            job.seq = next(self._seq)
+        entry = (job.priority, job.seq, job)
+        queue = self._chats.setdefault(job.chat_id, [])
+        heapq.heappush(queue, entry)
+        self._depth += 1
+        if job.chat_id not in self._waiting_chats and queue[0] is entry:
+            heapq.heappush(self._ready, (job.priority, job.seq, job.chat_id))
+        self._wakeup.set()
+
+    def _schedule(self, chat_id, now):
+        """Queue the chat's first call as ready, or park the chat until its bucket refills."""
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._chats.pop(chat_id, None)
+            return
+        delay = self._bucket(chat_id).delay(now)
+        if delay > 0:
+            self._waiting_chats.add(chat_id)
+            heapq.heappush(self._waiting, (now + delay, chat_id))
+        else:
+            priority, seq, _ = queue[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+    def _drop_done(self, queue):
+        while queue and queue[0][2].future.done():
+            heapq.heappop(queue)
+            self._depth -= 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in self._chats.values():
+            for _, _, job in queue:
+                if not job.future.done():
+                    job.future.set_exception(SendDropped("Scheduler stopped"))
+        self._chats.clear()
+        self._ready.clear()
+        self._waiting.clear()
+        self._waiting_chats.clear()
+        self._depth = 0
+        self._pending_keys.clear()
+
+    async def submit(self, chat_id, send, priority=PRIORITY_DEFAULT, coalesce_key=None):
+        self.start()
+        self.submitted += 1
+
+        if coalesce_key is not None:
+            pending = self._pending_keys.get(coalesce_key)
+            if pending is not None:
+                pending.send = send
+                pending.context = contextvars.copy_context()
+                pending.waiters += 1
+                self.coalesced += 1
+                return await self._wait(pending)
+
+        if self._depth >= self.max_queue:
+            self.dropped += 1
+            raise SendDropped(f"Outbound queue is full ({self.max_queue})")
+
+        job = _Job(chat_id, send, priority, coalesce_key, asyncio.get_running_loop().create_future(), self.clock())
+        if coalesce_key is not None:
+            self._pending_keys[coalesce_key] = job
+        self._push(job)
+        return await self._wait(job)
+
+    async def _wait(self, job):
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            job.waiters -= 1
+            if not job.waiters and not job.taken and not job.future.done():
+                # Nobody wants it any more: the queue skips it instead of sending.
+                job.future.cancel()
+                if job.coalesce_key is not None and self._pending_keys.get(job.coalesce_key) is job:
+                    del self._pending_keys[job.coalesce_key]
+                self.cancelled += 1
+            raise
+
+    def _take_ready(self, now):
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            return None, wait
+
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            self._waiting_chats.discard(chat_id)
+            self._schedule(chat_id, now)
+
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._chats.get(chat_id)
+            if chat_id in self._waiting_chats or not queue or queue[0][1] != seq:
+                continue  # superseded by a later entry for this chat
+            if queue[0][2].future.done():
+                self._drop_done(queue)
+                self._schedule(chat_id, now)
+                continue
+            bucket = self._bucket(chat_id)
+            if bucket.delay(now) > 0:
+                # Flood control paused the chat after this entry was queued.
+                self._schedule(chat_id, now)
+                continue
+            _, _, job = heapq.heappop(queue)
+            self._depth -= 1
+            self.global_bucket.consume(now)
+            bucket.consume(now)
+            self._drop_done(queue)
+            self._schedule(chat_id, now)
+            return job, 0.0
+
+        return None, (self._waiting[0][0] - now) if self._waiting else None
+
+    async def _run(self):
+        while True:
+            job, wait = self._take_ready(self.clock())
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job.taken = True
+            if job.coalesce_key is not None and self._pending_keys.get(job.coalesce_key) is job:
+                del self._pending_keys[job.coalesce_key]
+            await self._in_flight.acquire()
+            asyncio.get_running_loop().create_task(self._deliver(job), context=job.context)
+
+            if len(self._chat_buckets) > 10000:
+                self._evict_idle_buckets()
+
+    async def _deliver(self, job):
+        try:
+            job.attempts += 1
+            self.wait_total += self.clock() - job.enqueued_at
+            result = await job.send()
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+            self._bucket(job.chat_id).block(self.clock(), seconds)
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                logger.warning("Flood control for chat %s, retrying in %ss", job.chat_id, seconds)
+                job.taken = False
+                self._push(job)
+            else:
+                self.dropped += 1
+                job.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            job.future.set_exception(e)
+        else:
+            self.sent += 1
+            job.future.set_result(result)
+        finally:
+            self._in_flight.release()
+
+    def _evict_idle_buckets(self):
+        now = self.clock()
+        for chat_id in [c for c, bucket in self._chat_buckets.items() if bucket.idle(now)]:
+            del self._chat_buckets[chat_id]
+
+    def stats(self):
+        uptime = max(self.clock() - self._started_at, 1e-9)
+        return {
+            'queue_depth': self._depth,
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'retried': self.retried,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'sent_per_sec': self.sent / uptime,
+            'drop_rate': self.dropped / self.submitted if self.submitted else 0.0,
+            'avg_queue_wait_ms': (self.wait_total / (self.sent + self.failed) * 1000) if self.sent + self.failed else 0.0,
+        }
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+
+from session_store import DEFAULT_DB_TIMEOUT
+from trip_submit import RETRY_STATUSES
+
+logger = logging.getLogger('drive_ops')
+
+DEFAULT_OUTBOX_PATH = os.path.join(os.path.dirname(__file__), 'data', 'outbox.db')
+
+
+class TripOutbox:
+    """Durable queue of confirmed orders the Trip Service could not take yet.
+
+    Entries are rows in a WAL-mode SQLite file, so they survive restarts and can be
+    shared by the gateway workers of one host. A background drainer picks up due entries
+    and resubmits them with bounded concurrency under their original request_id, then
+    reports the outcome through on_result so the passenger's
+    message can be edited. Picking entries leases them for lease seconds, renewed every
+    lease/3 while the submission runs however long its retries take, so two workers do
+    not submit the same entry at once and an entry survives a crash mid-delivery.
+    Only orders the Trip Service certainly did not take (503, no connection, open
+    circuit) are queued and deferred, so a resubmission cannot create a second trip.
+    Entries still undeliverable after max_age are given up and reported as failed.
+    """
+
+    def __init__(self, submit, on_result, path=DEFAULT_OUTBOX_PATH, concurrency=4, batch_size=50,
+                 poll_interval=1.0, retry_delay=2.0, retry_max=60.0, max_age=600.0, lease=30.0,
+                 clock=time.time, timeout=DEFAULT_DB_TIMEOUT):
+        self.submit = submit
+        self.on_result = on_result
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.retry_max = retry_max
+        self.max_age = max_age
+        self.lease = lease
+        self.clock = clock
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Runs on the event loop: wait for another worker's write for at most timeout seconds.
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trip_outbox ("
+            " request_id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, message_id INTEGER,"
+            " payload TEXT NOT NULL, enqueued_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS trip_outbox_due ON trip_outbox (next_attempt_at)")
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.context = None
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.deferred = 0
+        self.age_total = 0.0
+        self.age_max = 0.0
+        self._started_at = clock()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM trip_outbox").fetchone()[0]
+
+    def add(self, request_id, chat_id, message_id, payload):
+        """Persist a confirmed order; adding the same request_id twice keeps the first entry."""
+        now = self.clock()
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO trip_outbox (request_id, chat_id, message_id, payload, enqueued_at, next_attempt_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (request_id, chat_id, message_id, json.dumps(payload, ensure_ascii=False), now, now + self.retry_delay),
+        )
+        if cur.rowcount:
+            self.enqueued += 1
+            logger.info("Trip request %s queued in outbox for chat_id=%s", request_id, chat_id)
+        self._wakeup.set()
+
+    def take_due(self, limit=None):
+        """Lease and return up to limit entries whose next attempt is due."""
+        now = self.clock()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._conn.execute(
+                "SELECT request_id, chat_id, message_id, payload, enqueued_at, attempts FROM trip_outbox"
+                " WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit or self.batch_size),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE trip_outbox SET next_attempt_at = ? WHERE request_id = ?",
+                [(now + self.lease, row[0]) for row in rows],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return [
+            {'request_id': r[0], 'chat_id': r[1], 'message_id': r[2], 'payload': json.loads(r[3]),
+             'enqueued_at': r[4], 'attempts': r[5]}
+            for r in rows
+        ]
+
+    def _remove(self, request_id):
+        self._conn.execute("DELETE FROM trip_outbox WHERE request_id = ?", (request_id,))
+
+    def _defer(self, entry):
+        attempts = entry['attempts'] + 1
+        delay = min(self.retry_max, self.retry_delay * 2 ** attempts)
+        self._conn.execute(
+            "UPDATE trip_outbox SET attempts = ?, next_attempt_at = ? WHERE request_id = ?",
+            (attempts, self.clock() + delay, entry['request_id']),
+        )
+        self.deferred += 1
+
+    async def _renew_lease(self, request_id):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                self._conn.execute("UPDATE trip_outbox SET next_attempt_at = ? WHERE request_id = ?",
+                                   (self.clock() + self.lease, request_id))
+            except sqlite3.Error as e:
+                logger.warning("Could not renew the outbox lease of %s: %s", request_id, e)
+
+    async def deliver(self, entry):
+        async with self._semaphore:
+            renewal = asyncio.ensure_future(self._renew_lease(entry['request_id']))
+            try:
+                result = await self.submit(entry['request_id'], entry['payload'])
+            except Exception as e:
+                logger.exception("Outbox delivery of %s failed: %s", entry['request_id'], e)
+                result = None
+            finally:
+                renewal.cancel()
+
+            age = self.clock() - entry['enqueued_at']
+            status_code = ((result or {}).get('error') or {}).get('status_code')
+            if result is None or (not result.get('success') and status_code in RETRY_STATUSES):
+                if age < self.max_age:
+                    self._defer(entry)
+                    return
+                logger.error("Giving up on queued trip request %s after %.0fs", entry['request_id'], age)
+
+            self._remove(entry['request_id'])
+            if result is not None and result.get('success'):
+                self.delivered += 1
+                self.age_total += age
+                self.age_max = max(self.age_max, age)
+            else:
+                self.failed += 1
+            try:
+                await self.on_result(entry, result, self.context)
+            except Exception as e:
+                logger.exception("Failed to report queued trip request %s: %s", entry['request_id'], e)
+
+    async def drain_once(self):
+        entries = self.take_due()
+        if entries:
+            await asyncio.gather(*(self.deliver(entry) for entry in entries))
+        return len(entries)
+
+    async def _drain(self):
+        while True:
+            try:
+                if await self.drain_once():
+                    continue
+            except sqlite3.OperationalError as e:
+                # Locked by another worker for longer than timeout: try again on the next poll.
+                logger.warning("Outbox drain skipped: %s", e)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, context):
+        self.context = context
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def close(self):
+        self._conn.close()
+
+    def stats(self):
+        oldest = self._conn.execute("SELECT MIN(enqueued_at) FROM trip_outbox").fetchone()[0]
+        uptime = max(self.clock() - self._started_at, 1e-9)
+        return {
+            'queued': len(self),
+            'oldest_age_s': self.clock() - oldest if oldest is not None else 0.0,
+            'enqueued': self.enqueued,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'deferred': self.deferred,
+            'delivered_per_min': self.delivered / uptime * 60,
+            'queue_age_avg_s': self.age_total / self.delivered if self.delivered else 0.0,
+            'queue_age_max_s': self.age_max,
+        }
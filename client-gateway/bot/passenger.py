@@ -1,26 +1,103 @@
-<<<<<<< HEAD
 import logging
 import re
+import uuid
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
 from telegram.ext import MessageHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, filters, CommandHandler
+from outbound import PRIORITY_CONFIRMATION, PRIORITY_MENU
+from fares import rates_text
+from keyboards import markups
+from records import Order, Role, Step
+from routing import UpdateRouter
 
 logger = logging.getLogger('drive_ops')
+# Per-step chatter; sampled before it reaches the log files.
+step_logger = logging.getLogger('drive_ops.steps')
 
 # Conversation states
-PICKUP, DROPOFF, COMMENT = range(3)
+PICKUP, DROPOFF, COMMENT = Step
+
+STATUS_TEXT = {
+    'PENDING': '⏳ Очікує водія',
+    'CONFIRMED': '✅ Підтверджено',
+    'IN_PROGRESS': '🚗 В дорозі',
+    'COMPLETED': '🏁 Завершено',
+    'CANCELLED': '❌ Скасовано',
+}
+
+
+def format_trip_status(trip_id, status):
+    status = (status or 'PENDING').upper()
+    return (
+        "\u2705 **Замовлення прийнято!**\n"
+        + ("Шукаємо найближче авто...\n" if status == 'PENDING' else "")
+        + f"\n\U0001F194 Trip ID: {trip_id}\n"
+        f"\U0001F4E6 Статус: {STATUS_TEXT.get(status, status)}"
+    )
 
 
-def register_handlers(application, user_orders, user_roles, buttons, keyboards, helpers):
-=======
-import time
-import logging
-from telebot import types
+def format_trip_failure(result):
+    error = result.get('error') or {}
+    code = error.get('status_code')
+    return (
+        "\u274C **Не вдалося створити поїздку.**\n"
+        f"Причина: {error.get('message') or 'сервіс недоступний.'}\n"
+        + (f"Код: {code}\n" if code is not None else "")
+        + f"\nЛокальний запит: {result.get('request_id')}"
+    )
 
-logger = logging.getLogger('drive_ops')
 
+def format_trip_queued(request_id):
+    return (
+        "\u23F3 **Сервіс поїздок тимчасово недоступний.**\n"
+        "Замовлення збережено і буде надіслано автоматично, щойно сервіс відновиться. "
+        "Ми оновимо це повідомлення.\n"
+        f"\nЛокальний запит: {request_id}"
+    )
+
+
+# The shown status rides in the button, so a refresh that finds it unchanged needs no edit.
+TRIP_REFRESH_MARKUP = markups.template('trip_refresh', InlineKeyboardMarkup([
+    [InlineKeyboardButton("\U0001F504 Оновити статус", callback_data="trip_refresh:{status}:{trip_id}")]
+]))
+FINAL_STATUSES = ('COMPLETED', 'CANCELLED')
+
+
+def trip_status_markup(trip_id, status):
+    """Refresh button under a trip's status message; None once the trip is over."""
+    status = (status or 'PENDING').upper()
+    if status in FINAL_STATUSES:
+        return None
+    return TRIP_REFRESH_MARKUP.render(status=status, trip_id=trip_id)
+
+
+QUICK_ORDER_MARKUP = markups.static('quick_order', InlineKeyboardMarkup([
+    [InlineKeyboardButton("\U0001F695 Замовити таксі зараз", callback_data="quick_order_taxi")]
+]))
+CONFIRM_ORDER_MARKUP = markups.static('confirm_order', InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("\u2705 Підтвердити", callback_data="order_confirm"),
+        InlineKeyboardButton("\u274C Скасувати", callback_data="order_cancel")
+    ]
+]))
+
+DROPOFF_PROMPT = "\U0001F3C1 **Крок 2/3**: Куди їдемо? (Введіть адресу призначення):"
+COMMENT_PROMPT = "\U0001F4AC **Крок 3/3**: Додайте коментар (під'їзд, дитяче крісло тощо) або натисніть кнопку нижче:"
 
-def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers):
->>>>>>> main
+
+def new_order(chat_id):
+    # request_id doubles as the Trip Service idempotency key, so it is fixed for the order's lifetime.
+    return Order(step=Step.PICKUP, request_id=f"REQ-{chat_id}-{uuid.uuid4().hex[:12]}")
+
+
+def address_choices(field, suggestions, allow_typed):
+    rows = [[InlineKeyboardButton(f"\U0001F4CD {text}", callback_data=f"addr_{field}_{i}")]
+            for i, text in enumerate(suggestions)]
+    if allow_typed:
+        rows.append([InlineKeyboardButton("\u270F\uFE0F Залишити як є", callback_data=f"addr_{field}_typed")])
+    return InlineKeyboardMarkup(rows)
+
+
+def register_handlers(application, user_orders, user_roles, buttons, keyboards, helpers):
     
     BTN_PASSENGER = buttons['BTN_PASSENGER']
     BTN_ORDER_TAXI = buttons['BTN_ORDER_TAXI']
@@ -32,68 +109,60 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
     get_user_menu = keyboards['get_user_menu']
     
     safe_send = helpers['safe_send']
-<<<<<<< HEAD
+    safe_edit_message_text = helpers['safe_edit_message_text']
+    safe_edit_message_reply_markup = helpers['safe_edit_message_reply_markup']
     submit_trip_request = helpers['submit_trip_request']
     is_valid_address = helpers['is_valid_address']
+    trip_status = helpers.get('trip_status')
+    fares = helpers.get('fares')
+    addresses = helpers.get('addresses')
+    queue_trip_request = helpers.get('queue_trip_request')
+    trips = helpers.get('trips')
     
+    async def user_menu(chat_id):
+        return get_user_menu(await user_roles.aget(chat_id))
+
     async def select_passenger_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        user_roles[chat_id] = 'passenger'
-        markup = InlineKeyboardMarkup([
-            [InlineKeyboardButton("\U0001F695 Замовити таксі зараз", callback_data="quick_order_taxi")]
-        ])
-        
-        await update.message.reply_text(
-=======
-    validate_address_and_retry = helpers['validate_address_and_retry']
-    submit_trip_request = helpers['submit_trip_request']
-    
-    @bot.message_handler(func=lambda message: message.text == BTN_PASSENGER)
-    def select_passenger_role(message):
-        chat_id = message.chat.id
-        user_roles[chat_id] = 'passenger'
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("\U0001F695 Замовити таксі зараз", callback_data="quick_order_taxi"))
-        
-        bot.send_message(
+        await user_roles.aset(chat_id, Role.PASSENGER)
+        await safe_send(
             chat_id,
->>>>>>> main
             "\u2705 Ви обрали роль: Замовник\n\n"
             "\U0001F697 Готові замовити таксі? Натисніть кнопку нижче або скористайтесь меню:",
-            reply_markup=markup
+            context,
+            reply_markup=QUICK_ORDER_MARKUP
         )
-<<<<<<< HEAD
-        await update.message.reply_text("Меню:", reply_markup=passenger_menu())
+        await safe_send(chat_id, "Меню:", context, priority=PRIORITY_MENU, reply_markup=passenger_menu())
 
     async def show_rates(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
-            "\U0001F695 Тариф 'Стандарт': 15 грн/км\n\U0001F3E2 Тариф 'Комфорт': 25 грн/км"
-        )
+        await safe_send(update.effective_chat.id, rates_text(), context)
 
     async def cancel_order_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        if chat_id in user_orders:
-            user_orders.pop(chat_id, None)
-            await safe_send(chat_id, "\u274C Ваше незавершене замовлення скасовано.", context, reply_markup=get_user_menu(chat_id))
+        if await user_orders.apop(chat_id) is not None:
+            await safe_send(chat_id, "\u274C Ваше незавершене замовлення скасовано.", context, reply_markup=await user_menu(chat_id))
         else:
-            await safe_send(chat_id, "У вас немає активного незавершеного замовлення.", context, reply_markup=get_user_menu(chat_id))
+            await safe_send(chat_id, "У вас немає активного незавершеного замовлення.", context, reply_markup=await user_menu(chat_id))
         return ConversationHandler.END
 
     async def start_order_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
-        if chat_id not in user_roles:
-            await update.message.reply_text("Спочатку оберіть вашу роль за допомогою команди /start")
+        if not await user_roles.acontains(chat_id):
+            await safe_send(chat_id, "Спочатку оберіть вашу роль за допомогою команди /start", context)
             return ConversationHandler.END
 
-        if chat_id in user_orders and user_orders[chat_id].get('_in_progress'):
-            await update.message.reply_text("У вас вже є незавершене замовлення. Скасуйте командою /cancel_order або завершіть поточне.")
+        current = await user_orders.aget(chat_id)
+        if current and current.get('_in_progress'):
+            await safe_send(chat_id, "У вас вже є незавершене замовлення. Скасуйте командою /cancel_order або завершіть поточне.", context)
             return ConversationHandler.END
 
-        user_orders[chat_id] = {'pickup': None, 'dropoff': None, 'comment': None, '_in_progress': True}
+        await user_orders.aset(chat_id, new_order(chat_id))
         
-        await update.message.reply_text(
+        await safe_send(
+            chat_id,
             "\U0001F4CD **Крок 1/3**: Введіть адресу відправлення (напр. вул. Хрещатик, 1):",
+            context,
             parse_mode='Markdown',
             reply_markup=ReplyKeyboardRemove()
         )
@@ -102,148 +171,134 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
     async def process_pickup_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
-        if chat_id not in user_orders or not user_orders.get(chat_id):
-            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=get_user_menu(chat_id))
+        order = await user_orders.aget(chat_id)
+        if not order:
+            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=await user_menu(chat_id))
             return ConversationHandler.END
         
-        address = update.message.text
+        address = await resolve_address(update, context, chat_id, order, 'pickup', "\U0001F50E Уточніть адресу відправлення:")
+        if address is None:
+            return PICKUP
 
         if not is_valid_address(address):
-            await update.message.reply_text("\u274C Адреса занадто коротка. Спробуйте ще раз:")
+            await safe_send(chat_id, "\u274C Адреса занадто коротка. Спробуйте ще раз:", context)
             return PICKUP
 
-        user_orders[chat_id]['pickup'] = address
-        await update.message.reply_text(
-            "\U0001F3C1 **Крок 2/3**: Куди їдемо? (Введіть адресу призначення):",
-            parse_mode='Markdown'
-        )
+        order['pickup'] = address
+        order['step'] = DROPOFF
+        await user_orders.aset(chat_id, order)
+        await safe_send(chat_id, DROPOFF_PROMPT, context, parse_mode='Markdown')
         return DROPOFF
 
     async def process_dropoff_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
-        if chat_id not in user_orders or not user_orders.get(chat_id):
-            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=get_user_menu(chat_id))
+        order = await user_orders.aget(chat_id)
+        if not order:
+            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=await user_menu(chat_id))
             return ConversationHandler.END
         
-        address = update.message.text
+        address = await resolve_address(update, context, chat_id, order, 'dropoff', "\U0001F50E Уточніть адресу призначення:")
+        if address is None:
+            return DROPOFF
 
         if not is_valid_address(address):
-            await update.message.reply_text("\u274C Будь ласка, вкажіть повну адресу призначення:")
+            await safe_send(chat_id, "\u274C Будь ласка, вкажіть повну адресу призначення:", context)
             return DROPOFF
 
-        user_orders[chat_id]['dropoff'] = address
-        await update.message.reply_text(
-=======
-        bot.send_message(chat_id, "Меню:", reply_markup=passenger_menu())
+        order['dropoff'] = address
+        order['step'] = COMMENT
+        await user_orders.aset(chat_id, order)
+        await safe_send(chat_id, COMMENT_PROMPT, context, reply_markup=skip_menu(), parse_mode='Markdown')
+        return COMMENT
 
-    @bot.message_handler(func=lambda message: message.text == BTN_RATES)
-    def show_rates(message):
-        bot.send_message(
-            message.chat.id,
-            "\U0001F695 Тариф 'Стандарт': 15 грн/км\n\U0001F3E2 Тариф 'Комфорт': 25 грн/км"
+    async def resolve_address(update, context, chat_id, order, field, question):
+        """The address to use for the typed text, or None after offering suggestions to pick from."""
+        typed = update.message.text
+        if addresses is None:
+            return typed
+        known = addresses.normalize(typed)
+        if known is not None:
+            return known
+        suggestions = addresses.suggest(typed)
+        if not suggestions:
+            return typed
+
+        order['_typed'] = typed
+        order['_suggestions'] = suggestions
+        await user_orders.aset(chat_id, order)
+        await safe_send(
+            chat_id, question, context, reply_markup=address_choices(field, suggestions, is_valid_address(typed))
         )
+        return None
 
-    @bot.message_handler(commands=['cancel_order'])
-    def cancel_order_command(message):
-        chat_id = message.chat.id
-        if chat_id in user_orders:
-            user_orders.pop(chat_id, None)
-            safe_send(chat_id, "\u274C Ваше незавершене замовлення скасовано.", reply_markup=get_user_menu(chat_id))
-        else:
-            safe_send(chat_id, "У вас немає активного незавершеного замовлення.", reply_markup=get_user_menu(chat_id))
-
-    def process_pickup_step(message):
-        chat_id = message.chat.id
-        
-        if chat_id not in user_orders or not user_orders.get(chat_id):
-            safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", reply_markup=get_user_menu(chat_id))
-            return
-        
-        address = message.text
-
-        if not validate_address_and_retry(chat_id, address, "\u274C Адреса занадто коротка. Спробуйте ще раз:", process_pickup_step):
-            return
-
-        user_orders[chat_id]['pickup'] = address
-        msg = bot.send_message(chat_id, "\U0001F3C1 **Крок 2/3**: Куди їдемо? (Введіть адресу призначення):", parse_mode='Markdown')
-        bot.register_next_step_handler(msg, process_dropoff_step)
-
-    def process_dropoff_step(message):
-        chat_id = message.chat.id
-        
-        if chat_id not in user_orders or not user_orders.get(chat_id):
-            safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", reply_markup=get_user_menu(chat_id))
-            return
-        
-        address = message.text
+    async def choose_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
 
-        if not validate_address_and_retry(chat_id, address, "\u274C Будь ласка, вкажіть повну адресу призначення:", process_dropoff_step):
-            return
+        chat_id = query.message.chat.id
+        _, field, choice = query.data.split('_', 2)
+        current_state = PICKUP if field == 'pickup' else DROPOFF
+        order = await user_orders.aget(chat_id)
+        if not order:
+            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=await user_menu(chat_id))
+            return ConversationHandler.END
 
-        user_orders[chat_id]['dropoff'] = address
-        msg = bot.send_message(
-            chat_id, 
->>>>>>> main
-            "\U0001F4AC **Крок 3/3**: Додайте коментар (під'їзд, дитяче крісло тощо) або натисніть кнопку нижче:", 
-            reply_markup=skip_menu(),
-            parse_mode='Markdown'
-        )
-<<<<<<< HEAD
+        suggestions = order.get('_suggestions') or []
+        if choice == 'typed':
+            address = order.get('_typed')
+        elif choice.isdigit() and int(choice) < len(suggestions):
+            address = suggestions[int(choice)]
+        else:
+            address = None
+        if not address:
+            return current_state
+
+        order.pop('_typed', None)
+        order.pop('_suggestions', None)
+        order[field] = address
+        order['step'] = DROPOFF if field == 'pickup' else COMMENT
+        await user_orders.aset(chat_id, order)
+        await safe_edit_message_text(chat_id, query.message.message_id, f"\U0001F4CD {address}", context)
+
+        if field == 'pickup':
+            await safe_send(chat_id, DROPOFF_PROMPT, context, parse_mode='Markdown')
+            return DROPOFF
+        await safe_send(chat_id, COMMENT_PROMPT, context, reply_markup=skip_menu(), parse_mode='Markdown')
         return COMMENT
 
     async def process_comment_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        logger.info("process_comment_step called for chat_id=%s, text=%s", chat_id, update.message.text)
+        step_logger.info("process_comment_step called for chat_id=%s, text=%s", chat_id, update.message.text)
         
-        if chat_id not in user_orders or not user_orders.get(chat_id):
+        order = await user_orders.aget(chat_id)
+        if not order:
             logger.warning("No active order for chat_id=%s in process_comment_step", chat_id)
-            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=get_user_menu(chat_id))
+            await safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", context, reply_markup=await user_menu(chat_id))
             return ConversationHandler.END
         
         if update.message.text == BTN_SKIP:
-            user_orders[chat_id]['comment'] = "Не вказано"
+            order['comment'] = "Не вказано"
         else:
-            user_orders[chat_id]['comment'] = update.message.text
-
-        order = user_orders[chat_id]
-        logger.info("Order data: pickup=%s, dropoff=%s, comment=%s", order.get('pickup'), order.get('dropoff'), order.get('comment'))
-        
-=======
-        bot.register_next_step_handler(msg, process_comment_step)
+            order['comment'] = update.message.text
+        await user_orders.aset(chat_id, order)
 
-    def process_comment_step(message):
-        chat_id = message.chat.id
+        step_logger.info("Order data: pickup=%s, dropoff=%s, comment=%s", order.get('pickup'), order.get('dropoff'), order.get('comment'))
         
-        if chat_id not in user_orders or not user_orders.get(chat_id):
-            safe_send(chat_id, "❌ Замовлення скасовано або закінчилось. Спробуйте знову.", reply_markup=get_user_menu(chat_id))
-            return
-        
-        if message.text == BTN_SKIP:
-            user_orders[chat_id]['comment'] = "Не вказано"
-        else:
-            user_orders[chat_id]['comment'] = message.text
-
-        order = user_orders[chat_id]
->>>>>>> main
+        quote = await fares.estimate(order['pickup'], order['dropoff']) if fares is not None else None
         summary = (
             f"\U0001F695 **Підтвердження замовлення**\n\n"
             f"\U0001F4CD **Звідки:** {order['pickup']}\n"
             f"\U0001F3C1 **Куди:** {order['dropoff']}\n"
             f"\U0001F4AC **Коментар:** {order['comment']}\n\n"
-            f"\U0001F4B0 *Вартість буде розрахована після підтвердження.*"
         )
+        if quote is not None:
+            summary += f"\U0001F4B0 **Орієнтовна вартість:**\n{quote.text()}"
+        else:
+            summary += "\U0001F4B0 *Вартість буде розрахована після підтвердження.*"
 
-<<<<<<< HEAD
-        markup = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("\u2705 Підтвердити", callback_data="order_confirm"),
-                InlineKeyboardButton("\u274C Скасувати", callback_data="order_cancel")
-            ]
-        ])
-        
-        logger.info("Sending confirmation message to chat_id=%s", chat_id)
-        await update.message.reply_text(summary, parse_mode='Markdown', reply_markup=markup)
+        step_logger.info("Sending confirmation message to chat_id=%s", chat_id)
+        await safe_send(chat_id, summary, context, parse_mode='Markdown', reply_markup=CONFIRM_ORDER_MARKUP)
         return ConversationHandler.END
 
     async def handle_quick_order_taxi(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -252,24 +307,23 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
         
         chat_id = query.message.chat.id
         
-        try:
-            await query.edit_message_reply_markup(reply_markup=None)
-        except Exception as e:
-            logger.exception("Failed to clear inline keyboard markup for quick_order_taxi: %s", e)
+        await safe_edit_message_reply_markup(chat_id, query.message.message_id, None, context)
         
-        if chat_id not in user_roles:
-            await context.bot.send_message(chat_id, "Спочатку оберіть вашу роль за допомогою команди /start")
+        if not await user_roles.acontains(chat_id):
+            await safe_send(chat_id, "Спочатку оберіть вашу роль за допомогою команди /start", context)
             return ConversationHandler.END
 
-        if chat_id in user_orders and user_orders[chat_id].get('_in_progress'):
-            await context.bot.send_message(chat_id, "У вас вже є незавершене замовлення. Скасуйте командою /cancel_order або завершіть поточне.")
+        current = await user_orders.aget(chat_id)
+        if current and current.get('_in_progress'):
+            await safe_send(chat_id, "У вас вже є незавершене замовлення. Скасуйте командою /cancel_order або завершіть поточне.", context)
             return ConversationHandler.END
 
-        user_orders[chat_id] = {'pickup': None, 'dropoff': None, 'comment': None, '_in_progress': True}
+        await user_orders.aset(chat_id, new_order(chat_id))
         
-        await context.bot.send_message(
-            chat_id, 
+        await safe_send(
+            chat_id,
             "\U0001F4CD **Крок 1/3**: Введіть адресу відправлення (напр. вул. Хрещатик, 1):",
+            context,
             parse_mode='Markdown',
             reply_markup=ReplyKeyboardRemove()
         )
@@ -279,77 +333,18 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
         query = update.callback_query
         await query.answer()
 
+        chat_id = query.message.chat.id
+        order = await user_orders.aget(chat_id)
         try:
             if query.data == "order_confirm":
-                chat_id = query.message.chat.id
-                order = user_orders.get(chat_id) or {}
-=======
-        markup = types.InlineKeyboardMarkup()
-        markup.add(
-            types.InlineKeyboardButton("\u2705 Підтвердити", callback_data="order_confirm"),
-            types.InlineKeyboardButton("\u274C Скасувати", callback_data="order_cancel")
-        )
-        
-        bot.send_message(chat_id, summary, parse_mode='Markdown', reply_markup=markup)
-
-    def start_order_flow(chat_id):
-        if chat_id not in user_roles:
-            safe_send(chat_id, "Спочатку оберіть вашу роль за допомогою команди /start")
-            return
-
-        if chat_id in user_orders and user_orders[chat_id].get('_in_progress'):
-            safe_send(chat_id, "У вас вже є незавершене замовлення. Скасуйте командою /cancel_order або завершіть поточне.")
-            return
-
-        user_orders[chat_id] = {'pickup': None, 'dropoff': None, 'comment': None, '_in_progress': True}
-        
-        msg = bot.send_message(
-            chat_id, 
-            "\U0001F4CD **Крок 1/3**: Введіть адресу відправлення (напр. вул. Хрещатик, 1):",
-            parse_mode='Markdown',
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        bot.register_next_step_handler(msg, process_pickup_step)
-
-    @bot.message_handler(func=lambda message: message.text == BTN_ORDER_TAXI)
-    def start_order(message):
-        start_order_flow(message.chat.id)
-
-    @bot.callback_query_handler(func=lambda call: call.data == 'quick_order_taxi')
-    def handle_quick_order_taxi(call):
-        try:
-            bot.answer_callback_query(call.id)
-        except Exception:
-            pass
-        
-        chat_id = call.message.chat.id
-        
-        try:
-            bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id, reply_markup=None)
-        except Exception:
-            pass
-        
-        start_order_flow(chat_id)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('order_'))
-    def handle_order_status(call):
-        try:
-            bot.answer_callback_query(call.id)
-        except Exception:
-            pass
-
-        try:
-            if call.data == "order_confirm":
-                chat_id = call.message.chat.id
-                order = user_orders.get(chat_id) or {}
-                # Log request before submitting to TripService
->>>>>>> main
+                if not order:
+                    logger.info("Ignoring confirm for an already handled order: chat_id=%s", chat_id)
+                    return
                 logger.info(
                     "Trip request confirmed: chat_id=%s pickup=%s dropoff=%s comment=%s",
                     chat_id, order.get('pickup'), order.get('dropoff'), order.get('comment')
                 )
 
-<<<<<<< HEAD
                 result = await submit_trip_request(chat_id, order)
                 req_id = result.get('request_id')
                 trip_id = result.get('trip_id')
@@ -362,74 +357,66 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
 
                 if result.get('success'):
                     status = result.get('status', 'PENDING').upper()
-                    status_text = {
-                        'PENDING': '⏳ Очікує водія',
-                        'CONFIRMED': '✅ Підтверджено',
-                        'IN_PROGRESS': '🚗 В дорозі',
-                        'COMPLETED': '🏁 Завершено',
-                        'CANCELLED': '❌ Скасовано',
-                    }.get(status, status)
                     
-                    await query.edit_message_text(
-=======
-                result = submit_trip_request(chat_id, order)
-                req_id = result.get('request_id')
-                status = result.get('status', 'created')
-                trip_id = result.get('trip_id')
-                error = result.get('error')
-
-                # Log response from TripService
-                logger.info(
-                    "Trip request response: success=%s trip_id=%s status=%s error=%s",
-                    result.get('success'), trip_id, status, error
-                )
-
-                if result.get('success'):
-                    bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=call.message.message_id,
->>>>>>> main
-                        text=(
-                            "\u2705 **Замовлення прийнято!**\n"
-                            "Шукаємо найближче авто...\n\n"
-                            f"\U0001F194 Trip ID: {trip_id or req_id}\n"
-<<<<<<< HEAD
-                            f"\U0001F4E6 Статус: {status_text}"
-=======
-                            f"\U0001F4E6 Статус: {status}"
->>>>>>> main
-                        ),
+                    await safe_edit_message_text(
+                        chat_id, query.message.message_id,
+                        format_trip_status(trip_id or req_id, status),
+                        context,
+                        priority=PRIORITY_CONFIRMATION,
+                        parse_mode='Markdown',
+                        reply_markup=trip_status_markup(trip_id, status) if trips is not None and trip_id else None
+                    )
+                    if trip_status is not None and trip_id:
+                        trip_status.watch(trip_id, chat_id, query.message.message_id, status)
+                    if addresses is not None:
+                        addresses.learn(order.get('pickup'))
+                        addresses.learn(order.get('dropoff'))
+                elif queue_trip_request is not None and (error or {}).get('status_code') == 503:
+                    queue_trip_request(req_id, chat_id, query.message.message_id, order)
+                    await safe_edit_message_text(
+                        chat_id, query.message.message_id, format_trip_queued(req_id), context,
+                        priority=PRIORITY_CONFIRMATION,
                         parse_mode='Markdown'
                     )
                 else:
-                    err_text = (error or {}).get('message')
-                    code = (error or {}).get('status_code')
-<<<<<<< HEAD
-                    await query.edit_message_text(
-=======
-                    bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=call.message.message_id,
->>>>>>> main
-                        text=(
-                            "\u274C **Не вдалося створити поїздку.**\n"
-                            f"Причина: {err_text or 'сервіс недоступний.'}\n"
-                            + (f"Код: {code}\n" if code is not None else "")
-                            + f"\nЛокальний запит: {req_id}"
-                        ),
+                    await safe_edit_message_text(
+                        chat_id, query.message.message_id, format_trip_failure(result), context,
+                        priority=PRIORITY_CONFIRMATION,
                         parse_mode='Markdown'
                     )
-<<<<<<< HEAD
             elif query.data == "order_cancel":
-                await query.edit_message_text(
-                    text="\u274C **Замовлення скасовано.**",
+                await safe_edit_message_text(
+                    chat_id, query.message.message_id, "\u274C **Замовлення скасовано.**", context,
                     parse_mode='Markdown'
                 )
             
-            chat_id = query.message.chat.id
-            await context.bot.send_message(chat_id, "Головне меню:", reply_markup=get_user_menu(chat_id))
+            await safe_send(chat_id, "Головне меню:", context, priority=PRIORITY_MENU, reply_markup=await user_menu(chat_id))
         finally:
-            user_orders.pop(query.message.chat.id, None)
+            # Only the order this button belonged to: a newer one may have been started meanwhile.
+            current = await user_orders.aget(chat_id) if order else None
+            if current and current.get('request_id') == order.get('request_id'):
+                await user_orders.apop(chat_id)
+
+    async def refresh_trip_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        _, shown, trip_id = query.data.split(':', 2)
+        trip = await trips.get(trip_id)
+        if trip is None:
+            await query.answer("Не вдалося отримати статус. Спробуйте пізніше.")
+            return
+        status = (trip.get('status') or 'PENDING').upper()
+        if status == shown:
+            await query.answer(f"Статус: {STATUS_TEXT.get(status, status)}")
+            return
+        await query.answer()
+        await safe_edit_message_text(
+            query.message.chat.id, query.message.message_id,
+            format_trip_status(trip_id, status),
+            context,
+            priority=PRIORITY_CONFIRMATION,
+            parse_mode='Markdown',
+            reply_markup=trip_status_markup(trip_id, status)
+        )
 
     # Conversation handler for ordering taxi
     conv_handler = ConversationHandler(
@@ -438,28 +425,29 @@ def register_handlers(bot, user_orders, user_roles, buttons, keyboards, helpers)
             CallbackQueryHandler(handle_quick_order_taxi, pattern="^quick_order_taxi$"),
         ],
         states={
-            PICKUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_pickup_step)],
-            DROPOFF: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_dropoff_step)],
+            PICKUP: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_pickup_step),
+                CallbackQueryHandler(choose_address, pattern="^addr_pickup_"),
+            ],
+            DROPOFF: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_dropoff_step),
+                CallbackQueryHandler(choose_address, pattern="^addr_dropoff_"),
+            ],
             COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_comment_step)],
         },
         fallbacks=[CommandHandler("cancel_order", cancel_order_command)],
+        name="order_conversation",
+        persistent=True,
     )
 
-    application.add_handler(MessageHandler(filters.Regex(f"^{re.escape(BTN_PASSENGER)}$"), select_passenger_role))
-    application.add_handler(MessageHandler(filters.Regex(f"^{re.escape(BTN_RATES)}$"), show_rates))
+    router = helpers.get('router')
+    if router is None:
+        router = UpdateRouter()
+        application.add_handler(router)
+    router.on_text(BTN_PASSENGER, select_passenger_role)
+    router.on_text(BTN_RATES, show_rates)
+    router.on_callback("order_", handle_order_status)
+    if trips is not None:
+        router.on_callback("trip_refresh:", refresh_trip_status)
+    # The conversation keeps its own entry points: it has to see them to track the order state.
     application.add_handler(conv_handler)
-    application.add_handler(CallbackQueryHandler(handle_order_status, pattern="^order_"))
-=======
-            elif call.data == "order_cancel":
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="\u274C **Замовлення скасовано.**"
-                )
-            
-            chat_id = call.message.chat.id
-            bot.send_message(chat_id, "Головне меню:", reply_markup=get_user_menu(chat_id))
-        finally:
-            user_orders.pop(call.message.chat.id, None)
-
->>>>>>> main
@@ -0,0 +1,132 @@
+from enum import Enum, IntEnum
+
+
+class Step(IntEnum):
+    """Order conversation states; plain ints to ConversationHandler and its persistence."""
+
+    PICKUP = 0
+    DROPOFF = 1
+    COMMENT = 2
+
+
+class Role(str, Enum):
+    PASSENGER = 'passenger'
+    DRIVER = 'driver'
+
+
+class Record:
+    """Base for slotted session records that still answer the dict API handlers were written against.
+
+    record['pickup'], record.get('comment'), record.pop('typed') and friends map onto
+    attributes; legacy keys are translated through KEYS. An attribute set to None counts
+    as a missing key. to_dict()/from_dict() are what the JSON session stores persist.
+    """
+
+    __slots__ = ()
+    KEYS = {}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def _name(self, key):
+        name = self.KEYS.get(key, key)
+        if name not in self.__slots__ and not isinstance(getattr(type(self), name, None), property):
+            raise KeyError(key)
+        return name
+
+    def __getitem__(self, key):
+        return getattr(self, self._name(key))
+
+    def __setitem__(self, key, value):
+        setattr(self, self._name(key), value)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        name = self.KEYS.get(key, key)
+        prop = getattr(type(self), name, None)
+        if name in self.__slots__ or (isinstance(prop, property) and prop.fset is not None):
+            self[key] = None
+        return value
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        for key, value in data.items():
+            name = cls.KEYS.get(key, key)
+            if name in cls.__slots__:
+                setattr(record, name, value)
+        return record
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Order(Record):
+    """A passenger's order while it is being filled in and confirmed.
+
+    step is the conversation state the order is waiting in, advanced by the passenger
+    handlers as each answer is taken; it stays COMMENT while the summary awaits
+    confirmation. The legacy _in_progress flag reads and writes it: False (or None)
+    clears it, True starts at PICKUP unless a step is already set.
+    """
+
+    __slots__ = ('pickup', 'dropoff', 'comment', 'request_id', 'passenger_id', 'step', 'typed', 'suggestions')
+    KEYS = {'_typed': 'typed', '_suggestions': 'suggestions', '_in_progress': 'in_progress'}
+
+    @property
+    def in_progress(self):
+        return self.step is not None
+
+    @in_progress.setter
+    def in_progress(self, value):
+        if not value:
+            self.step = None
+        elif self.step is None:
+            self.step = Step.PICKUP
+
+    @classmethod
+    def from_dict(cls, data):
+        order = super().from_dict(data)
+        if order.step is not None:
+            order.step = Step(order.step)
+        elif data.get('_in_progress'):
+            order.step = Step.PICKUP
+        return order
+
+
+class SubmitError(Record):
+    __slots__ = ('status_code', 'message')
+
+
+class SubmitResult(Record):
+    """Outcome of a trip submission; error is a SubmitError on failure."""
+
+    __slots__ = ('success', 'trip_id', 'request_id', 'status', 'error', 'raw_response')
+
+    @classmethod
+    def failure(cls, request_id, status_code, message):
+        return cls(success=False, request_id=request_id, status='error',
+                   error=SubmitError(status_code=status_code, message=message))
+
+    def to_dict(self):
+        data = super().to_dict()
+        if self.error is not None:
+            data['error'] = self.error.to_dict()
+        return data
@@ -0,0 +1,92 @@
+from telegram import Update
+from telegram.ext import BaseHandler
+
+
+class _Node:
+    __slots__ = ('children', 'prefix', 'exact')
+
+    def __init__(self):
+        self.children = {}
+        self.prefix = None
+        self.exact = None
+
+
+class UpdateRouter(BaseHandler):
+    """One handler for all button presses: exact reply-button text and callback_data prefixes.
+
+    Button texts are looked up in a dict and callback_data walks a character trie to its
+    longest registered prefix, so the cost of routing an update does not grow with the
+    number of buttons. Updates the router does not know return None from check_update
+    and fall through to the regular handlers registered after it (commands, the order
+    conversation, free-text steps).
+    """
+
+    def __init__(self):
+        super().__init__(self._unrouted)
+        self.texts = {}
+        self._callbacks = _Node()
+        self.routed = 0
+
+    @staticmethod
+    async def _unrouted(update, context):
+        return None
+
+    def on_text(self, text, callback):
+        """Route messages whose text is exactly text (a reply keyboard button)."""
+        self.texts[text] = callback
+
+    def on_callback(self, prefix, callback, exact=False):
+        """Route callback queries whose data starts with prefix, or equals it when exact."""
+        node = self._callbacks
+        for char in prefix:
+            node = node.children.setdefault(char, _Node())
+        if exact:
+            node.exact = callback
+        else:
+            node.prefix = callback
+
+    def wrap_callbacks(self, wrap):
+        """Replace every registered callback with wrap(callback), e.g. to time it."""
+        self.texts = {text: wrap(callback) for text, callback in self.texts.items()}
+        stack = [self._callbacks]
+        while stack:
+            node = stack.pop()
+            if node.prefix is not None:
+                node.prefix = wrap(node.prefix)
+            if node.exact is not None:
+                node.exact = wrap(node.exact)
+            stack.extend(node.children.values())
+
+    def match_callback(self, data):
+        node = self._callbacks
+        found = node.prefix
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                return found
+            found = node.prefix or found
+        return node.exact or found
+
+    @property
+    def update_types(self):
+        types = []
+        if self._callbacks.children:
+            types.append(Update.CALLBACK_QUERY)
+        if self.texts:
+            types.append(Update.MESSAGE)
+        return types
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        query = update.callback_query
+        if query is not None:
+            return self.match_callback(query.data) if query.data else None
+        message = update.message or update.edited_message
+        if message is not None and message.text:
+            return self.texts.get(message.text)
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        self.routed += 1
+        return await check_result(update, context)
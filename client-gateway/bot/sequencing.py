@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger('drive_ops')
+
+
+def chat_key(update):
+    """The chat an update belongs to, or None for updates that have none."""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return ('user', user.id) if user is not None else None
+
+
+class _ChatTurn:
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class ChatSequencer(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently and those of one chat strictly in order.
+
+    Handlers read, check and write a chat's order across awaits (start_order_flow,
+    handle_order_status), so two updates of one chat must never interleave. Each chat
+    with updates in flight gets a lock, taken in arrival order (asyncio.Lock wakes its
+    waiters first in, first out), and dropped as soon as the chat has nothing queued, so
+    idle chats cost nothing.
+
+    At most max_running handlers run at once. Updates waiting for their chat's turn do
+    not hold one of those slots, so a chat that floods the bot cannot starve the others;
+    max_pending bounds how many updates may be admitted in total.
+    """
+
+    def __init__(self, max_running=64, max_pending=10000):
+        super().__init__(max_pending)
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        self._turns = {}
+        self.running = 0
+        self.processed = 0
+        self.waited = 0
+        self.max_queued = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            key = chat_key(update)
+            if key is None:
+                await self._run(coroutine)
+            else:
+                await self._run_in_turn(key, coroutine)
+        finally:
+            # Cancelled before its turn came, the update's coroutine never started.
+            coroutine.close()
+
+    async def _run_in_turn(self, key, coroutine):
+        turn = self._turns.get(key)
+        if turn is None:
+            turn = self._turns[key] = _ChatTurn()
+        turn.pending += 1
+        if turn.pending > 1:
+            self.waited += 1
+            self.max_queued = max(self.max_queued, turn.pending - 1)
+        try:
+            async with turn.lock:
+                await self._run(coroutine)
+        finally:
+            turn.pending -= 1
+            if not turn.pending:
+                del self._turns[key]
+
+    async def _run(self, coroutine):
+        async with self._running:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    def stats(self):
+        return {
+            'max_running': self.max_running,
+            'running': self.running,
+            'chats_in_flight': len(self._turns),
+            'processed': self.processed,
+            'waited_for_chat': self.waited,
+            'max_queued_per_chat': self.max_queued,
+        }
@@ -0,0 +1,519 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import MutableMapping
+from urllib.parse import urlparse
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger('drive_ops')
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'sessions.db')
+# A store serves every chat through one thread, and claims.py calls RespConnection on
+# the event loop itself, so every wait below holds up many chats; keep them at milliseconds.
+DEFAULT_DB_TIMEOUT = 0.2
+DEFAULT_REDIS_TIMEOUT = 0.05
+
+
+def _encode_key(key):
+    return json.dumps(key)
+
+
+def _decode_key(raw):
+    return json.loads(raw)
+
+
+class SessionStore(MutableMapping):
+    """Dict-compatible per-chat state. Values may be copies, so write them back after mutating.
+
+    The mapping API is synchronous. Handlers use the async methods (aget, aset, apop,
+    acontains) instead: for a backend that does I/O (blocking = True) they run the call
+    on the store's own single thread, so a slow disk or network never stalls the event
+    loop, and one connection is never used by two threads at once. In-process backends
+    answer inline. Do not mix in sync calls from the loop while handlers are running.
+    """
+
+    blocking = False
+
+    def __init__(self, namespace, ttl=None, record=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.record = record
+        self.inserts = 0
+        self.deletes = 0
+        self._executor = None
+
+    def _dumps(self, value):
+        if hasattr(value, 'to_dict'):
+            value = value.to_dict()
+        return json.dumps(value, ensure_ascii=False)
+
+    def _loads(self, raw):
+        value = json.loads(raw)
+        if self.record is not None and isinstance(value, dict):
+            return self.record.from_dict(value)
+        return value
+
+    def _expires_at(self, now):
+        return now + self.ttl if self.ttl else None
+
+    async def _run(self, fn, *args):
+        if not self.blocking:
+            return fn(*args)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix=f"store-{self.namespace}")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def aget(self, key, default=None):
+        return await self._run(self.get, key, default)
+
+    async def aset(self, key, value):
+        await self._run(self.__setitem__, key, value)
+
+    async def apop(self, key, default=None):
+        return await self._run(self.pop, key, default)
+
+    async def acontains(self, key):
+        return await self._run(self.__contains__, key)
+
+    async def akeys(self):
+        return await self._run(list, self)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def active(self):
+        """Entries this process added minus entries it saw go; unlike len(), costs no I/O.
+
+        Several processes sharing a backend each count their own writes, so add their
+        numbers up. Backends that expire entries on their own (Redis) do not report it.
+        """
+        return self.inserts - self.deletes
+
+    def stats(self):
+        return {'namespace': self.namespace, 'backend': type(self).__name__,
+                'inserts': self.inserts, 'deletes': self.deletes, 'active': self.active}
+
+
+class MemoryStore(SessionStore):
+    """In-process LRU store with per-entry TTL and a hard size bound."""
+
+    def __init__(self, namespace='default', maxsize=10000, ttl=None, clock=time.monotonic, record=None):
+        super().__init__(namespace, ttl, record)
+        self.maxsize = maxsize
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+
+    def _purge_expired(self):
+        now = self.clock()
+        expired = [key for key, (expires_at, _) in self._data.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
+        self.deletes += len(expired)
+
+    def __getitem__(self, key):
+        expires_at, value = self._data[key]
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            self.deletes += 1
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        now = self.clock()
+        entry = self._data.get(key)
+        if entry is None:
+            self.inserts += 1
+        elif entry[0] is not None and entry[0] <= now:
+            self.expirations += 1
+            self.deletes += 1
+            self.inserts += 1
+        self._data[key] = (self._expires_at(now), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            self.deletes += 1
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.deletes += 1
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self._purge_expired()
+        return iter(list(self._data))
+
+    def __len__(self):
+        self._purge_expired()
+        return len(self._data)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(maxsize=self.maxsize, evictions=self.evictions, expirations=self.expirations)
+        return stats
+
+
+class SQLiteStore(SessionStore):
+    """Durable store in a WAL-mode SQLite file, shareable by several processes on one host.
+
+    Reads never wait under WAL; a write waits for another process's write for at most
+    timeout seconds and then raises sqlite3.OperationalError.
+    """
+
+    PURGE_EVERY = 500
+    blocking = True
+
+    def __init__(self, namespace='default', path=DEFAULT_DB_PATH, ttl=None, clock=time.time, record=None,
+                 timeout=DEFAULT_DB_TIMEOUT):
+        super().__init__(namespace, ttl, record)
+        self.path = path
+        self.clock = clock
+        self._writes = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at)")
+
+    def __getitem__(self, key):
+        row = self._conn.execute(
+            "SELECT value FROM sessions WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.namespace, _encode_key(key), self.clock()),
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._loads(row[0])
+
+    def __setitem__(self, key, value):
+        now = self.clock()
+        data, expires_at, encoded = self._dumps(value), self._expires_at(now), _encode_key(key)
+        # Most writes update an entry, so try that first; a miss is an insert.
+        cur = self._conn.execute(
+            "UPDATE sessions SET value = ?, expires_at = ? WHERE namespace = ? AND key = ?",
+            (data, expires_at, self.namespace, encoded),
+        )
+        if cur.rowcount == 0:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, encoded, data, expires_at),
+            )
+            self.inserts += 1
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def __delitem__(self, key):
+        cur = self._conn.execute(
+            "DELETE FROM sessions WHERE namespace = ? AND key = ?", (self.namespace, _encode_key(key))
+        )
+        if cur.rowcount == 0:
+            raise KeyError(key)
+        self.deletes += 1
+
+    def __iter__(self):
+        rows = self._conn.execute(
+            "SELECT key FROM sessions WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.namespace, self.clock()),
+        ).fetchall()
+        return iter([_decode_key(row[0]) for row in rows])
+
+    def __len__(self):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.namespace, self.clock()),
+        ).fetchone()[0]
+
+    def purge_expired(self):
+        cur = self._conn.execute("DELETE FROM sessions WHERE expires_at IS NOT NULL AND expires_at <= ?", (self.clock(),))
+        self.deletes += cur.rowcount
+        return cur.rowcount
+
+    def close(self):
+        super().close()
+        self._conn.close()
+
+
+class RespConnection:
+    """Minimal blocking client for the Redis serialization protocol (RESP2).
+
+    It runs on a store's thread or, for claims, on the event loop, so it fails fast:
+    connecting and each reply wait at most timeout seconds, a timed out command is not
+    retried, and after a failure further commands raise ConnectionError at once for
+    down_for seconds instead of reconnecting. Only a pooled connection found closed by
+    the server is reopened and the command retried.
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=DEFAULT_REDIS_TIMEOUT,
+                 down_for=1.0, clock=time.monotonic):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.down_for = down_for
+        self.clock = clock
+        self.failures = 0
+        self._down_until = 0.0
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        if self.clock() < self._down_until:
+            raise ConnectionError(f"Redis at {self.address[0]}:{self.address[1]} is unavailable")
+        try:
+            self._sock = socket.create_connection(self.address, timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._file = self._sock.makefile('rb')
+            if self.password:
+                self._roundtrip('AUTH', self.password)
+            if self.db:
+                self._roundtrip('SELECT', self.db)
+        except (OSError, ConnectionError):
+            self._fail()
+            raise
+
+    def _fail(self):
+        self.close()
+        self.failures += 1
+        self._down_until = self.clock() + self.down_for
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RuntimeError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+    def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def execute(self, *args):
+        reused = self._sock is not None
+        if not reused:
+            self._connect()
+        try:
+            return self._roundtrip(*args)
+        except TimeoutError:
+            self._fail()
+            raise
+        except (OSError, ConnectionError):
+            if not reused:
+                self._fail()
+                raise
+            # The server closed an idle connection: reconnect once.
+            self.close()
+            self._connect()
+            try:
+                return self._roundtrip(*args)
+            except (OSError, ConnectionError):
+                self._fail()
+                raise
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._file = None
+
+    @classmethod
+    def from_url(cls, url, timeout=DEFAULT_REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, parsed.password, timeout)
+
+
+class RedisStore(SessionStore):
+    """Store in any server speaking the Redis protocol; expiry is delegated to the server."""
+
+    blocking = True
+
+    def __init__(self, namespace='default', connection=None, ttl=None, prefix='drive_ops', record=None):
+        super().__init__(namespace, ttl, record)
+        self.conn = connection or RespConnection()
+        self.prefix = f"{prefix}:{namespace}:"
+
+    def _key(self, key):
+        return self.prefix + _encode_key(key)
+
+    def __getitem__(self, key):
+        raw = self.conn.execute('GET', self._key(key))
+        if raw is None:
+            raise KeyError(key)
+        return self._loads(raw)
+
+    def __setitem__(self, key, value):
+        data = self._dumps(value)
+        # GET returns the previous value in the same round trip, which tells inserts apart.
+        if self.ttl:
+            previous = self.conn.execute('SET', self._key(key), data, 'EX', int(self.ttl), 'GET')
+        else:
+            previous = self.conn.execute('SET', self._key(key), data, 'GET')
+        if previous is None:
+            self.inserts += 1
+
+    def __delitem__(self, key):
+        if not self.conn.execute('DEL', self._key(key)):
+            raise KeyError(key)
+        self.deletes += 1
+
+    def __contains__(self, key):
+        return bool(self.conn.execute('EXISTS', self._key(key)))
+
+    def _scan(self):
+        cursor = '0'
+        while True:
+            cursor, keys = self.conn.execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            for raw in keys:
+                yield _decode_key(raw[len(self.prefix):])
+            if cursor == '0':
+                return
+
+    def __iter__(self):
+        return iter(list(self._scan()))
+
+    def __len__(self):
+        return sum(1 for _ in self._scan())
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+def from_env(namespace, ttl=None, record=None):
+    """Store for namespace picked by SESSION_STORE; record is the Record class its values are decoded into."""
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+    ttl = float(os.getenv(f"{namespace.upper()}_TTL", ttl or 0)) or None
+
+    if backend == 'sqlite':
+        store = SQLiteStore(namespace, os.getenv('SESSION_DB_PATH', DEFAULT_DB_PATH), ttl=ttl, record=record,
+                            timeout=float(os.getenv('SESSION_DB_TIMEOUT', DEFAULT_DB_TIMEOUT)))
+    elif backend == 'redis':
+        conn = RespConnection.from_url(os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+                                       timeout=float(os.getenv('REDIS_TIMEOUT', DEFAULT_REDIS_TIMEOUT)))
+        store = RedisStore(namespace, conn, ttl=ttl, record=record)
+    elif backend == 'memory':
+        store = MemoryStore(namespace, maxsize=int(os.getenv('SESSION_MAX_ENTRIES', 100000)), ttl=ttl, record=record)
+    else:
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+
+    logger.info("Session store %s: backend=%s ttl=%s", namespace, type(store).__name__, ttl)
+    return store
+
+
+class ConversationPersistence(BasePersistence):
+    """Keeps ConversationHandler states in a session store so half-finished orders survive restarts."""
+
+    def __init__(self, store, update_interval=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for store_key in await self.store.akeys():
+            conv_name, *key = json.loads(store_key)
+            if conv_name == name:
+                state = await self.store.aget(store_key)
+                if state is not None:
+                    conversations[tuple(key)] = state
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        store_key = json.dumps([name, *key])
+        if new_state is None:
+            await self.store.apop(store_key, None)
+        else:
+            await self.store.aset(store_key, new_state)
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
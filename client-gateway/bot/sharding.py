@@ -0,0 +1,305 @@
+import os
+import signal
+import bisect
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from queue import Full
+from types import SimpleNamespace
+from telegram import Update
+
+import httpserver
+import log_pipeline
+import webhook
+
+logger = logging.getLogger('drive_ops')
+
+# Set in a worker process to its shard id; None in the front process and without sharding.
+current_shard = None
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+def update_chat_id(data):
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = data.get(field)
+        if message:
+            return message['chat']['id']
+    query = data.get('callback_query')
+    if query:
+        message = query.get('message')
+        return message['chat']['id'] if message else query['from']['id']
+    return data.get('update_id')
+
+
+class HashRing:
+    """Consistent hash ring: adding or removing a shard only remaps the chats it owns."""
+
+    def __init__(self, replicas=64):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if self._owners.pop(point, None) is not None:
+                self._points.remove(point)
+
+    @property
+    def nodes(self):
+        return sorted(set(self._owners.values()))
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+def worker_main(shard_id, build_application, queue, processed, log_queue=None, max_in_flight=256):
+    global current_shard
+    current_shard = shard_id
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if log_queue is not None:
+        log_pipeline.forward(logger, log_queue)
+    application = build_application()
+    asyncio.run(_worker_loop(shard_id, application, queue, processed, max_in_flight))
+
+
+def _count(processed):
+    with processed.get_lock():
+        processed.value += 1
+
+
+async def _worker_loop(shard_id, application, queue, processed, max_in_flight=256):
+    loop = asyncio.get_running_loop()
+    # Take no more than max_in_flight updates off the queue at a time, so the rest wait
+    # there: dispatched - processed then is the backlog, and a full queue pushes back.
+    slots = asyncio.Semaphore(max_in_flight)
+
+    def done(_):
+        slots.release()
+        _count(processed)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info("Shard %s started in pid %s", shard_id, os.getpid())
+        try:
+            while True:
+                await slots.acquire()
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                # Through the update processor, so chats run concurrently and each stays in order.
+                update = Update.de_json(data, application.bot)
+                task = application.create_task(
+                    application.update_processor.process_update(update, application.process_update(update)),
+                    update=update,
+                )
+                task.add_done_callback(done)
+        finally:
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info("Shard %s stopped", shard_id)
+
+
+class Shard:
+    def __init__(self, shard_id, process, queue, processed):
+        self.shard_id = shard_id
+        self.process = process
+        self.queue = queue
+        self.processed = processed
+        self.dispatched = 0
+
+    @property
+    def depth(self):
+        return self.dispatched - self.processed.value
+
+
+class ShardDispatcher:
+    """Front process that routes updates to worker processes by consistent hash of chat_id.
+
+    Each worker runs the full handler wiring and takes its queue in order; its update
+    processor (sequencing.ChatSequencer) runs chats concurrently but all updates of one
+    chat strictly one after another. While a worker joins
+    or leaves, chats that move may briefly be handled by two shards; keep SESSION_STORE on
+    sqlite or redis so the new owner sees their state.
+    """
+
+    def __init__(self, build_application, workers=2, queue_size=1000, replicas=64, max_in_flight=256,
+                 log_queue=None):
+        self.build_application = build_application
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight
+        self.log_queue = log_queue
+        self.lost = 0
+        self.ring = HashRing(replicas)
+        self.shards = {}
+        self._next_id = 0
+        self._mp = multiprocessing.get_context('spawn')
+        self.initial_workers = workers
+
+    def _spawn(self, shard_id):
+        queue = self._mp.Queue(self.queue_size)
+        processed = self._mp.Value('q', 0)
+        process = self._mp.Process(
+            target=worker_main,
+            args=(shard_id, self.build_application, queue, processed, self.log_queue, self.max_in_flight),
+            name=f"gateway-shard-{shard_id}", daemon=True,
+        )
+        process.start()
+        return Shard(shard_id, process, queue, processed)
+
+    def add_worker(self):
+        shard_id = self._next_id
+        self._next_id += 1
+        self.shards[shard_id] = self._spawn(shard_id)
+        self.ring.add(shard_id)
+        logger.info("Shard %s joined, ring=%s", shard_id, self.ring.nodes)
+        return shard_id
+
+    def remove_worker(self, shard_id):
+        shard = self.shards.pop(shard_id)
+        self.ring.remove(shard_id)
+        shard.queue.put(None)
+        logger.info("Shard %s leaving after draining %s updates, ring=%s", shard_id, shard.depth, self.ring.nodes)
+        return shard
+
+    def restart_dead_workers(self):
+        for shard_id, shard in list(self.shards.items()):
+            if not shard.process.is_alive():
+                # Its queue cannot be read any more: a worker killed inside get() keeps the
+                # queue's read lock. What it had taken or still had queued is lost.
+                lost = shard.depth
+                self.lost += lost
+                logger.error("Shard %s died with exit code %s, restarting; %s dispatched updates were not processed",
+                             shard_id, shard.process.exitcode, lost)
+                shard.queue.cancel_join_thread()
+                shard.queue.close()
+                self.shards[shard_id] = self._spawn(shard_id)
+
+    async def dispatch(self, data):
+        shard = self.shards[self.ring.node_for(update_chat_id(data))]
+        shard.dispatched += 1
+        try:
+            shard.queue.put_nowait(data)
+        except Full:
+            await asyncio.get_running_loop().run_in_executor(None, shard.queue.put, data)
+
+    def stats(self):
+        return {
+            'workers': len(self.shards),
+            'lost': self.lost,
+            'shards': [
+                {
+                    'shard': shard.shard_id,
+                    'pid': shard.process.pid,
+                    'alive': shard.process.is_alive(),
+                    'dispatched': shard.dispatched,
+                    'processed': shard.processed.value,
+                    'queue_depth': shard.depth,
+                }
+                for shard in self.shards.values()
+            ],
+        }
+
+    def start(self):
+        for _ in range(self.initial_workers):
+            self.add_worker()
+
+    def stop(self, timeout=10):
+        for shard_id in list(self.shards):
+            self.remove_worker(shard_id).process.join(timeout)
+
+    def stats_server(self, host='127.0.0.1', port=9100):
+        server = httpserver.HTTPServer(host, port)
+
+        async def stats(request):
+            return httpserver.Response.json(self.stats())
+
+        async def add(request):
+            return httpserver.Response.json({'shard': self.add_worker()}, 201)
+
+        async def remove(request):
+            shard_id = int(request.query.get('shard', -1))
+            if shard_id not in self.shards or len(self.shards) == 1:
+                return httpserver.Response.json({'error': 'unknown shard or last worker'}, 400)
+            await asyncio.get_running_loop().run_in_executor(None, self.remove_worker, shard_id)
+            return httpserver.Response.json({'shard': shard_id})
+
+        server.route('GET', '/stats', stats)
+        server.route('POST', '/workers/add', add)
+        server.route('POST', '/workers/remove', remove)
+        return server
+
+
+async def _pump(front_queue, dispatcher):
+    while True:
+        update = await front_queue.get()
+        await dispatcher.dispatch(update.to_dict())
+
+
+async def _supervise(dispatcher, interval=5.0):
+    while True:
+        await asyncio.sleep(interval)
+        dispatcher.restart_dead_workers()
+
+
+async def _poll(bot, front_queue, allowed_updates):
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.exception("getUpdates failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await front_queue.put(update)
+            offset = update.update_id + 1
+
+
+async def serve(dispatcher, bot, allowed_updates, webhook_config=None, stats_port=9100):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    front_queue = asyncio.Queue(maxsize=dispatcher.queue_size)
+    stats_server = dispatcher.stats_server(port=stats_port)
+    await stats_server.start()
+    dispatcher.start()
+
+    async with bot:
+        if webhook_config is not None:
+            ingress = webhook.WebhookIngress(SimpleNamespace(update_queue=front_queue, bot=bot), webhook_config)
+            await ingress.start()
+            await bot.set_webhook(url=webhook_config.public_url, secret_token=webhook_config.secret,
+                                  allowed_updates=allowed_updates, max_connections=webhook_config.max_connections)
+            source = None
+        else:
+            await bot.delete_webhook()
+            source = asyncio.create_task(_poll(bot, front_queue, allowed_updates))
+        tasks = [asyncio.create_task(_pump(front_queue, dispatcher)), asyncio.create_task(_supervise(dispatcher))]
+        try:
+            await stop_event.wait()
+        finally:
+            for task in tasks + ([source] if source else []):
+                task.cancel()
+            if webhook_config is not None:
+                await ingress.stop()
+            await stats_server.stop()
+            await loop.run_in_executor(None, dispatcher.stop)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from telegram.ext import Application
+
+logger = logging.getLogger('drive_ops')
+
+TRACEPARENT = 'traceparent'
+CORRELATION_HEADER = 'X-Correlation-ID'
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanContext:
+    """The part of a span that crosses process boundaries, as a W3C traceparent header."""
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, header):
+        """The SpanContext in a traceparent header, or None if it is missing or malformed."""
+        parts = (header or '').strip().split('-')
+        if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            flags = int(parts[3], 16)
+            if not int(parts[1], 16) or not int(parts[2], 16):
+                return None
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], bool(flags & 1))
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'service', 'start', 'duration', 'attributes', 'error')
+
+    def __init__(self, name, context, parent_id, service, attributes):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.service = service
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': self.service,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class JsonlCollector:
+    """Stand-in for a trace collector: appends finished spans as JSON lines to path.
+
+    Spans go through a bounded queue to a writer thread, so exporting never blocks the
+    event loop; when the queue is full the span is dropped and counted.
+    """
+
+    def __init__(self, path, maxsize=10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize)
+        self.exported = 0
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, span):
+        if self._pid != os.getpid():
+            # Started on first use, and again in a forked gateway shard.
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._write, name='span-collector', daemon=True)
+            self._thread.start()
+        try:
+            self.queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+                self.exported += 1
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'exported': self.exported, 'dropped': self.dropped}
+
+
+class Tracer:
+    """Starts spans, keeps the current one in a context variable and exports the sampled ones.
+
+    The sampling decision is made once per trace, at its root (or taken from the
+    incoming traceparent), so a trace is either exported whole or not at all. Unsampled
+    spans still get ids, so the traceparent sent downstream is always valid.
+    """
+
+    def __init__(self, service, collector=None, sample_rate=0.0, rng=random):
+        self.service = service
+        self.collector = collector
+        self.sample_rate = sample_rate
+        self.rng = rng
+        self.started = 0
+        self.sampled = 0
+
+    def configure(self, collector, sample_rate):
+        self.collector = collector
+        self.sample_rate = sample_rate
+
+    def start_span(self, name, parent=None, **attributes):
+        """A new span, a child of parent (a SpanContext) or of the current span."""
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            trace_id = f"{self.rng.getrandbits(128):032x}"
+            sampled = self.collector is not None and self.rng.random() < self.sample_rate
+        else:
+            trace_id, sampled = parent.trace_id, parent.sampled
+        self.started += 1
+        context = SpanContext(trace_id, f"{self.rng.getrandbits(64):016x}", sampled)
+        return Span(name, context, parent.span_id if parent is not None else None, self.service, attributes)
+
+    def end_span(self, span):
+        span.duration = time.time() - span.start
+        if span.context.sampled and self.collector is not None:
+            self.sampled += 1
+            self.collector.export(span)
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Run the block inside a new current span; an exception is recorded on it and re-raised."""
+        span = self.start_span(name, parent, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(span)
+
+    def headers(self, correlation_id=None):
+        """traceparent (and X-Correlation-ID) headers that continue the current trace downstream."""
+        headers = {}
+        current = _current.get()
+        if current is not None:
+            headers[TRACEPARENT] = current.context.traceparent()
+        if correlation_id:
+            headers[CORRELATION_HEADER] = correlation_id
+        return headers
+
+    def stats(self):
+        stats = {'spans_started': self.started, 'spans_sampled': self.sampled, 'sample_rate': self.sample_rate}
+        if self.collector is not None:
+            stats['collector'] = self.collector.stats()
+        return stats
+
+
+tracer = Tracer('client-gateway')
+
+
+def current_span():
+    return _current.get()
+
+
+def update_attributes(update):
+    attributes = {'update_id': getattr(update, 'update_id', None)}
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        attributes['chat_id'] = chat.id
+    if getattr(update, 'callback_query', None) is not None:
+        attributes['kind'] = 'callback_query'
+        attributes['data'] = update.callback_query.data
+    elif getattr(update, 'message', None) is not None:
+        attributes['kind'] = 'message'
+    return attributes
+
+
+class TracedApplication(Application):
+    """Application that processes every update inside a root 'telegram.update' span."""
+
+    async def process_update(self, update):
+        with tracer.span('telegram.update', **update_attributes(update)):
+            return await super().process_update(update)
@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+
+import httpx
+
+import metrics
+import tracing
+from session_store import MemoryStore
+
+logger = logging.getLogger('drive_ops')
+
+TRIP_LOOKUP_SECONDS = metrics.registry.histogram(
+    'gateway_trip_lookup_seconds', 'Trip Service GET /trips/{id} latency by status code', ('status',))
+
+
+class _CachedTrip:
+    __slots__ = ('trip', 'etag', 'fetched_at')
+
+    def __init__(self, trip, etag, fetched_at):
+        self.trip = trip
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+
+class TripClient:
+    """Reads trips from the Trip Service through a short-TTL read-through cache.
+
+    A cached trip is served as is for ttl seconds. After that it is revalidated with
+    If-None-Match, so an unchanged trip costs a 304 with no body; the copy is kept for
+    keep seconds to make that possible. Concurrent lookups of one trip share a single
+    upstream request. Status events call invalidate(), which makes the next lookup
+    revalidate at once. When the service fails, a cached copy is served stale.
+    """
+
+    def __init__(self, http, path='/trips', ttl=2.0, keep=600, maxsize=10000, clock=time.monotonic):
+        self.http = http
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.cache = MemoryStore('trips', maxsize=maxsize, ttl=keep)
+        self._inflight = {}
+        self.hits = 0
+        self.coalesced = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        self.stale_served = 0
+
+    async def get(self, trip_id):
+        """The trip as the Trip Service returns it, or None if it is unknown or cannot be fetched."""
+        trip_id = str(trip_id)
+        entry = self.cache.get(trip_id)
+        if entry is not None and entry.fetched_at is not None and self.clock() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            return entry.trip
+        task = self._inflight.get(trip_id)
+        if task is None:
+            task = self._inflight[trip_id] = asyncio.ensure_future(self._fetch(trip_id))
+            task.add_done_callback(lambda done: self._forget(trip_id, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, trip_id, task):
+        if self._inflight.get(trip_id) is task:
+            del self._inflight[trip_id]
+
+    def invalidate(self, trip_id):
+        """Make the next lookup of trip_id go upstream; its ETag is kept for the revalidation."""
+        trip_id = str(trip_id)
+        entry = self.cache.get(trip_id)
+        if entry is not None:
+            entry.fetched_at = None
+            self.invalidations += 1
+        # A request already in flight may have been answered before the change; later
+        # lookups start a new one, and the old one does not refresh the cache.
+        self._inflight.pop(trip_id, None)
+
+    def handle_event(self, event):
+        trip_id = (event.get('payload') or {}).get('trip_id')
+        if trip_id is not None:
+            self.invalidate(trip_id)
+
+    async def _fetch(self, trip_id):
+        with tracing.tracer.span('trip_service.get', trip_id=trip_id) as span:
+            entry = self.cache.get(trip_id)
+            headers = tracing.tracer.headers()
+            if entry is not None and entry.etag:
+                headers['If-None-Match'] = entry.etag
+            self.requests += 1
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                resp = await self.http.get(f"{self.path}/{trip_id}", headers=headers)
+                status = str(resp.status_code)
+            except httpx.HTTPError as e:
+                logger.warning("Trip lookup %s failed: %s", trip_id, e)
+                return self._stale(entry)
+            finally:
+                TRIP_LOOKUP_SECONDS.labels(status).observe(time.perf_counter() - started)
+                span.set('status', status)
+
+            current = self._inflight.get(trip_id) is asyncio.current_task()
+            if resp.status_code == 304 and entry is not None:
+                self.not_modified += 1
+                if current:
+                    entry.fetched_at = self.clock()
+                return entry.trip
+            if resp.status_code == 200:
+                trip = resp.json()
+                if current:
+                    self.cache[trip_id] = _CachedTrip(trip, resp.headers.get('etag'), self.clock())
+                return trip
+            if resp.status_code == 404:
+                self.cache.pop(trip_id, None)
+                return None
+            logger.warning("Trip lookup %s failed: status_code=%s", trip_id, resp.status_code)
+            return self._stale(entry)
+
+    def _stale(self, entry):
+        if entry is None:
+            return None
+        self.stale_served += 1
+        return entry.trip
+
+    def stats(self):
+        lookups = self.hits + self.coalesced + self.requests
+        return {
+            'lookups': lookups,
+            'cache_hits': self.hits,
+            'coalesced': self.coalesced,
+            'upstream_requests': self.requests,
+            'not_modified': self.not_modified,
+            'invalidations': self.invalidations,
+            'stale_served': self.stale_served,
+            'upstream_ratio': self.requests / lookups if lookups else 0.0,
+            'cached_trips': len(self.cache),
+            'in_flight': len(self._inflight),
+        }
@@ -0,0 +1,265 @@
+import os
+import json
+import asyncio
+import fnmatch
+import logging
+from urllib.parse import urlparse
+
+from outbound import PRIORITY_NOTIFICATION
+from session_store import MemoryStore
+
+logger = logging.getLogger('drive_ops')
+
+TRIP_EVENTS = 'trip.event.*'
+
+EVENT_STATUS = {
+    'trip.event.created': 'PENDING',
+    'trip.event.driver_assigned': 'CONFIRMED',
+    'trip.event.started': 'IN_PROGRESS',
+    'trip.event.completed': 'COMPLETED',
+    'trip.event.cancelled': 'CANCELLED',
+}
+STATUS_ORDER = ['PENDING', 'CONFIRMED', 'IN_PROGRESS', 'COMPLETED', 'CANCELLED']
+FINAL_STATUSES = ('COMPLETED', 'CANCELLED')
+
+
+def event_status(event):
+    payload = event.get('payload') or {}
+    status = payload.get('status') or EVENT_STATUS.get(event.get('event_type'))
+    return status.upper() if status else None
+
+
+class LocalBroker:
+    """In-process stand-in for the message broker: fan-out pub/sub with glob topic patterns."""
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subscribers = []
+        self.published = 0
+        self.dropped = 0
+
+    async def publish(self, event):
+        self.published += 1
+        topic = event.get('event_type', '')
+        for pattern, queue in self._subscribers:
+            if fnmatch.fnmatchcase(topic, pattern):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+                    logger.warning("Local broker subscriber is full, dropping %s", topic)
+
+    async def subscribe(self, pattern=TRIP_EVENTS):
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        entry = (pattern, queue)
+        self._subscribers.append(entry)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.remove(entry)
+
+    async def close(self):
+        pass
+
+
+class RedisBroker:
+    """Pub/sub over a Redis-protocol server; Trip Service publishes each event on a channel named by event_type."""
+
+    def __init__(self, host='127.0.0.1', port=6379, password=None, reconnect_delay=1.0):
+        self.address = (host, port)
+        self.password = password
+        self.reconnect_delay = reconnect_delay
+        self._writer = None
+
+    @classmethod
+    def from_url(cls, url):
+        parsed = urlparse(url)
+        return cls(parsed.hostname or '127.0.0.1', parsed.port or 6379, parsed.password)
+
+    @staticmethod
+    def _encode(*args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b''.join(parts)
+
+    @classmethod
+    async def _read_reply(cls, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RuntimeError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            return None if size < 0 else (await reader.readexactly(size + 2))[:-2].decode()
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [await cls._read_reply(reader) for _ in range(size)]
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+    async def publish(self, event):
+        reader, writer = await asyncio.open_connection(*self.address)
+        try:
+            if self.password:
+                writer.write(self._encode('AUTH', self.password))
+                await self._read_reply(reader)
+            writer.write(self._encode('PUBLISH', event.get('event_type', ''), json.dumps(event, ensure_ascii=False)))
+            await self._read_reply(reader)
+        finally:
+            writer.close()
+
+    async def subscribe(self, pattern=TRIP_EVENTS):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(*self.address)
+                if self.password:
+                    self._writer.write(self._encode('AUTH', self.password))
+                    await self._read_reply(reader)
+                self._writer.write(self._encode('PSUBSCRIBE', pattern))
+                await self._read_reply(reader)
+                logger.info("Subscribed to %s on %s:%s", pattern, *self.address)
+                while True:
+                    reply = await self._read_reply(reader)
+                    if isinstance(reply, list) and reply[0] == 'pmessage':
+                        try:
+                            yield json.loads(reply[3])
+                        except ValueError:
+                            logger.warning("Skipping malformed event on %s", reply[2])
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                logger.warning("Trip event subscription lost (%s), reconnecting in %ss", e, self.reconnect_delay)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def broker_from_env():
+    """The configured broker, or None when TRIP_EVENTS_BROKER is unset and status push is off."""
+    backend = os.getenv('TRIP_EVENTS_BROKER', '').lower()
+    if not backend or backend == 'none':
+        logger.info("Trip status push disabled: TRIP_EVENTS_BROKER is not set")
+        return None
+    if backend == 'redis':
+        return RedisBroker.from_url(os.getenv('TRIP_EVENTS_URL') or os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'))
+    if backend == 'local':
+        return LocalBroker()
+    raise ValueError(f"Unknown TRIP_EVENTS_BROKER backend: {backend}")
+
+
+class TripStatusNotifier:
+    """Pushes trip status changes to passengers by editing their confirmation message in place.
+
+    Events for one trip that arrive within coalesce_window are folded into a single edit
+    showing the latest status. Watches live in this process only: with sharding, the worker
+    that confirmed the order is the one that owns its confirmation message. Every event,
+    watched or not, is first handed to the callables in listeners.
+    """
+
+    def __init__(self, broker, edit, render, coalesce_window=1.0, max_watches=100000, watch_ttl=24 * 3600,
+                 markup=None):
+        self.broker = broker
+        self.edit = edit
+        self.render = render
+        self.markup = markup
+        self.listeners = []
+        self.coalesce_window = coalesce_window
+        self.watches = MemoryStore('trip_watches', maxsize=max_watches, ttl=watch_ttl)
+        self._flushes = {}
+        self._task = None
+        self.context = None
+        self.received = 0
+        self.ignored = 0
+        self.edits = 0
+        self.coalesced = 0
+
+    def watch(self, trip_id, chat_id, message_id, status='PENDING'):
+        self.watches[str(trip_id)] = {'chat_id': chat_id, 'message_id': message_id, 'shown': status, 'latest': status}
+
+    def start(self, context):
+        self.context = context
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._consume())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._flushes.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._flushes.clear()
+        await self.broker.close()
+
+    async def _consume(self):
+        async for event in self.broker.subscribe(TRIP_EVENTS):
+            try:
+                self.handle(event)
+            except Exception as e:
+                logger.exception("Failed to handle trip event %s: %s", event.get('event_id'), e)
+
+    def handle(self, event):
+        self.received += 1
+        for listener in self.listeners:
+            listener(event)
+        trip_id = str((event.get('payload') or {}).get('trip_id'))
+        watch = self.watches.get(trip_id)
+        status = event_status(event)
+        if watch is None or status is None or not self._advances(watch['latest'], status):
+            self.ignored += 1
+            return
+
+        watch['latest'] = status
+        self.watches[trip_id] = watch
+        if trip_id in self._flushes:
+            self.coalesced += 1
+        else:
+            self._flushes[trip_id] = asyncio.get_running_loop().create_task(self._flush(trip_id))
+
+    @staticmethod
+    def _advances(current, status):
+        if current in FINAL_STATUSES:
+            return False
+        if current in STATUS_ORDER and status in STATUS_ORDER:
+            return STATUS_ORDER.index(status) > STATUS_ORDER.index(current)
+        return status != current
+
+    async def _flush(self, trip_id):
+        try:
+            await asyncio.sleep(self.coalesce_window)
+        finally:
+            self._flushes.pop(trip_id, None)
+
+        watch = self.watches.get(trip_id)
+        if watch is None or watch['latest'] == watch['shown']:
+            return
+        status = watch['latest']
+        kwargs = {'reply_markup': self.markup(trip_id, status)} if self.markup is not None else {}
+        await self.edit(watch['chat_id'], watch['message_id'], self.render(trip_id, status), self.context,
+                        priority=PRIORITY_NOTIFICATION, parse_mode='Markdown', **kwargs)
+        self.edits += 1
+        if status in FINAL_STATUSES:
+            self.watches.pop(trip_id, None)
+        else:
+            watch['shown'] = status
+            self.watches[trip_id] = watch
+
+    def stats(self):
+        return {
+            'watched_trips': len(self.watches),
+            'events_received': self.received,
+            'events_ignored': self.ignored,
+            'edits': self.edits,
+            'coalesced': self.coalesced,
+        }
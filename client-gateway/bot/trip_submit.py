@@ -0,0 +1,219 @@
+import time
+import random
+import asyncio
+import logging
+
+import httpx
+
+import metrics
+import tracing
+from records import SubmitResult
+from session_store import MemoryStore
+
+logger = logging.getLogger('drive_ops')
+
+# Only failures where the Trip Service certainly did not create the trip: it does not
+# deduplicate on Idempotency-Key, so after a timeout or a 504 the first POST may have
+# created one and repeating it would create a second.
+RETRY_STATUSES = (503,)
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+TRIP_REQUEST_SECONDS = metrics.registry.histogram(
+    'gateway_trip_request_seconds', 'Trip Service POST /trips latency by status code', ('status',))
+
+
+def backoff_delay(attempt, base=0.2, cap=2.0, rng=random):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for reset_timeout after failure_threshold failures in a row.
+
+    Once the timeout passes a single probe request is let through (half-open); its
+    success closes the circuit again, its failure reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened_total = 0
+        self.rejected_total = 0
+        self._probing = False
+
+    def allow(self):
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected_total += 1
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def release(self):
+        """Free the half-open probe slot when its request ended without an outcome (e.g. cancelled)."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_total += 1
+                logger.warning("Circuit opened after %s failures", self.failures)
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'opened_total': self.opened_total,
+            'rejected_total': self.rejected_total,
+        }
+
+
+class TripSubmitter:
+    """Creates trips in the Trip Service exactly once per order.
+
+    Every order carries a request_id, sent as the Idempotency-Key header for when the
+    Trip Service learns to deduplicate on it; it does not yet, so a request that may
+    have reached it is never repeated. Concurrent submissions of the same request_id (a
+    double tap on confirm) share one in-flight request, and a successful result is
+    remembered for recent_ttl seconds to answer late repeats without a call. Only 503
+    responses and failures to connect are retried, with jittered exponential backoff;
+    a timeout or a 504 is reported at once. While the circuit breaker is open,
+    submissions fail at once with 503.
+    """
+
+    def __init__(self, http, path='/trips', breaker=None, max_attempts=3, backoff_base=0.2,
+                 backoff_max=2.0, recent_ttl=120, sleep=asyncio.sleep, rng=random):
+        self.http = http
+        self.path = path
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self.rng = rng
+        self.recent = MemoryStore('trip_submissions', maxsize=10000, ttl=recent_ttl)
+        self._inflight = {}
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.fast_failures = 0
+
+    async def submit(self, request_id, payload):
+        """The SubmitResult for request_id; repeats share the first call's result."""
+        result = self.recent.get(request_id)
+        if result is not None:
+            self.coalesced += 1
+            return result
+        task = self._inflight.get(request_id)
+        if task is None:
+            task = self._inflight[request_id] = asyncio.ensure_future(self._submit(request_id, payload))
+            task.add_done_callback(lambda _: self._inflight.pop(request_id, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _submit(self, request_id, payload):
+        with tracing.tracer.span('trip_service.create', correlation_id=request_id) as span:
+            result = await self._attempts(request_id, payload)
+            span.set('status', result.get('status'))
+            return result
+
+    async def _attempts(self, request_id, payload):
+        # The correlation id is the order's request_id, so retries and outbox
+        # redeliveries of one order share it; traceparent ties it to this trace.
+        headers = {'Idempotency-Key': request_id, **tracing.tracer.headers(correlation_id=request_id)}
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.retries += 1
+                await self.sleep(backoff_delay(attempt - 1, self.backoff_base, self.backoff_max, self.rng))
+            if not self.breaker.allow():
+                self.fast_failures += 1
+                logger.warning("Trip Service circuit open, request %s not sent", request_id)
+                return SubmitResult.failure(request_id, 503, 'Сервіс тимчасово недоступний. Спробуйте за хвилину.')
+
+            self.requests += 1
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                resp = await self.http.post(self.path, json=payload, headers=headers)
+                status = str(resp.status_code)
+                data = resp.json() if resp.status_code in (200, 201) else None
+                if data is not None and not isinstance(data, dict):
+                    raise ValueError(f"unexpected response body: {resp.text[:200]}")
+            except asyncio.CancelledError:
+                # Give back a half-open probe slot, or the circuit would stay half-open for good.
+                self.breaker.release()
+                raise
+            except RETRY_ERRORS as e:
+                status = 'connect_error'
+                self.breaker.record_failure()
+                logger.warning("Trip request %s connection error (attempt %s): %s", request_id, attempt + 1, e)
+                result = SubmitResult.failure(request_id, 503, 'Сервіс недоступний. Спробуйте пізніше.')
+                continue
+            except httpx.TimeoutException:
+                status = 'timeout'
+                self.breaker.record_failure()
+                logger.error("Trip request %s timed out", request_id)
+                return SubmitResult.failure(
+                    request_id, 504, 'Сервіс не відповів вчасно, замовлення могло бути створене. Спробуйте пізніше.')
+            except Exception as e:
+                # Read errors, broken connections, a malformed 200 body: the service failed us.
+                self.breaker.record_failure()
+                logger.exception("Trip request %s unexpected error: %s", request_id, e)
+                return SubmitResult.failure(request_id, 500, str(e))
+            finally:
+                TRIP_REQUEST_SECONDS.labels(status).observe(time.perf_counter() - started)
+
+            if resp.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if data is not None:
+                result = SubmitResult(
+                    success=True,
+                    trip_id=data.get('id') or data.get('trip_id') or request_id,
+                    request_id=request_id,
+                    status=data.get('status', 'pending'),
+                    raw_response=data,
+                )
+                logger.info("Trip request success: trip_id=%s status=%s", result.trip_id, result.status)
+                self.recent[request_id] = result
+                return result
+
+            logger.error("Trip request %s failed: status_code=%s response=%s", request_id, resp.status_code, resp.text)
+            result = SubmitResult.failure(request_id, resp.status_code, resp.text or 'Unknown error')
+            if resp.status_code not in RETRY_STATUSES:
+                return result
+        return result
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'coalesced': self.coalesced,
+            'fast_failures': self.fast_failures,
+            'in_flight': len(self._inflight),
+            'circuit': self.breaker.stats(),
+        }
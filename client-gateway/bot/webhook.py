@@ -0,0 +1,185 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler
+
+import httpserver
+
+logger = logging.getLogger('drive_ops')
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+def allowed_updates(application):
+    """Update types the registered handlers can consume; anything unknown widens to ALL_TYPES."""
+    types = set()
+
+    def visit(handler):
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            return all(visit(h) for h in nested)
+        if isinstance(handler, CallbackQueryHandler):
+            types.add(Update.CALLBACK_QUERY)
+            return True
+        if isinstance(handler, (MessageHandler, CommandHandler)):
+            types.add(Update.MESSAGE)
+            return True
+        update_types = getattr(handler, 'update_types', None)
+        if update_types is not None:
+            types.update(update_types)
+            return True
+        return False
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not visit(handler):
+                return list(Update.ALL_TYPES)
+    return sorted(types)
+
+
+class WebhookConfig:
+    def __init__(self, url, listen='0.0.0.0', port=8443, path='/telegram', secret=None,
+                 max_connections=40, queue_size=1000, enqueue_timeout=2.0):
+        self.url = url
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+
+    @property
+    def public_url(self):
+        return self.url.rstrip('/') + self.path
+
+    @classmethod
+    def from_env(cls):
+        url = os.getenv('WEBHOOK_URL')
+        if not url:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+        if not os.getenv('WEBHOOK_SECRET'):
+            raise ValueError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+        return cls(
+            url=url,
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', 8443)),
+            path=os.getenv('WEBHOOK_PATH', '/telegram'),
+            secret=os.getenv('WEBHOOK_SECRET'),
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+            queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)),
+            enqueue_timeout=float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 2.0)),
+        )
+
+
+class WebhookIngress:
+    """Receives Telegram updates over HTTP and feeds them to the application's update queue.
+
+    When handlers lag and the bounded queue has no room for the whole request within
+    enqueue_timeout, nothing from it is queued and it is answered with 503, so Telegram
+    redelivers it later instead of us buffering without limit or handling part of it twice.
+    Requests must carry the configured secret; the ingress does not run without one.
+    """
+
+    def __init__(self, application, config, server=None):
+        if not config.secret:
+            raise ValueError("A webhook secret is required: anyone could post updates otherwise")
+        self.application = application
+        self.config = config
+        self.server = server or httpserver.HTTPServer(config.listen, config.port)
+        self.server.route('POST', config.path, self.handle)
+        self.accepted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.config.secret.encode()):
+            self.rejected += 1
+            return httpserver.Response(403, 'Forbidden')
+
+        try:
+            data = request.json()
+        except ValueError:
+            self.rejected += 1
+            return httpserver.Response(400, 'Invalid JSON')
+
+        batch = data if isinstance(data, list) else [data]
+        queue = self.application.update_queue
+        if queue.maxsize and len(batch) > queue.maxsize:
+            self.rejected += 1
+            return httpserver.Response(413, 'Batch larger than the update queue')
+        updates = [Update.de_json(item, self.application.bot) for item in batch]
+        if not await self._wait_for_room(queue, len(updates)):
+            self.throttled += len(updates)
+            logger.warning("Webhook backpressure: update queue full (%s pending)", queue.qsize())
+            return httpserver.Response(503, 'Busy', headers={'Retry-After': '1'})
+        # Nothing awaits between the room check and here, so the whole batch fits.
+        for update in updates:
+            queue.put_nowait(update)
+        self.accepted += len(updates)
+        return httpserver.Response(200, 'OK')
+
+    async def _wait_for_room(self, queue, count, poll=0.01):
+        if not queue.maxsize:
+            return True
+        deadline = asyncio.get_running_loop().time() + self.config.enqueue_timeout
+        while queue.maxsize - queue.qsize() < count:
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(poll)
+        return True
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    def stats(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'queue_depth': self.application.update_queue.qsize(),
+        }
+
+
+async def serve(application, config, allowed_updates):
+    ingress = WebhookIngress(application, config)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await ingress.start()
+        await application.bot.set_webhook(
+            url=config.public_url,
+            secret_token=config.secret,
+            allowed_updates=allowed_updates,
+            max_connections=config.max_connections,
+        )
+        logger.info("Webhook set to %s, allowed_updates=%s", config.public_url, allowed_updates)
+        try:
+            await stop_event.wait()
+        finally:
+            await ingress.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            logger.info("Webhook ingress stopped: %s", ingress.stats())
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_webhook(application, config, allowed_updates):
+    asyncio.run(serve(application, config, allowed_updates))
@@ -0,0 +1,70 @@
+import time
+
+import addresses
+
+
+def make_index(tmp_path, lines):
+    path = tmp_path / 'gazetteer.txt'
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return addresses.AddressIndex(str(path))
+
+
+def test_gazetteer_is_loaded_on_first_lookup(tmp_path):
+    index = make_index(tmp_path, ['# comment', 'вул. Хрещатик, 1\t10', 'Центральний вокзал'])
+    assert not index.stats()['loaded']
+    assert index.suggest('хрещ') == ['вул. Хрещатик, 1']
+    assert index.stats()['gazetteer_entries'] == 2
+    index.close()
+
+
+def test_prefix_matches_any_word_and_ranks_by_weight(tmp_path):
+    index = make_index(tmp_path, ['вул. Хрещатик, 1\t2', 'вул. Хрещатик, 22\t9', 'пров. Хрестовий, 3\t1'])
+    assert index.suggest('Хре', k=2) == ['вул. Хрещатик, 22', 'вул. Хрещатик, 1']
+    assert index.suggest('вулиця хрещатик 1')[0] == 'вул. Хрещатик, 1'
+
+
+def test_normalize_fixes_typos_but_not_unknown_places(tmp_path):
+    index = make_index(tmp_path, ['Аеропорт Бориспіль', 'Центральний вокзал'])
+    assert index.normalize('аеропорт  бориспіль') == 'Аеропорт Бориспіль'
+    assert index.normalize('Центральнй вокзал') == 'Центральний вокзал'
+    assert index.normalize('вул. Невідома, 5') is None
+    assert index.suggest('') == []
+
+
+def test_learned_addresses_are_suggested_and_boosted(tmp_path):
+    index = make_index(tmp_path, ['вул. Лесі Українки, 1\t2'])
+    index.learn('вул. Лесная, 12')
+    assert index.suggest('лес', k=2)[0] == 'вул. Лесі Українки, 1'
+    index.learn('вул. Лесная, 12')
+    index.learn('вул. Лесная, 12')
+    assert index.suggest('лес', k=2) == ['вул. Лесная, 12', 'вул. Лесі Українки, 1']
+    assert index.stats()['learned_entries'] == 1
+
+
+def test_lookup_latency_on_bundled_gazetteer():
+    index = addresses.AddressIndex()
+    index.suggest('вокзал')
+    queries = ['хрещ', 'Аэропорт Борисполь', 'вул. Саксаганського 5', 'майдан незалежнсоті'] * 250
+    started = time.perf_counter()
+    for query in queries:
+        index.suggest(query)
+    assert (time.perf_counter() - started) / len(queries) < 0.001
+    index.close()
+
+
+def test_normalize_never_changes_the_house_number(tmp_path):
+    index = make_index(tmp_path, ['вул. Хрещатик, 1', 'вул. Хрещатик, 22', 'вул. Саксаганського, 121',
+                                  'вул. Володимирська, 40'])
+    for typed in ('вул. Хрещатик, 10', 'Хрещатик, 2', 'Саксаганського, 1', 'Володимирська, 4'):
+        assert index.normalize(typed) is None
+    assert index.normalize('вул. Хрещатикк, 22') == 'вул. Хрещатик, 22'
+    assert 'вул. Хрещатик, 1' in index.suggest('вул. Хрещатик, 10')
+
+
+def test_bundled_gazetteer_keeps_typed_house_numbers():
+    index = addresses.AddressIndex()
+    for typed in ('вул. Хрещатик, 10', 'Хрещатик, 2', 'Саксаганського, 1', 'Володимирська, 4'):
+        normalized = index.normalize(typed)
+        assert normalized is None or addresses.numbers(addresses.address_key(normalized)) == \
+            addresses.numbers(addresses.address_key(typed))
+    index.close()
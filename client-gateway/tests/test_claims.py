@@ -0,0 +1,131 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import claims
+import driver
+import session_store
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_claims_first_accept_wins():
+    registry = claims.MemoryClaims()
+    assert registry.claim('T1', 1).won
+    second = registry.claim('T1', 2)
+    assert second.lost and second.holder == '1'
+    assert registry.claim('T1', 1).outcome == claims.REPEAT
+    assert registry.stats()['won'] == 1
+    assert registry.stats()['lost'] == 1
+
+
+def test_memory_claims_expire():
+    clock = FakeClock()
+    registry = claims.MemoryClaims(ttl=60, clock=clock)
+    registry.claim('T1', 1)
+    clock.now += 61
+    assert registry.holder('T1') is None
+    assert registry.claim('T1', 2).won
+
+
+def test_sqlite_claims_are_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    worker_a = claims.SQLiteClaims(path)
+    worker_b = claims.SQLiteClaims(path)
+    assert worker_a.claim('T1', 1).won
+    assert worker_b.claim('T1', 2).lost
+    assert worker_b.holder('T1') == '1'
+    worker_a.release('T1')
+    assert worker_b.claim('T1', 2).won
+    worker_a.close()
+    worker_b.close()
+
+
+def test_memory_claims_are_refused_with_several_workers(monkeypatch, tmp_path):
+    monkeypatch.delenv('CLAIM_STORE', raising=False)
+    monkeypatch.delenv('SESSION_STORE', raising=False)
+    assert isinstance(claims.from_env(workers=1), claims.MemoryClaims)
+    with pytest.raises(ValueError, match='gateway workers'):
+        claims.from_env(workers=4)
+
+    monkeypatch.setenv('CLAIM_STORE', 'sqlite')
+    monkeypatch.setenv('SESSION_DB_PATH', str(tmp_path / 'sessions.db'))
+    registry = claims.from_env(workers=4)
+    assert isinstance(registry, claims.SQLiteClaims)
+    registry.close()
+
+
+def make_accept(chat_id):
+    async def answer(*args, **kwargs):
+        pass
+
+    query = SimpleNamespace(data='accept_trip_T1',
+                            message=SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=10), answer=answer)
+    return SimpleNamespace(callback_query=query)
+
+
+def make_handler(helpers, edits):
+    async def safe_send(chat_id, text, context, **kwargs):
+        pass
+
+    async def safe_edit_message_text(chat_id, message_id, text, context, **kwargs):
+        edits.append((chat_id, text))
+
+    handlers = []
+    application = SimpleNamespace(add_handler=handlers.append)
+    helpers = dict(helpers, safe_send=safe_send, safe_edit_message_text=safe_edit_message_text)
+    driver.register_handlers(application, session_store.MemoryStore('orders'), session_store.MemoryStore('roles'),
+                             {'BTN_DRIVER': 'd', 'BTN_MY_ORDERS': 'o'}, {'driver_menu': None}, helpers)
+    return handlers[0].match_callback('accept_trip_T1')
+
+
+def test_concurrent_accepts_forward_only_the_winner():
+    forwarded = []
+
+    async def forward_assignment(trip_id, driver_chat_id):
+        forwarded.append((trip_id, driver_chat_id))
+        return True
+
+    edits = []
+    accept = make_handler({'claims': claims.MemoryClaims(), 'forward_assignment': forward_assignment}, edits)
+
+    async def scenario():
+        await asyncio.gather(*(accept(make_accept(chat_id), None) for chat_id in range(1, 6)))
+
+    asyncio.run(scenario())
+    assert forwarded == [('T1', 1)]
+    assert sorted(chat_id for chat_id, text in edits if text == driver.TRIP_TAKEN_TEXT) == [2, 3, 4, 5]
+
+
+def test_failed_forward_releases_the_claim_and_tells_the_driver():
+    registry = claims.MemoryClaims()
+    replies = iter([False, True])
+
+    async def forward_assignment(trip_id, driver_chat_id):
+        return next(replies)
+
+    edits = []
+    accept = make_handler({'claims': registry, 'forward_assignment': forward_assignment}, edits)
+    asyncio.run(accept(make_accept(1), None))
+    assert edits == [(1, driver.TRIP_ACCEPT_FAILED_TEXT.format(trip_id='T1'))]
+    assert registry.holder('T1') is None
+
+    asyncio.run(accept(make_accept(2), None))
+    assert registry.holder('T1') == '2' and edits[-1][1].startswith('\u2705')
+
+
+def test_claim_backend_failure_is_answered():
+    class Down(claims.MemoryClaims):
+        def _try_claim(self, trip_id, driver_id):
+            raise ConnectionError("Redis is unavailable")
+
+    edits = []
+    asyncio.run(make_handler({'claims': Down()}, edits)(make_accept(1), None))
+    assert edits == [(1, driver.TRIP_ACCEPT_FAILED_TEXT.format(trip_id='T1'))]
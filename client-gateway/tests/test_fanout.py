@@ -0,0 +1,163 @@
+import asyncio
+from types import SimpleNamespace
+
+import fanout
+import outbound
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeBot:
+    def __init__(self, fail=(), delay=0.0):
+        self.fail = set(fail)
+        self.delay = delay
+        self.sent = []
+        self.edited = []
+        self.markups = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if chat_id in self.fail:
+                raise RuntimeError("blocked by user")
+            self.sent.append(chat_id)
+            self.markups.add(id(kwargs['reply_markup']))
+            return SimpleNamespace(message_id=chat_id * 10)
+        finally:
+            self.in_flight -= 1
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.edited.append((chat_id, message_id))
+
+
+ORDER = {'trip_id': 'T1', 'pickup': 'вул. Хрещатик, 1', 'dropoff': 'вул. Саксаганського, 5'}
+
+
+def test_offer_sends_once_per_driver_with_shared_markup():
+    async def scenario():
+        bot = FakeBot(fail={3}, delay=0.01)
+        offer = await fanout.OfferFanout(concurrency=2).offer(bot, ORDER, [1, 2, 3, 4, 2])
+        return bot, offer
+
+    bot, offer = run(scenario())
+    assert sorted(bot.sent) == [1, 2, 4]
+    assert len(bot.markups) == 1
+    assert bot.max_in_flight == 2
+    assert offer.results[3].status == fanout.FAILED
+    assert offer.results[1].message_id == 10
+    assert offer.summary() == {fanout.SENT: 3, fanout.FAILED: 1}
+
+
+def test_offer_goes_through_scheduler():
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=10)
+        bot = FakeBot()
+        offer = await fanout.OfferFanout(scheduler).offer(bot, ORDER, [1, 2, 3])
+        await scheduler.stop()
+        return scheduler, offer
+
+    scheduler, offer = run(scenario())
+    assert scheduler.stats()['sent'] == 3
+    assert offer.summary() == {fanout.SENT: 3}
+
+
+def test_accept_cancels_pending_and_withdraws_delivered():
+    async def scenario():
+        bot = FakeBot(delay=0.05)
+        offers = fanout.OfferFanout(concurrency=2)
+        task = asyncio.ensure_future(offers.offer(bot, ORDER, [1, 2, 3, 4, 5]))
+        await asyncio.sleep(0.07)
+        offers.decline('T1', 2)
+        withdrawn = await offers.resolve('T1', 1)
+        offer = await task
+        return bot, offer, withdrawn
+
+    bot, offer, withdrawn = run(scenario())
+    assert offer.results[1].status == fanout.ACCEPTED
+    assert offer.results[2].status == fanout.DECLINED
+    assert withdrawn == 0
+    assert {offer.results[c].status for c in (3, 4, 5)} == {fanout.CANCELLED}
+    assert bot.edited == []
+
+
+def test_resolve_edits_other_delivered_offers():
+    async def scenario():
+        bot = FakeBot()
+        offers = fanout.OfferFanout()
+        offer = await offers.offer(bot, ORDER, [1, 2, 3])
+        withdrawn = await offers.resolve('T1', 2)
+        again = await offers.resolve('T1', 3)
+        return bot, offer, withdrawn, again
+
+    bot, offer, withdrawn, again = run(scenario())
+    assert withdrawn == 2 and again == 0
+    assert sorted(bot.edited) == [(1, 10), (3, 30)]
+    assert offer.results[2].status == fanout.ACCEPTED
+    assert offer.results[1].status == fanout.WITHDRAWN
+
+
+def test_cancelled_offers_are_not_delivered_and_late_ones_are_withdrawn():
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=5, chat_rate=1000, chat_burst=10)
+        scheduler.global_bucket.tokens = 1
+        bot = FakeBot(delay=0.02)
+        offers = fanout.OfferFanout(scheduler)
+        task = asyncio.ensure_future(offers.offer(bot, ORDER, list(range(1, 11))))
+        await asyncio.sleep(0.01)
+        await offers.resolve('T1', 5)
+        offer = await task
+        await asyncio.sleep(0.05)
+        await asyncio.gather(*offer._late)
+        await scheduler.stop()
+        return bot, offer, scheduler
+
+    bot, offer, scheduler = run(scenario())
+    # Only the offer already on its way went out, and it was retracted when it landed.
+    assert bot.sent == [1]
+    assert bot.edited == [(1, 10)]
+    assert offer.results[1].status == fanout.WITHDRAWN
+    assert offer.summary()[fanout.CANCELLED] == 8
+    assert scheduler.stats()['cancelled'] == 9
+
+
+def test_offer_is_dropped_once_every_driver_declined_or_failed():
+    async def scenario():
+        offers = fanout.OfferFanout()
+        await offers.offer(FakeBot(fail={3}), ORDER, [1, 2, 3])
+        offers.decline('T1', 1)
+        still_open = 'T1' in offers.active
+        offers.decline('T1', 2)
+        return still_open, offers
+
+    still_open, offers = run(scenario())
+    assert still_open
+    assert 'T1' not in offers.active
+
+
+def test_offer_nobody_could_receive_is_not_kept():
+    async def scenario():
+        offers = fanout.OfferFanout()
+        await offers.offer(FakeBot(fail={1, 2}), ORDER, [1, 2])
+        return offers
+
+    assert len(run(scenario()).active) == 0
+
+
+def test_unanswered_offer_expires():
+    now = [0.0]
+
+    async def scenario():
+        offers = fanout.OfferFanout(offer_ttl=60, clock=lambda: now[0])
+        await offers.offer(FakeBot(), ORDER, [1, 2])
+        now[0] = 61.0
+        return offers, await offers.resolve('T1', 1)
+
+    offers, withdrawn = run(scenario())
+    assert withdrawn == 0
+    assert len(offers.active) == 0
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import fares
+
+
+class CountingProvider(fares.LocalProvider):
+    def __init__(self):
+        super().__init__()
+        self.geocoded = 0
+        self.routed = 0
+
+    async def geocode(self, address):
+        self.geocoded += 1
+        return await super().geocode(address)
+
+    async def route_km(self, origin, destination):
+        self.routed += 1
+        return await super().route_km(origin, destination)
+
+
+def test_popular_route_is_served_from_cache():
+    provider = CountingProvider()
+    estimator = fares.FareEstimator(provider)
+
+    async def scenario():
+        first = await estimator.estimate('Вул. Хрещатик, 1', 'Аеропорт Бориспіль')
+        second = await estimator.estimate('  вул. хрещатик,  1 ', 'аеропорт бориспіль')
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.km == second.km == pytest.approx(29.2 * 1.3, rel=0.02)
+    assert provider.geocoded == 2 and provider.routed == 1
+    assert estimator.stats()['cache_hit_ratio'] == pytest.approx(1 / 4)
+
+
+def test_quote_applies_tariffs():
+    quote = asyncio.run(fares.FareEstimator(fares.LocalProvider(road_factor=1)).estimate('вокзал', 'Жуляни'))
+    assert [price for _, price in quote.prices] == [fares.Tariff('', '', per_km).price(quote.km) for per_km in (15, 25)]
+    assert fares.Tariff('x', '', per_km=15).price(10.01) == 151
+
+
+def test_unknown_addresses_get_no_quote():
+    estimator = fares.FareEstimator(fares.LocalProvider())
+    assert asyncio.run(estimator.estimate('вул. Невідома, 7', 'вокзал')) is None
+
+
+def test_quotes_are_off_unless_a_provider_is_configured(monkeypatch):
+    monkeypatch.delenv('FARE_PROVIDER', raising=False)
+    assert fares.provider_from_env() is None
+    monkeypatch.setenv('FARE_PROVIDER', 'local')
+    assert isinstance(fares.provider_from_env(), fares.LocalProvider)
+
+
+def test_provider_failure_gives_no_quote():
+    class Broken(fares.LocalProvider):
+        async def route_km(self, origin, destination):
+            raise ConnectionError("router down")
+
+    assert asyncio.run(fares.FareEstimator(Broken()).estimate('вокзал', 'аеропорт')) is None
+
+
+def test_rates_text_lists_tariffs():
+    assert "Тариф 'Стандарт': 15 грн/км" in fares.rates_text()
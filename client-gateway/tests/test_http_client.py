@@ -0,0 +1,80 @@
+import asyncio
+
+import http_client
+
+
+async def start_keepalive_server():
+    async def handle(reader, writer):
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                writer.close()
+                return
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            if length:
+                await reader.readexactly(length)
+            body = b'{"id": "trip-1", "status": "PENDING"}'
+            writer.write(
+                b"HTTP/1.1 201 Created\r\nContent-Type: application/json\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_pooled_client_reuses_connections():
+    async def scenario():
+        server, port = await start_keepalive_server()
+        client = http_client.PooledClient(f"http://127.0.0.1:{port}", http_client.PoolConfig())
+        await client.start()
+        try:
+            for _ in range(10):
+                resp = await client.post('/trips', json={'pickup': 'a'})
+                assert resp.status_code == 201
+            stats = client.stats()
+        finally:
+            await client.aclose()
+            server.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats['requests_total'] == 10
+    assert stats['connections_opened_total'] == 1
+    assert stats['reuse_ratio'] == 0.9
+    assert stats['requests_in_flight'] == 0
+
+
+def test_pool_config_from_env(monkeypatch):
+    monkeypatch.setenv('TRIP_SERVICE_MAX_CONNECTIONS', '7')
+    monkeypatch.setenv('TRIP_SERVICE_TIMEOUT', '2.5')
+    cfg = http_client.PoolConfig.from_env('TRIP_SERVICE')
+    assert cfg.max_connections == 7
+    assert cfg.timeout == 2.5
+    assert cfg.pool_timeout == 5.0
+
+
+def test_pooled_client_counts_requests_in_flight():
+    async def scenario():
+        server, port = await start_keepalive_server()
+        client = http_client.PooledClient(f"http://127.0.0.1:{port}")
+        try:
+            pending = [asyncio.create_task(client.get('/trips/trip-1')) for _ in range(3)]
+            await asyncio.sleep(0)
+            in_flight = client.stats()['requests_in_flight']
+            await asyncio.gather(*pending)
+            stats = client.stats()
+        finally:
+            await client.aclose()
+            server.close()
+        return in_flight, stats
+
+    in_flight, stats = asyncio.run(scenario())
+    assert in_flight == 3
+    assert stats['requests_in_flight'] == 0
+    assert stats['connections_opened_total'] == 3
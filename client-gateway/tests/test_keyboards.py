@@ -0,0 +1,57 @@
+import json
+import asyncio
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram.request import BaseRequest
+
+import keyboards
+
+
+class CaptureRequest(BaseRequest):
+    def __init__(self):
+        self.sent = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 1
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        self.sent.append(request_data.json_parameters)
+        message = {'message_id': 1, 'date': 0, 'chat': {'id': 5, 'type': 'private'}}
+        return 200, json.dumps({'ok': True, 'result': message}).encode()
+
+
+def offer_markup(trip_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Прийняти", callback_data=f"accept_trip_{trip_id}"),
+        InlineKeyboardButton("❌ Відхилити", callback_data=f"decline_trip_{trip_id}"),
+    ]])
+
+
+def test_cached_markup_goes_on_the_wire_like_the_original():
+    request = CaptureRequest()
+    bot = Bot('123:abc', request=request, get_updates_request=CaptureRequest())
+    menu = ReplyKeyboardMarkup([["\U0001F695 Замовити таксі"]], resize_keyboard=True)
+    registry = keyboards.MarkupRegistry()
+    cached = registry.static('menu', menu)
+
+    async def scenario():
+        await bot.send_message(5, 'hi', reply_markup=menu)
+        await bot.send_message(5, 'hi', reply_markup=cached)
+
+    asyncio.run(scenario())
+    original, fast = request.sent
+    assert original == fast
+    assert registry['menu'] is cached and registry.stats()['static'] == 1
+
+
+def test_template_renders_per_trip_markup():
+    template = keyboards.MarkupTemplate(offer_markup('{trip_id}'))
+    for trip_id in ('trip-1', 'a"b\\c'):
+        assert json.loads(template.render(trip_id=trip_id)) == offer_markup(trip_id).to_dict()
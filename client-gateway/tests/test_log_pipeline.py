@@ -0,0 +1,76 @@
+import io
+import json
+import logging
+import multiprocessing
+
+import log_pipeline
+
+
+def make_logger(name):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def test_writes_json_lines_from_a_background_thread():
+    logger = make_logger('test_pipeline.json')
+    out = io.StringIO()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(log_pipeline.JsonFormatter())
+    queue_handler = log_pipeline.install(logger, [handler])
+
+    logger.info("Trip %s accepted", 'T1', extra={'chat_id': 42})
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception("Failed")
+    queue_handler.listener.stop()
+
+    first, second = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert first['msg'] == 'Trip T1 accepted' and first['chat_id'] == 42 and first['level'] == 'INFO'
+    assert second['level'] == 'ERROR' and 'ValueError: boom' in second['exc']
+
+
+def test_full_queue_drops_info_but_keeps_warnings():
+    logger = make_logger('test_pipeline.full')
+    queue_handler = log_pipeline.DroppingQueueHandler(maxsize=2)
+    logger.addHandler(queue_handler)
+    for n in range(5):
+        logger.info("step %s", n)
+    logger.warning("service down")
+
+    queued = [queue_handler.queue.get_nowait().msg for _ in range(2)]
+    assert queued == ['step 1', 'service down']
+    assert queue_handler.stats()['dropped'] == 4
+
+
+def test_samples_noisy_loggers_per_call_site():
+    sampler = log_pipeline.SamplingFilter(('drive_ops.steps',), every=5)
+
+    def record(name, msg, level=logging.INFO):
+        return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+    kept = [sampler.filter(record('drive_ops.steps', 'Order data: %s')) for _ in range(10)]
+    assert kept.count(True) == 2
+    assert sampler.filter(record('drive_ops.steps', 'Sending confirmation %s'))
+    assert all(sampler.filter(record('drive_ops', 'Trip request success')) for _ in range(10))
+    assert sampler.filter(record('drive_ops.steps', 'Order data: %s', logging.WARNING))
+
+
+def test_child_records_are_written_by_the_parent_listener():
+    shared = multiprocessing.get_context('spawn').Queue()
+    parent, child = make_logger('test_pipeline.parent'), make_logger('test_pipeline.child')
+    parent_out, child_out = io.StringIO(), io.StringIO()
+    parent_handler = log_pipeline.install(parent, [logging.StreamHandler(parent_out)])
+    child_handler = log_pipeline.install(child, [logging.StreamHandler(child_out)])
+
+    log_pipeline.share(parent, shared)
+    log_pipeline.forward(child, shared)
+    child.info("from the shard")
+    parent.info("from the front")
+    parent_handler.listener.stop()
+
+    assert parent_out.getvalue().splitlines() == ["from the shard", "from the front"]
+    assert child_out.getvalue() == ''
+    assert child_handler.stats()['capacity'] == 10000
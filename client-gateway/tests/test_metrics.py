@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler, filters
+
+import metrics
+import routing
+from records import Step
+
+
+def test_counter_and_gauge_render_in_text_format():
+    registry = metrics.Registry()
+    sent = registry.counter('sent_total', 'Messages sent', ('method',))
+    sent.labels('sendMessage').inc()
+    sent.labels('sendMessage').inc(2)
+    registry.gauge('orders', 'Active orders', fn=lambda: 7)
+
+    text = registry.render()
+    assert '# TYPE sent_total counter' in text
+    assert 'sent_total{method="sendMessage"} 3' in text
+    assert 'orders 7' in text
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    registry = metrics.Registry()
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'latency_seconds_count 4' in lines
+    assert 'latency_seconds_sum 3.65' in lines
+
+
+def test_labels_are_checked_and_escaped():
+    registry = metrics.Registry()
+    errors = registry.counter('errors_total', 'Errors', ('handler', 'state'))
+    with pytest.raises(ValueError):
+        errors.labels('only_one')
+    errors.labels('say "hi"', 'PICKUP').inc()
+    assert 'errors_total{handler="say \\"hi\\"",state="PICKUP"} 1' in registry.render()
+    with pytest.raises(ValueError):
+        registry.counter('errors_total', 'Again')
+
+
+def test_collect_flattens_numeric_stats():
+    registry = metrics.Registry()
+    registry.collect('submit', lambda: {'requests': 3, 'circuit': {'state': 'closed', 'opened_total': 1}})
+    text = registry.render()
+    assert 'submit_requests 3' in text
+    assert 'submit_circuit_opened_total 1' in text
+    assert 'closed' not in text
+
+
+def test_timed_observes_duration_and_counts_errors():
+    registry = metrics.Registry()
+    latency = registry.histogram('helper_seconds', 'Helper latency')
+    errors = registry.counter('helper_errors_total', 'Helper errors')
+
+    async def fails():
+        raise RuntimeError('boom')
+
+    wrapped = metrics.timed(fails, latency, errors)
+    with pytest.raises(RuntimeError):
+        asyncio.run(wrapped())
+    assert wrapped.__name__ == 'fails'
+    assert latency._default.counts[0] == 1
+    assert errors._default.value == 1
+
+
+def test_instrument_handlers_labels_conversation_states_and_router_buttons():
+    async def start(update, context):
+        pass
+
+    async def start_order_flow(update, context):
+        pass
+
+    async def process_pickup_step(update, context):
+        pass
+
+    async def show_rates(update, context):
+        pass
+
+    registry = metrics.Registry()
+    latency = registry.histogram('handler_seconds', 'Handler latency', ('handler', 'state'))
+    errors = registry.counter('handler_errors_total', 'Handler errors', ('handler', 'state'))
+    app = Application.builder().token('1:x').build()
+    app.add_handler(CommandHandler('start', start))
+    router = routing.UpdateRouter()
+    router.on_text('\U0001F4B0 Тарифи', show_rates)
+    app.add_handler(router)
+    app.add_handler(ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_order_flow, pattern='^quick_order_taxi$')],
+        states={Step.PICKUP: [MessageHandler(filters.TEXT, process_pickup_step)]},
+        fallbacks=[],
+    ))
+
+    metrics.instrument_handlers(app, latency, errors)
+    metrics.instrument_handlers(app, latency, errors)
+    asyncio.run(app.handlers[0][0].callback(None, None))
+    asyncio.run(router.texts['\U0001F4B0 Тарифи'](None, None))
+
+    assert set(latency._children) == {
+        ('start', 'none'), ('show_rates', 'router'), ('start_order_flow', 'entry'), ('process_pickup_step', 'PICKUP'),
+    }
+    assert latency.labels('start', 'none').counts[0] == 1
+    assert latency.labels('show_rates', 'router').counts[0] == 1
+
+
+def test_instrument_helpers_wraps_only_coroutines():
+    registry = metrics.Registry()
+    latency = registry.histogram('helper_seconds', 'Helper latency', ('helper',))
+
+    async def safe_send(chat_id, text):
+        return text
+
+    def is_valid_address(address):
+        return True
+
+    offers = object()
+    helpers = metrics.instrument_helpers(
+        {'safe_send': safe_send, 'is_valid_address': is_valid_address, 'offers': offers}, latency)
+    assert asyncio.run(helpers['safe_send'](1, 'hi')) == 'hi'
+    assert helpers['is_valid_address'] is is_valid_address
+    assert helpers['offers'] is offers
+    assert latency.labels('safe_send').counts[0] == 1
+
+
+def test_scrape_endpoint_serves_registry():
+    registry = metrics.Registry()
+    registry.counter('scrapes_total', 'Scrapes').inc()
+
+    async def scenario():
+        server = metrics.metrics_server(registry, port=0)
+        await server.start()
+        try:
+            async with httpx.AsyncClient() as client:
+                return await client.get(f"http://127.0.0.1:{server.port}/metrics")
+        finally:
+            await server.stop()
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert 'scrapes_total 1' in resp.text
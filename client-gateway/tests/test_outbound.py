@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import outbound
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def recorder(log, label, result=None):
+    async def send():
+        log.append(label)
+        return result if result is not None else label
+    return send
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = outbound.TokenBucket(rate=2, capacity=1, clock=lambda: now[0])
+    assert bucket.delay(now[0]) == 0
+    bucket.consume(now[0])
+    assert bucket.delay(now[0]) == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.delay(now[0]) == 0
+
+
+def test_confirmations_jump_ahead_of_menus():
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=100)
+        log = []
+        await asyncio.gather(
+            scheduler.submit(1, recorder(log, 'menu'), priority=outbound.PRIORITY_MENU),
+            scheduler.submit(2, recorder(log, 'confirm'), priority=outbound.PRIORITY_CONFIRMATION),
+        )
+        await scheduler.stop()
+        return log
+
+    assert run(scenario()) == ['confirm', 'menu']
+
+
+def test_busy_chat_does_not_block_other_chats():
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=1000, chat_rate=20, chat_burst=1)
+        log = []
+        await asyncio.gather(
+            scheduler.submit(1, recorder(log, 'a1')),
+            scheduler.submit(1, recorder(log, 'a2')),
+            scheduler.submit(1, recorder(log, 'a3')),
+            scheduler.submit(2, recorder(log, 'b1')),
+        )
+        await scheduler.stop()
+        return log
+
+    assert run(scenario()) == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_retry_after_is_honoured():
+    async def scenario():
+        scheduler = outbound.SendScheduler()
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RetryAfter(0)
+            return 'ok'
+
+        result = await scheduler.submit(1, flaky)
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return result, stats
+
+    result, stats = run(scenario())
+    assert result == 'ok'
+    assert stats['retried'] == 1
+    assert stats['sent'] == 1
+
+
+def test_pending_edits_of_one_message_are_coalesced():
+    async def scenario():
+        scheduler = outbound.SendScheduler()
+        log = []
+        key = ('edit', 1, 10)
+        results = await asyncio.gather(*[
+            scheduler.submit(1, recorder(log, f"v{i}"), coalesce_key=key) for i in range(3)
+        ])
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return log, results, stats
+
+    log, results, stats = run(scenario())
+    assert log == ['v2']
+    assert results == ['v2', 'v2', 'v2']
+    assert stats['coalesced'] == 2
+
+
+def test_full_queue_drops_and_counts():
+    async def scenario():
+        scheduler = outbound.SendScheduler(max_queue=1)
+        first = asyncio.ensure_future(scheduler.submit(1, recorder([], 'a')))
+        await asyncio.sleep(0)
+        with pytest.raises(outbound.SendDropped):
+            await scheduler.submit(2, recorder([], 'b'))
+        await first
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return stats
+
+    stats = run(scenario())
+    assert stats['dropped'] == 1
+    assert stats['drop_rate'] == 0.5
+
+
+def test_cancelled_submits_are_dropped_from_the_queue():
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=1, chat_rate=1000, chat_burst=10)
+        log = []
+        first = asyncio.ensure_future(scheduler.submit(1, recorder(log, 'first')))
+        queued = asyncio.ensure_future(scheduler.submit(2, recorder(log, 'queued')))
+        shared = [asyncio.ensure_future(scheduler.submit(3, recorder(log, f"edit{i}"), coalesce_key=('edit', 3, 1)))
+                  for i in range(2)]
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        shared[0].cancel()
+        await asyncio.sleep(0)
+        scheduler.global_bucket.tokens = 10
+        scheduler._wakeup.set()
+        results = await asyncio.gather(first, shared[1])
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return log, results, stats
+
+    log, results, stats = run(scenario())
+    assert log == ['first', 'edit1']
+    assert results == ['first', 'edit1']
+    assert stats['cancelled'] == 1
+
+
+def test_rate_limited_chats_wait_until_their_bucket_refills():
+    async def scenario():
+        now = [0.0]
+        scheduler = outbound.SendScheduler(global_rate=1000, chat_rate=1, chat_burst=1, clock=lambda: now[0])
+        loop = asyncio.get_running_loop()
+        for chat_id in range(100):
+            scheduler._bucket(chat_id).consume(now[0])
+            scheduler._push(outbound._Job(chat_id, None, outbound.PRIORITY_DEFAULT, None, loop.create_future(), 0.0))
+        fresh = outbound._Job(100, None, outbound.PRIORITY_MENU, None, loop.create_future(), 0.0)
+        scheduler._push(fresh)
+
+        taken, _ = scheduler._take_ready(now[0])
+        parked = len(scheduler._waiting)
+        nothing, wait = scheduler._take_ready(now[0])
+        now[0] = 1.0
+        order = [scheduler._take_ready(now[0])[0].chat_id for _ in range(100)]
+        return taken is fresh, parked, nothing, wait, order, scheduler.stats()['queue_depth']
+
+    taken_fresh, parked, nothing, wait, order, depth = run(scenario())
+    assert taken_fresh
+    assert parked == 100
+    assert nothing is None and wait == pytest.approx(1.0)
+    assert order == list(range(100))
+    assert depth == 0
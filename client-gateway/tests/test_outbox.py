@@ -0,0 +1,128 @@
+import time
+import asyncio
+import sqlite3
+
+import pytest
+
+import outbox
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_outbox(tmp_path, submit, clock, **kwargs):
+    reported = []
+
+    async def on_result(entry, result, context):
+        reported.append((entry['request_id'], entry['message_id'], result and result.get('trip_id')))
+
+    box = outbox.TripOutbox(submit, on_result, str(tmp_path / 'outbox.db'), clock=clock, **kwargs)
+    return box, reported
+
+
+def unavailable(request_id):
+    return {'success': False, 'request_id': request_id, 'error': {'status_code': 503, 'message': 'down'}}
+
+
+def test_entries_survive_restart_and_are_delivered_once_service_recovers(tmp_path):
+    clock = Clock()
+    service_up = False
+    calls = []
+
+    async def submit(request_id, payload):
+        calls.append((request_id, payload['pickup']))
+        if not service_up:
+            return unavailable(request_id)
+        return {'success': True, 'request_id': request_id, 'trip_id': 'trip-' + request_id}
+
+    box, _ = make_outbox(tmp_path, submit, clock)
+    box.add('REQ-1', 42, 7, {'pickup': 'вокзал'})
+    box.add('REQ-1', 42, 7, {'pickup': 'вокзал'})
+    box.close()
+
+    box, reported = make_outbox(tmp_path, submit, clock)
+    assert len(box) == 1
+    assert asyncio.run(box.drain_once()) == 0
+
+    clock.now += 5
+    assert asyncio.run(box.drain_once()) == 1
+    assert len(box) == 1 and box.stats()['deferred'] == 1
+
+    service_up = True
+    clock.now += 60
+    asyncio.run(box.drain_once())
+    assert reported == [('REQ-1', 7, 'trip-REQ-1')]
+    assert calls == [('REQ-1', 'вокзал')] * 2
+    stats = box.stats()
+    assert stats['queued'] == 0 and stats['delivered'] == 1
+    assert stats['queue_age_max_s'] == 65
+
+
+def test_taken_entries_are_leased(tmp_path):
+    clock = Clock()
+    box, _ = make_outbox(tmp_path, None, clock, lease=30)
+    box.add('REQ-1', 1, 1, {})
+    clock.now += 5
+    assert [e['request_id'] for e in box.take_due()] == ['REQ-1']
+    assert box.take_due() == []
+    clock.now += 31
+    assert [e['request_id'] for e in box.take_due()] == ['REQ-1']
+
+
+def test_lease_is_renewed_while_a_submission_runs(tmp_path):
+    clock = Clock()
+    seen_by_other_worker = []
+
+    async def submit(request_id, payload):
+        # Slower than the lease: retries against a hanging Trip Service.
+        for _ in range(4):
+            clock.now += 0.02
+            await asyncio.sleep(0.02)
+        seen_by_other_worker.extend(other.take_due())
+        return {'success': True, 'request_id': request_id, 'trip_id': 'trip-1'}
+
+    box, reported = make_outbox(tmp_path, submit, clock, lease=0.03)
+    other, _ = make_outbox(tmp_path, None, clock, lease=0.03)
+    box.add('REQ-1', 1, 1, {})
+    clock.now += 5
+    asyncio.run(box.drain_once())
+    assert seen_by_other_worker == [] and reported == [('REQ-1', 1, 'trip-1')]
+
+
+def test_rejected_or_expired_entries_are_reported_as_failed(tmp_path):
+    clock = Clock()
+
+    async def submit(request_id, payload):
+        if request_id in ('REQ-bad', 'REQ-timeout'):
+            status_code = 400 if request_id == 'REQ-bad' else 504
+            return {'success': False, 'request_id': request_id, 'error': {'status_code': status_code, 'message': 'x'}}
+        return unavailable(request_id)
+
+    box, reported = make_outbox(tmp_path, submit, clock, max_age=100)
+    box.add('REQ-bad', 1, 1, {})
+    box.add('REQ-old', 2, 2, {})
+    clock.now += 150
+    # Fresh, but a timed out submission is not resubmitted: the trip may exist.
+    box.add('REQ-timeout', 3, 3, {})
+    clock.now += 5
+    asyncio.run(box.drain_once())
+    assert sorted(reported) == [('REQ-bad', 1, None), ('REQ-old', 2, None), ('REQ-timeout', 3, None)]
+    assert len(box) == 0 and box.stats()['failed'] == 3
+
+
+def test_a_locked_outbox_fails_fast_instead_of_blocking_the_loop(tmp_path):
+    box, _ = make_outbox(tmp_path, None, Clock(), timeout=0.05)
+    other = sqlite3.connect(str(tmp_path / 'outbox.db'), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    started = time.perf_counter()
+    with pytest.raises(sqlite3.OperationalError):
+        box.add('REQ-1', 1, 1, {})
+    assert time.perf_counter() - started < 1
+    other.execute("ROLLBACK")
+    box.add('REQ-1', 1, 1, {})
+    assert len(box) == 1
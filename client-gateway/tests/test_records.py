@@ -0,0 +1,44 @@
+import session_store
+from records import Order, Role, Step, SubmitResult
+
+
+def test_order_answers_the_dict_api():
+    order = Order(step=Step.PICKUP, request_id='REQ-1')
+    assert order.get('_in_progress') and order['pickup'] is None
+    order['pickup'] = 'вул. Хрещатик, 1'
+    order['_suggestions'] = ['a', 'b']
+    assert order.suggestions == ['a', 'b'] and order.get('comment', 'Не вказано') == 'Не вказано'
+    assert order.pop('_suggestions') == ['a', 'b'] and order.suggestions is None
+    assert order.get('unknown') is None and 'pickup' in order
+
+
+def test_in_progress_is_the_step_and_can_be_written():
+    order = Order(step=Step.DROPOFF)
+    order['_in_progress'] = True
+    assert order.step is Step.DROPOFF
+    order['_in_progress'] = False
+    assert order.step is None and not order.get('_in_progress')
+    order['_in_progress'] = True
+    assert order.step is Step.PICKUP
+    assert order.pop('_in_progress') is True and order.step is None
+
+
+def test_records_round_trip_through_json_stores(tmp_path):
+    store = session_store.SQLiteStore('orders', str(tmp_path / 's.db'), record=Order)
+    order = Order(pickup='вокзал', dropoff='аеропорт', step=Step.COMMENT, request_id='REQ-2')
+    store[1] = order
+    loaded = store[1]
+    assert loaded == order and loaded.step is Step.COMMENT
+
+    store[2] = {'pickup': 'вокзал', 'dropoff': None, 'comment': None, '_in_progress': True}
+    assert store[2].in_progress and store[2].pickup == 'вокзал'
+
+    roles = session_store.SQLiteStore('roles', str(tmp_path / 's.db'))
+    roles[1] = Role.DRIVER
+    assert roles[1] == Role.DRIVER
+
+
+def test_submit_result_failure_shape():
+    result = SubmitResult.failure('REQ-3', 503, 'down')
+    assert not result['success'] and (result.get('error') or {}).get('status_code') == 503
+    assert result.to_dict()['error'] == {'status_code': 503, 'message': 'down'}
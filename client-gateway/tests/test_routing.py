@@ -0,0 +1,60 @@
+import datetime
+from types import SimpleNamespace
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import Application, CommandHandler
+
+import routing
+import webhook
+
+CHAT = Chat(1, 'private')
+USER = User(1, 'passenger', False)
+
+
+def text_update(text):
+    return Update(1, message=Message(1, datetime.datetime.now(), CHAT, text=text))
+
+
+def callback_update(data):
+    return Update(1, callback_query=CallbackQuery('1', USER, 'chat', data=data))
+
+
+def make_router():
+    router = routing.UpdateRouter()
+    handlers = SimpleNamespace(**{name: object() for name in ('rates', 'order', 'accept', 'quick', 'quick_more')})
+    router.on_text('\U0001F4B0 Тарифи', handlers.rates)
+    router.on_callback('order_', handlers.order)
+    router.on_callback('accept_trip_', handlers.accept)
+    router.on_callback('quick_order_taxi', handlers.quick, exact=True)
+    router.on_callback('quick_', handlers.quick_more)
+    return router, handlers
+
+
+def test_routes_button_text_exactly():
+    router, handlers = make_router()
+    assert router.check_update(text_update('\U0001F4B0 Тарифи')) is handlers.rates
+    assert router.check_update(text_update('\U0001F4B0 Тарифи ')) is None
+    assert router.check_update(text_update('вул. Хрещатик, 1')) is None
+
+
+def test_routes_callback_data_by_longest_prefix():
+    router, handlers = make_router()
+    assert router.check_update(callback_update('order_confirm')) is handlers.order
+    assert router.check_update(callback_update('accept_trip_42')) is handlers.accept
+    assert router.check_update(callback_update('quick_order_taxi')) is handlers.quick
+    assert router.check_update(callback_update('quick_order_taxi_2')) is handlers.quick_more
+    assert router.check_update(callback_update('addr_pickup_0')) is None
+    assert router.check_update(callback_update('accept_')) is None
+
+
+def test_webhook_subscribes_to_routed_update_types():
+    async def noop(update, context):
+        pass
+
+    app = Application.builder().token('1:x').build()
+    app.add_handler(CommandHandler('start', noop))
+    router = routing.UpdateRouter()
+    app.add_handler(router)
+    assert webhook.allowed_updates(app) == ['message']
+    router.on_callback('order_', noop)
+    assert webhook.allowed_updates(app) == ['callback_query', 'message']
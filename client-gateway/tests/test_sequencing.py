@@ -0,0 +1,181 @@
+import random
+import asyncio
+from types import SimpleNamespace
+
+import passenger
+import sequencing
+import session_store
+from records import Role, Step
+
+
+def chat_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_chats_run_in_parallel_and_each_chat_in_order():
+    sequencer = sequencing.ChatSequencer(max_running=8)
+    log = []
+    running = {'now': 0, 'max': 0}
+
+    async def handle(chat_id, n):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(random.uniform(0, 0.005))
+        log.append((chat_id, n))
+        running['now'] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(sequencer.process_update(chat_update(chat_id), handle(chat_id, n))
+                               for n in range(5) for chat_id in range(20)))
+
+    asyncio.run(scenario())
+    for chat_id in range(20):
+        assert [n for c, n in log if c == chat_id] == list(range(5))
+    assert 1 < running['max'] <= 8
+    stats = sequencer.stats()
+    assert stats['processed'] == 100 and stats['waited_for_chat'] == 80
+    assert stats['chats_in_flight'] == 0 and stats['running'] == 0
+
+
+def test_a_flooding_chat_does_not_hold_running_slots():
+    sequencer = sequencing.ChatSequencer(max_running=2)
+    done = []
+
+    async def handle(chat_id):
+        await asyncio.sleep(0.01)
+        done.append(chat_id)
+
+    async def scenario():
+        flood = [asyncio.ensure_future(sequencer.process_update(chat_update(1), handle(1))) for _ in range(10)]
+        await asyncio.sleep(0)
+        await sequencer.process_update(chat_update(2), handle(2))
+        await asyncio.gather(*flood)
+
+    asyncio.run(scenario())
+    assert done.index(2) <= 1
+
+
+class PassengerChats:
+    """Passenger handlers wired to fakes, with updates built for a scripted burst per chat."""
+
+    def __init__(self, chats, rng):
+        self.rng = rng
+        self.user_orders = session_store.MemoryStore('orders')
+        self.user_roles = session_store.MemoryStore('roles')
+        for chat_id in chats:
+            self.user_roles[chat_id] = Role.PASSENGER
+        self.submitted = []
+        handlers = []
+        helpers = {
+            'safe_send': self.pause,
+            'safe_edit_message_text': self.pause,
+            'safe_edit_message_reply_markup': self.pause,
+            'submit_trip_request': self.submit,
+            'is_valid_address': lambda address: len(address) > 3,
+        }
+        keyboards = {name: lambda *args: None for name in ('passenger_menu', 'skip_menu', 'get_user_menu')}
+        buttons = {'BTN_PASSENGER': 'passenger', 'BTN_ORDER_TAXI': 'order', 'BTN_RATES': 'rates', 'BTN_SKIP': 'skip'}
+        passenger.register_handlers(SimpleNamespace(add_handler=handlers.append), self.user_orders,
+                                    self.user_roles, buttons, keyboards, helpers)
+        router, conversation = handlers
+        self.order_status = router.match_callback('order_confirm')
+        self.start_order, self.quick_order = (handler.callback for handler in conversation.entry_points)
+        self.steps = [conversation.states[step][0].callback for step in Step]
+        self.context = SimpleNamespace(bot=None)
+
+    async def pause(self, *args, **kwargs):
+        await asyncio.sleep(self.rng.uniform(0, 0.002))
+
+    async def submit(self, chat_id, order):
+        await asyncio.sleep(self.rng.uniform(0, 0.01))
+        self.submitted.append((chat_id, order['request_id'], order['pickup'], order['dropoff']))
+        return {'success': True, 'trip_id': f"T-{order['request_id']}", 'request_id': order['request_id'],
+                'status': 'PENDING'}
+
+    def message(self, chat_id, text):
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id),
+                               message=SimpleNamespace(text=text))
+
+    def callback(self, chat_id, data):
+        query = SimpleNamespace(data=data, message=SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=1),
+                                answer=self.pause)
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), callback_query=query)
+
+    def script(self, chat_id):
+        """Two orders sent back to back, the first confirmed with a double tap."""
+        pickup, dropoff, comment = self.steps
+        return [
+            (self.start_order, self.message(chat_id, 'order')),
+            (pickup, self.message(chat_id, f"вул. Хрещатик, {chat_id}")),
+            (dropoff, self.message(chat_id, f"вул. Саксаганського, {chat_id}")),
+            (comment, self.message(chat_id, 'skip')),
+            (self.order_status, self.callback(chat_id, 'order_confirm')),
+            (self.order_status, self.callback(chat_id, 'order_confirm')),
+            (self.quick_order, self.callback(chat_id, 'quick_order_taxi')),
+            (pickup, self.message(chat_id, f"вул. Велика Васильківська, {chat_id}")),
+            (dropoff, self.message(chat_id, f"вул. Антоновича, {chat_id}")),
+            (comment, self.message(chat_id, 'skip')),
+            (self.order_status, self.callback(chat_id, 'order_confirm')),
+        ]
+
+    def broken_chats(self, chats):
+        """Chats that did not end with exactly their two orders submitted once each."""
+        broken = set()
+        for chat_id in chats:
+            orders = [entry for entry in self.submitted if entry[0] == chat_id]
+            routes = [(pickup, dropoff) for _, _, pickup, dropoff in orders]
+            if routes != [(f"вул. Хрещатик, {chat_id}", f"вул. Саксаганського, {chat_id}"),
+                          (f"вул. Велика Васильківська, {chat_id}", f"вул. Антоновича, {chat_id}")]:
+                broken.add(chat_id)
+            elif len({request_id for _, request_id, _, _ in orders}) != 2 or chat_id in self.user_orders:
+                broken.add(chat_id)
+        return broken
+
+
+def test_order_step_follows_the_conversation():
+    bot = PassengerChats([1], random.Random(1))
+    pickup, dropoff, comment = bot.steps
+    seen = []
+
+    async def scenario():
+        await bot.start_order(bot.message(1, 'order'), bot.context)
+        for handler, text in ((pickup, "вул. Хрещатик, 1"), (dropoff, "вул. Антоновича, 2"), (comment, 'skip')):
+            seen.append(bot.user_orders[1].step)
+            await handler(bot.message(1, text), bot.context)
+        seen.append(bot.user_orders[1].step)
+
+    asyncio.run(scenario())
+    assert seen == [Step.PICKUP, Step.DROPOFF, Step.COMMENT, Step.COMMENT]
+
+
+def run_burst(sequencer, chats=200, seed=3):
+    chat_ids = range(1, chats + 1)
+    bot = PassengerChats(chat_ids, random.Random(seed))
+    scripts = [bot.script(chat_id) for chat_id in chat_ids]
+
+    async def scenario():
+        tasks = []
+        # Every update of every chat arrives at once, the chats' updates interleaved.
+        for step in zip(*scripts):
+            for callback, update in step:
+                coroutine = callback(update, bot.context)
+                if sequencer is not None:
+                    coroutine = sequencer.process_update(update, coroutine)
+                tasks.append(asyncio.ensure_future(coroutine))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    return bot.broken_chats(chat_ids), bot
+
+
+def test_order_bursts_lose_or_duplicate_nothing_when_sequenced():
+    sequencer = sequencing.ChatSequencer(max_running=64)
+    broken, bot = run_burst(sequencer)
+    assert broken == set()
+    assert len(bot.submitted) == 400
+    assert sequencer.stats()['chats_in_flight'] == 0
+
+
+def test_order_bursts_race_without_sequencing():
+    broken, _ = run_burst(None)
+    assert len(broken) > 100
@@ -0,0 +1,219 @@
+import time
+import socket
+import asyncio
+import fnmatch
+import socketserver
+import threading
+
+import pytest
+
+import session_store
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis server for RedisStore: GET/SET/DEL/EXISTS/SCAN."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.data = {}
+        super().__init__(('127.0.0.1', 0), RespHandler)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode())
+        return args
+
+    def bulk(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            cmd = args[0].upper()
+            if cmd == 'GET':
+                reply = self.bulk(data.get(args[1]))
+            elif cmd == 'SET':
+                previous = data.get(args[1])
+                data[args[1]] = args[2]
+                reply = self.bulk(previous) if 'GET' in args[3:] else b"+OK\r\n"
+            elif cmd == 'DEL':
+                reply = b":%d\r\n" % int(data.pop(args[1], None) is not None)
+            elif cmd == 'EXISTS':
+                reply = b":%d\r\n" % int(args[1] in data)
+            elif cmd == 'SCAN':
+                keys = [k for k in data if fnmatch.fnmatch(k, args[3])]
+                reply = b"*2\r\n" + self.bulk('0') + b"*%d\r\n" % len(keys) + b''.join(self.bulk(k) for k in keys)
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = session_store.MemoryStore('orders', maxsize=2)
+    store[1] = {'pickup': 'a'}
+    store[2] = {'pickup': 'b'}
+    store[1]
+    store[3] = {'pickup': 'c'}
+    assert set(store) == {1, 3}
+    assert store.evictions == 1
+
+
+def test_memory_store_expires_entries():
+    clock = FakeClock()
+    store = session_store.MemoryStore('orders', ttl=60, clock=clock)
+    store[1] = {'pickup': 'a'}
+    clock.now += 61
+    assert 1 not in store
+    assert len(store) == 0
+    assert store.active == 0
+
+
+def test_stores_count_inserts_and_deletes(tmp_path, resp_server):
+    conn = session_store.RespConnection('127.0.0.1', resp_server.server_address[1])
+    for store in (session_store.MemoryStore('orders', maxsize=2),
+                  session_store.SQLiteStore('orders', str(tmp_path / 's.db')),
+                  session_store.RedisStore('orders', conn)):
+        store[1] = {'pickup': 'a'}
+        store[1] = {'pickup': 'b'}
+        store[2] = {'pickup': 'c'}
+        store.pop(1)
+        store.pop(1, None)
+        assert (store.inserts, store.deletes, store.active) == (2, 1, 1), type(store).__name__
+        store.close()
+
+
+def test_sqlite_store_survives_reopen(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = session_store.SQLiteStore('orders', path)
+    store[42] = {'pickup': 'вул. Хрещатик, 1', 'dropoff': None, '_in_progress': True}
+    store.close()
+
+    reopened = session_store.SQLiteStore('orders', path)
+    assert list(reopened) == [42]
+    assert reopened[42]['pickup'] == 'вул. Хрещатик, 1'
+    assert reopened.pop(42)['_in_progress'] is True
+    assert 42 not in reopened
+    assert len(session_store.SQLiteStore('roles', path)) == 0
+
+
+def test_sqlite_store_ttl(tmp_path):
+    clock = FakeClock()
+    store = session_store.SQLiteStore('roles', str(tmp_path / 's.db'), ttl=10, clock=clock)
+    store[7] = 'driver'
+    clock.now += 11
+    assert store.get(7) is None
+    assert store.purge_expired() == 1
+
+
+def test_redis_store_against_stand_in(resp_server):
+    conn = session_store.RespConnection('127.0.0.1', resp_server.server_address[1])
+    store = session_store.RedisStore('orders', conn)
+    store[5] = {'pickup': 'Аеропорт'}
+    store[6] = {'pickup': 'Вокзал'}
+    assert store[5] == {'pickup': 'Аеропорт'}
+    assert sorted(store) == [5, 6]
+    del store[5]
+    assert 5 not in store
+    assert len(store) == 1
+    store.close()
+
+
+def test_disk_and_network_stores_answer_handlers_off_the_event_loop(tmp_path, resp_server):
+    conn = session_store.RespConnection('127.0.0.1', resp_server.server_address[1])
+    stores = [session_store.SQLiteStore('orders', str(tmp_path / 's.db')), session_store.RedisStore('orders', conn)]
+
+    async def scenario(store):
+        loop_thread = threading.get_ident()
+        threads = set()
+        get = store.get
+
+        def tracked_get(key, default=None):
+            threads.add(threading.get_ident())
+            return get(key, default)
+
+        store.get = tracked_get
+        await store.aset(1, {'pickup': 'a'})
+        assert await store.acontains(1)
+        assert await store.aget(1) == {'pickup': 'a'}
+        assert await store.akeys() == [1]
+        assert await store.apop(1) == {'pickup': 'a'}
+        assert await store.apop(1) is None
+        return threads, loop_thread
+
+    for store in stores:
+        threads, loop_thread = asyncio.run(scenario(store))
+        assert len(threads) == 1 and loop_thread not in threads
+        store.close()
+
+    memory = session_store.MemoryStore('orders')
+    asyncio.run(memory.aset(1, 'x'))
+    assert memory[1] == 'x'
+
+
+def test_redis_connection_fails_fast_when_the_server_hangs():
+    silent = socket.create_server(('127.0.0.1', 0))
+    clock = FakeClock()
+    conn = session_store.RespConnection('127.0.0.1', silent.getsockname()[1], timeout=0.05, clock=clock)
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        conn.execute('GET', 'k')
+    assert time.perf_counter() - started < 0.5
+    # Down: later commands do not reconnect and wait again.
+    with pytest.raises(ConnectionError):
+        conn.execute('GET', 'k')
+    assert conn.failures == 1
+    silent.close()
+
+
+def test_redis_connection_reopens_a_dropped_connection(resp_server):
+    conn = session_store.RespConnection('127.0.0.1', resp_server.server_address[1])
+    assert conn.execute('SET', 'k', 'v') == 'OK'
+    conn._sock.close()
+    assert conn.execute('GET', 'k') == 'v'
+    assert conn.failures == 0
+    conn.close()
+
+
+def test_conversation_persistence_roundtrip():
+    persistence = session_store.ConversationPersistence(session_store.MemoryStore('conversations'))
+
+    async def scenario():
+        await persistence.update_conversation('order_conversation', (1, 1), 2)
+        await persistence.update_conversation('order_conversation', (3, 3), 0)
+        await persistence.update_conversation('order_conversation', (3, 3), None)
+        return await persistence.get_conversations('order_conversation')
+
+    assert asyncio.run(scenario()) == {(1, 1): 2}
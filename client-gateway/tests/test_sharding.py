@@ -0,0 +1,82 @@
+import asyncio
+import multiprocessing
+import queue
+from types import SimpleNamespace
+
+import sharding
+
+
+def make_update(chat_id):
+    return {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}}}
+
+
+def test_update_chat_id_for_messages_and_callbacks():
+    assert sharding.update_chat_id(make_update(10)) == 10
+    assert sharding.update_chat_id({'update_id': 2, 'callback_query': {
+        'id': 'q', 'from': {'id': 7}, 'message': {'chat': {'id': 11}}}}) == 11
+    assert sharding.update_chat_id({'update_id': 3, 'callback_query': {'id': 'q', 'from': {'id': 7}}}) == 7
+
+
+def test_hash_ring_only_remaps_keys_of_removed_node():
+    ring = sharding.HashRing()
+    for node in range(4):
+        ring.add(node)
+    before = {chat_id: ring.node_for(chat_id) for chat_id in range(2000)}
+    assert set(before.values()) == {0, 1, 2, 3}
+
+    ring.remove(2)
+    after = {chat_id: ring.node_for(chat_id) for chat_id in range(2000)}
+    moved = [chat_id for chat_id in before if before[chat_id] != after[chat_id]]
+    assert moved and all(before[chat_id] == 2 for chat_id in moved)
+    assert 2 not in after.values()
+
+
+def test_dispatch_keeps_each_chat_on_one_shard(monkeypatch):
+    def fake_spawn(self, shard_id):
+        return sharding.Shard(shard_id, multiprocessing.current_process(), queue.Queue(), multiprocessing.Value('q', 0))
+
+    monkeypatch.setattr(sharding.ShardDispatcher, '_spawn', fake_spawn)
+    dispatcher = sharding.ShardDispatcher(build_application=None, workers=3)
+    dispatcher.start()
+
+    async def scenario():
+        for step in range(3):
+            for chat_id in range(50):
+                await dispatcher.dispatch(make_update(chat_id))
+
+    asyncio.run(scenario())
+
+    seen = {}
+    for shard in dispatcher.shards.values():
+        while not shard.queue.empty():
+            chat_id = sharding.update_chat_id(shard.queue.get())
+            assert seen.setdefault(chat_id, shard.shard_id) == shard.shard_id
+    assert len(seen) == 50
+
+    stats = dispatcher.stats()
+    assert stats['workers'] == 3
+    assert sum(s['dispatched'] for s in stats['shards']) == 150
+    assert sum(s['queue_depth'] for s in stats['shards']) == 150
+
+
+def test_restarting_a_dead_worker_counts_its_lost_updates(monkeypatch):
+    spawned = []
+
+    def fake_spawn(self, shard_id):
+        alive = bool(spawned)
+        process = SimpleNamespace(is_alive=lambda: alive, exitcode=-9, pid=None)
+        spawned.append(shard_id)
+        return sharding.Shard(shard_id, process, multiprocessing.Queue(), multiprocessing.Value('q', 0))
+
+    monkeypatch.setattr(sharding.ShardDispatcher, '_spawn', fake_spawn)
+    dispatcher = sharding.ShardDispatcher(build_application=None, workers=1)
+    dispatcher.start()
+    shard = dispatcher.shards[0]
+    shard.dispatched = 5
+    shard.processed.value = 2
+
+    dispatcher.restart_dead_workers()
+    assert spawned == [0, 0]
+    assert dispatcher.shards[0] is not shard
+    assert dispatcher.stats()['lost'] == 3
+    assert dispatcher.shards[0].depth == 0
@@ -0,0 +1,122 @@
+import json
+import random
+import asyncio
+
+import httpx
+
+import outbound
+import tracing
+import trip_submit
+
+
+class ListCollector:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+
+def make_tracer(sample_rate=1.0):
+    collector = ListCollector()
+    return tracing.Tracer('client-gateway', collector, sample_rate, random.Random(1)), collector
+
+
+def test_traceparent_round_trip_and_rejects_malformed():
+    context = tracing.SpanContext('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', True)
+    parsed = tracing.SpanContext.from_traceparent(context.traceparent())
+    assert (parsed.trace_id, parsed.span_id, parsed.sampled) == (context.trace_id, context.span_id, True)
+    for header in (None, '', 'garbage', '00-abc-def-01', f"00-{'0' * 32}-00f067aa0ba902b7-01",
+                   '00-4bf92f3577b34da6a3ce929d0e0e473z-00f067aa0ba902b7-01'):
+        assert tracing.SpanContext.from_traceparent(header) is None
+
+
+def test_child_spans_share_the_trace_and_point_at_their_parent():
+    tracer, collector = make_tracer()
+    with tracer.span('telegram.update', chat_id=1) as root:
+        with tracer.span('trip_service.create'):
+            headers = tracer.headers(correlation_id='REQ-1')
+    child, parent = collector.spans
+    assert child['trace_id'] == parent['trace_id'] == root.context.trace_id
+    assert child['parent_id'] == parent['span_id'] and parent['parent_id'] is None
+    assert headers['X-Correlation-ID'] == 'REQ-1'
+    assert tracing.SpanContext.from_traceparent(headers['traceparent']).span_id == child['span_id']
+
+
+def test_sampling_keeps_or_drops_whole_traces():
+    tracer, collector = make_tracer(sample_rate=0.3)
+    for _ in range(200):
+        with tracer.span('telegram.update'):
+            with tracer.span('bot_api.sendMessage'):
+                pass
+    by_trace = {}
+    for span in collector.spans:
+        by_trace.setdefault(span['trace_id'], []).append(span['name'])
+    assert 30 < len(by_trace) < 90
+    assert all(sorted(names) == ['bot_api.sendMessage', 'telegram.update'] for names in by_trace.values())
+
+    unsampled, collector = make_tracer(sample_rate=0.0)
+    with unsampled.span('telegram.update'):
+        assert unsampled.headers()['traceparent'].endswith('-00')
+    assert collector.spans == []
+
+
+def test_errors_are_recorded_on_the_span():
+    tracer, collector = make_tracer()
+    try:
+        with tracer.span('telegram.update'):
+            raise ValueError('bad update')
+    except ValueError:
+        pass
+    assert collector.spans[0]['error'] == 'ValueError: bad update'
+
+
+def test_trip_request_carries_trace_headers(monkeypatch):
+    tracer, collector = make_tracer()
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+    sent = []
+
+    class Service:
+        async def post(self, url, json=None, headers=None):
+            sent.append(headers)
+            return httpx.Response(201, json={'id': 'trip-1', 'status': 'PENDING'})
+
+    async def scenario():
+        with tracer.span('telegram.update'):
+            return await trip_submit.TripSubmitter(Service()).submit('REQ-7', {})
+
+    assert asyncio.run(scenario())['success']
+    create, update = collector.spans
+    assert create['name'] == 'trip_service.create' and create['attributes']['correlation_id'] == 'REQ-7'
+    assert sent[0]['X-Correlation-ID'] == 'REQ-7' and sent[0]['Idempotency-Key'] == 'REQ-7'
+    assert sent[0]['traceparent'].split('-')[1:3] == [update['trace_id'], create['span_id']]
+
+
+def test_queued_sends_run_under_the_submitting_span():
+    tracer, _ = make_tracer()
+    seen = []
+
+    async def send():
+        seen.append(tracing.current_span())
+
+    async def scenario():
+        scheduler = outbound.SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=100)
+        with tracer.span('telegram.update') as span:
+            await scheduler.submit(1, send)
+        await scheduler.stop()
+        return span
+
+    assert seen == [asyncio.run(scenario())]
+
+
+def test_jsonl_collector_writes_one_span_per_line(tmp_path):
+    path = tmp_path / 'spans' / 'spans.jsonl'
+    collector = tracing.JsonlCollector(str(path))
+    tracer = tracing.Tracer('client-gateway', collector, 1.0)
+    for name in ('telegram.update', 'bot_api.sendMessage'):
+        with tracer.span(name):
+            pass
+    collector.close()
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [line['name'] for line in lines] == ['telegram.update', 'bot_api.sendMessage']
+    assert collector.stats() == {'queued': 0, 'exported': 2, 'dropped': 0}
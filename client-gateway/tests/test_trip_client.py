@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+
+import trip_client
+
+
+class FakeTripService:
+    """GET /trips/{id} with ETags: the ETag is the trip's version."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.trips = {}
+        self.calls = []
+
+    def set(self, trip_id, status):
+        version = self.trips.get(trip_id, (None, 0))[1] + 1
+        self.trips[trip_id] = ({'id': trip_id, 'status': status}, version)
+
+    async def get(self, url, headers=None):
+        trip_id = url.rsplit('/', 1)[1]
+        self.calls.append((trip_id, headers.get('If-None-Match')))
+        await asyncio.sleep(self.delay)
+        reply = self.trips.get(trip_id)
+        if isinstance(reply, Exception):
+            raise reply
+        if reply is None:
+            return httpx.Response(404, text='Trip not found')
+        trip, version = reply
+        etag = f'"v{version}"'
+        if headers.get('If-None-Match') == etag:
+            return httpx.Response(304, headers={'ETag': etag})
+        return httpx.Response(200, json=trip, headers={'ETag': etag})
+
+
+def make_client(service, ttl=2.0):
+    now = [0.0]
+    return trip_client.TripClient(service, ttl=ttl, clock=lambda: now[0]), now
+
+
+def test_concurrent_lookups_share_one_request():
+    service = FakeTripService(delay=0.01)
+    service.set('T1', 'PENDING')
+    client, _ = make_client(service)
+
+    async def scenario():
+        return await asyncio.gather(*(client.get('T1') for _ in range(20)))
+
+    trips = asyncio.run(scenario())
+    assert all(trip == {'id': 'T1', 'status': 'PENDING'} for trip in trips)
+    assert service.calls == [('T1', None)]
+    assert client.stats()['coalesced'] == 19
+
+
+def test_expired_entry_is_revalidated_with_its_etag():
+    service = FakeTripService()
+    service.set('T1', 'PENDING')
+    client, now = make_client(service)
+
+    async def scenario():
+        first = await client.get('T1')
+        now[0] = 1.0
+        cached = await client.get('T1')
+        now[0] = 2.5
+        revalidated = await client.get('T1')
+        return first, cached, revalidated
+
+    first, cached, revalidated = asyncio.run(scenario())
+    assert first == cached == revalidated
+    assert service.calls == [('T1', None), ('T1', '"v1"')]
+    stats = client.stats()
+    assert stats['cache_hits'] == 1 and stats['not_modified'] == 1
+
+
+def test_status_event_invalidates_the_cached_trip():
+    service = FakeTripService()
+    service.set('T1', 'PENDING')
+    client, _ = make_client(service)
+
+    async def scenario():
+        await client.get('T1')
+        service.set('T1', 'CONFIRMED')
+        stale = await client.get('T1')
+        client.handle_event({'event_type': 'trip.event.driver_assigned', 'payload': {'trip_id': 'T1'}})
+        return stale, await client.get('T1')
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale['status'] == 'PENDING' and fresh['status'] == 'CONFIRMED'
+    assert service.calls == [('T1', None), ('T1', '"v1"')]
+
+
+def test_invalidation_during_a_request_starts_a_new_one():
+    service = FakeTripService(delay=0.01)
+    service.set('T1', 'PENDING')
+    client, _ = make_client(service)
+
+    async def scenario():
+        early = asyncio.ensure_future(client.get('T1'))
+        await asyncio.sleep(0)
+        service.set('T1', 'CONFIRMED')
+        client.invalidate('T1')
+        late = await client.get('T1')
+        return await early, late, await client.get('T1')
+
+    early, late, cached = asyncio.run(scenario())
+    assert late['status'] == cached['status'] == 'CONFIRMED'
+    assert len(service.calls) == 2
+
+
+def test_failures_serve_the_cached_copy():
+    service = FakeTripService()
+    service.set('T1', 'PENDING')
+    client, now = make_client(service)
+
+    async def scenario():
+        await client.get('T1')
+        service.trips['T1'] = httpx.ConnectError('refused')
+        now[0] = 5.0
+        return await client.get('T1'), await client.get('unknown')
+
+    stale, unknown = asyncio.run(scenario())
+    assert stale['status'] == 'PENDING' and unknown is None
+    assert client.stats()['stale_served'] == 1
+
+
+def test_polling_storm_costs_an_order_of_magnitude_fewer_upstream_calls():
+    service = FakeTripService()
+    for n in range(10):
+        service.set(f"T{n}", 'PENDING')
+    client, now = make_client(service)
+
+    async def scenario():
+        # 200 passengers polling 10 trips every 100 ms for 10 s; one trip changes at 5 s.
+        for tick in range(100):
+            now[0] = tick * 0.1
+            if tick == 50:
+                service.set('T3', 'CONFIRMED')
+                client.invalidate('T3')
+            await asyncio.gather(*(client.get(f"T{p % 10}") for p in range(200)))
+
+    asyncio.run(scenario())
+    stats = client.stats()
+    assert stats['lookups'] == 20000
+    assert stats['upstream_requests'] <= 60
+    assert stats['upstream_ratio'] < 0.01
+    assert stats['not_modified'] >= 40
@@ -0,0 +1,88 @@
+import asyncio
+
+import trip_events
+
+
+def event(event_type, trip_id='T1', **payload):
+    return {'event_type': event_type, 'event_version': '1.0', 'payload': {'trip_id': trip_id, **payload}}
+
+
+def run_notifier(events, window=0.05, pause=0.0):
+    async def scenario():
+        broker = trip_events.LocalBroker()
+        edits = []
+
+        async def edit(chat_id, message_id, text, context, **kwargs):
+            edits.append((chat_id, message_id, text))
+
+        notifier = trip_events.TripStatusNotifier(broker, edit, lambda trip_id, status: f"{trip_id}:{status}",
+                                                  coalesce_window=window)
+        notifier.watch('T1', 42, 7)
+        notifier.start(None)
+        await asyncio.sleep(0)
+        for e in events:
+            await broker.publish(e)
+            await asyncio.sleep(pause)
+        await asyncio.sleep(window * 3)
+        await notifier.stop()
+        return edits, notifier
+
+    return asyncio.run(scenario())
+
+
+def test_rapid_transitions_collapse_into_one_edit():
+    edits, notifier = run_notifier([
+        event('trip.event.driver_assigned', driver_id='d1'),
+        event('trip.event.started'),
+    ])
+    assert edits == [(42, 7, 'T1:IN_PROGRESS')]
+    assert notifier.stats()['coalesced'] == 1
+
+
+def test_each_settled_status_is_pushed_and_final_status_unwatches():
+    edits, notifier = run_notifier([
+        event('trip.event.driver_assigned'),
+        event('trip.event.completed'),
+        event('trip.event.cancelled'),
+    ], pause=0.1)
+    assert [text for _, _, text in edits] == ['T1:CONFIRMED', 'T1:COMPLETED']
+    assert 'T1' not in notifier.watches
+
+
+def test_unknown_trips_and_stale_events_are_ignored():
+    edits, notifier = run_notifier([
+        event('trip.event.driver_assigned', trip_id='other'),
+        event('trip.event.created'),
+        event('trip.event.driver_assigned', status='in_progress'),
+        event('trip.event.driver_assigned'),
+    ])
+    assert edits == [(42, 7, 'T1:IN_PROGRESS')]
+    assert notifier.stats()['events_ignored'] == 3
+
+
+def test_listeners_see_every_event_and_edits_carry_the_markup():
+    async def scenario():
+        edits, seen = [], []
+
+        async def edit(chat_id, message_id, text, context, **kwargs):
+            edits.append(kwargs.get('reply_markup'))
+
+        notifier = trip_events.TripStatusNotifier(trip_events.LocalBroker(), edit, lambda trip_id, status: status,
+                                                  coalesce_window=0, markup=lambda trip_id, status: f"{trip_id}:{status}")
+        notifier.listeners.append(lambda e: seen.append(e['payload']['trip_id']))
+        notifier.watch('T1', 42, 7)
+        notifier.handle(event('trip.event.driver_assigned', trip_id='other'))
+        notifier.handle(event('trip.event.driver_assigned'))
+        await asyncio.sleep(0.01)
+        return edits, seen
+
+    edits, seen = asyncio.run(scenario())
+    assert seen == ['other', 'T1']
+    assert edits == ['T1:CONFIRMED']
+
+
+def test_status_push_is_off_unless_a_broker_is_configured(monkeypatch):
+    monkeypatch.delenv('TRIP_EVENTS_BROKER', raising=False)
+    assert trip_events.broker_from_env() is None
+    monkeypatch.setenv('TRIP_EVENTS_BROKER', 'local')
+    assert isinstance(trip_events.broker_from_env(), trip_events.LocalBroker)
@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+
+import trip_submit
+
+
+class FakeTripService:
+    def __init__(self, replies, delay=0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.calls = []
+
+    async def post(self, url, json=None, headers=None):
+        self.calls.append(headers['Idempotency-Key'])
+        await asyncio.sleep(self.delay)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return httpx.Response(reply, json={'id': 'trip-1', 'status': 'PENDING'} if reply == 201 else None)
+
+
+async def no_sleep(delay):
+    pass
+
+
+def test_double_confirm_sends_one_request():
+    service = FakeTripService([201], delay=0.01)
+    submitter = trip_submit.TripSubmitter(service, sleep=no_sleep)
+
+    async def scenario():
+        results = await asyncio.gather(*(submitter.submit('REQ-1', {}) for _ in range(3)))
+        late = await submitter.submit('REQ-1', {})
+        return results + [late]
+
+    results = asyncio.run(scenario())
+    assert service.calls == ['REQ-1']
+    assert all(r['success'] and r['trip_id'] == 'trip-1' for r in results)
+    assert submitter.stats()['coalesced'] == 3
+
+
+def test_retries_only_unavailable_and_connect_errors():
+    connect_error = httpx.ConnectError('refused')
+    service = FakeTripService([503, connect_error, 201])
+    submitter = trip_submit.TripSubmitter(service, sleep=no_sleep)
+    result = asyncio.run(submitter.submit('REQ-2', {}))
+    assert result['success'] and service.calls == ['REQ-2'] * 3
+    assert submitter.stats()['retries'] == 2
+
+    service = FakeTripService([422])
+    result = asyncio.run(trip_submit.TripSubmitter(service, sleep=no_sleep).submit('REQ-3', {}))
+    assert result['error']['status_code'] == 422 and len(service.calls) == 1
+
+    # The trip may exist after a timeout or a 504: not repeated.
+    service = FakeTripService([httpx.ReadTimeout('slow')])
+    result = asyncio.run(trip_submit.TripSubmitter(service, sleep=no_sleep).submit('REQ-4', {}))
+    assert result['error']['status_code'] == 504 and len(service.calls) == 1
+    service = FakeTripService([504, 201])
+    result = asyncio.run(trip_submit.TripSubmitter(service, sleep=no_sleep).submit('REQ-5', {}))
+    assert result['error']['status_code'] == 504 and len(service.calls) == 1
+
+
+def test_open_circuit_fails_fast_until_probe_succeeds():
+    now = [0.0]
+    breaker = trip_submit.CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    service = FakeTripService([503])
+    submitter = trip_submit.TripSubmitter(service, breaker=breaker, max_attempts=1, sleep=no_sleep)
+
+    for key in ('a', 'b', 'c', 'd'):
+        result = asyncio.run(submitter.submit(key, {}))
+        assert result['error']['status_code'] == 503
+    assert service.calls == ['a', 'b'] and breaker.state == breaker.OPEN
+
+    now[0] = 31
+    service.replies = [201]
+    assert asyncio.run(submitter.submit('e', {}))['success']
+    assert breaker.state == breaker.CLOSED and submitter.stats()['fast_failures'] == 2
+
+
+def test_failed_or_cancelled_probe_does_not_wedge_the_circuit():
+    now = [0.0]
+    breaker = trip_submit.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+    service = FakeTripService([httpx.ReadError('connection reset')])
+    submitter = trip_submit.TripSubmitter(service, breaker=breaker, max_attempts=1, sleep=no_sleep)
+
+    assert asyncio.run(submitter.submit('a', {}))['error']['status_code'] == 500
+    assert breaker.state == breaker.OPEN
+    now[0] = 31
+    asyncio.run(submitter.submit('b', {}))
+    assert breaker.state == breaker.OPEN and breaker.opened_at == 31
+
+    async def cancelled_probe():
+        service.delay = 1
+        task = asyncio.ensure_future(submitter._submit('c', {}))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    now[0] = 62
+    asyncio.run(cancelled_probe())
+    assert breaker.state == breaker.HALF_OPEN
+    service.delay = 0
+    service.replies = [201]
+    assert asyncio.run(submitter.submit('d', {}))['success']
+    assert breaker.state == breaker.CLOSED
+
+
+def test_malformed_success_body_is_a_failure():
+    class Garbage:
+        async def post(self, url, json=None, headers=None):
+            return httpx.Response(201, text='<html>oops</html>')
+
+    result = asyncio.run(trip_submit.TripSubmitter(Garbage(), sleep=no_sleep).submit('REQ-5', {}))
+    assert not result['success'] and result['error']['status_code'] == 500
+
+
+def test_backoff_is_jittered_and_capped():
+    class Upper:
+        def uniform(self, lo, hi):
+            return hi
+
+    delays = [trip_submit.backoff_delay(n, base=0.2, cap=1.0, rng=Upper()) for n in range(5)]
+    assert delays == [0.2, 0.4, 0.8, 1.0, 1.0]
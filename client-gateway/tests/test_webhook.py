@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+
+import webhook
+
+
+def make_update(update_id, chat_id=1):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': 'hi',
+            'chat': {'id': chat_id, 'type': 'private'},
+        },
+    }
+
+
+def run_ingress(queue_size, requests, secret='s3cret'):
+    async def scenario():
+        app = SimpleNamespace(update_queue=asyncio.Queue(maxsize=queue_size), bot=None)
+        config = webhook.WebhookConfig('https://example.org', listen='127.0.0.1', port=0,
+                                       secret=secret, enqueue_timeout=0.05)
+        ingress = webhook.WebhookIngress(app, config)
+        await ingress.start()
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{ingress.server.port}") as client:
+                codes = []
+                for body, token in requests:
+                    resp = await client.post('/telegram', json=body,
+                                             headers={webhook.SECRET_HEADER: token} if token else {})
+                    codes.append(resp.status_code)
+        finally:
+            await ingress.stop()
+        return codes, ingress.stats()
+
+    return asyncio.run(scenario())
+
+
+def test_rejects_wrong_secret():
+    codes, stats = run_ingress(10, [(make_update(1), 'wrong'), (make_update(2), None)])
+    assert codes == [403, 403]
+    assert stats['rejected'] == 2
+    assert stats['queue_depth'] == 0
+
+
+def test_accepts_batches_and_applies_backpressure():
+    codes, stats = run_ingress(3, [
+        ([make_update(1), make_update(2)], 's3cret'),
+        ([make_update(3), make_update(4)], 's3cret'),
+    ])
+    # The second batch only half fits, so none of it is queued and Telegram resends all of it.
+    assert codes == [200, 503]
+    assert stats['accepted'] == 2
+    assert stats['throttled'] == 2
+    assert stats['queue_depth'] == 2
+
+
+def test_webhook_needs_a_secret(monkeypatch):
+    config = webhook.WebhookConfig('https://example.org', secret=None)
+    with pytest.raises(ValueError):
+        webhook.WebhookIngress(SimpleNamespace(update_queue=asyncio.Queue(), bot=None), config)
+    monkeypatch.setenv('WEBHOOK_URL', 'https://example.org')
+    monkeypatch.delenv('WEBHOOK_SECRET', raising=False)
+    with pytest.raises(ValueError):
+        webhook.WebhookConfig.from_env()
+
+
+def test_oversized_header_is_answered_not_dropped():
+    async def scenario():
+        app = SimpleNamespace(update_queue=asyncio.Queue(maxsize=10), bot=None)
+        ingress = webhook.WebhookIngress(app, webhook.WebhookConfig('https://example.org', listen='127.0.0.1',
+                                                                    port=0, secret='s3cret'))
+        ingress.server.max_head = 1024
+        await ingress.start()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', ingress.server.port)
+            writer.write(b"POST /telegram HTTP/1.1\r\nX-Padding: " + b"a" * 4096 + b"\r\n\r\n")
+            await writer.drain()
+            status = await reader.readline()
+            writer.close()
+        finally:
+            await ingress.stop()
+        return status
+
+    assert asyncio.run(scenario()).startswith(b"HTTP/1.1 431 ")
+
+
+def test_allowed_updates_follow_registered_handlers():
+    async def noop(update, context):
+        pass
+
+    app = Application.builder().token('1:x').build()
+    app.add_handler(CommandHandler('start', noop))
+    app.add_handler(ConversationHandler(
+        entry_points=[CallbackQueryHandler(noop, pattern='^go$')],
+        states={0: [MessageHandler(filters.TEXT, noop)]},
+        fallbacks=[],
+    ))
+    assert webhook.allowed_updates(app) == ['callback_query', 'message']
+
+    app.add_handler(TypeHandler(object, noop))
+    assert 'inline_query' in webhook.allowed_updates(app)
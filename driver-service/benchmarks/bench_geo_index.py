@@ -0,0 +1,77 @@
+"""Nearest-driver lookups: grid index vs. a vectorized linear scan over every driver.
+
+    python benchmarks/bench_geo_index.py [--drivers 100000] [--queries 2000] [--k 10]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from geo_index import DriverIndex, haversine_km
+
+# Roughly the Kyiv urban area.
+LAT_RANGE = (50.35, 50.55)
+LNG_RANGE = (30.35, 30.70)
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    return f"p50={np.percentile(samples, 50):.3f}ms p99={np.percentile(samples, 99):.3f}ms max={samples.max():.3f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--drivers', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=2.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(*LAT_RANGE, args.drivers)
+    lngs = rng.uniform(*LNG_RANGE, args.drivers)
+    q_lats = rng.uniform(*LAT_RANGE, args.queries)
+    q_lngs = rng.uniform(*LNG_RANGE, args.queries)
+
+    index = DriverIndex(capacity=args.drivers)
+    started = time.perf_counter()
+    for driver_id in range(args.drivers):
+        index.update(driver_id, lats[driver_id], lngs[driver_id])
+    print(f"insert: {args.drivers / (time.perf_counter() - started):,.0f} drivers/s")
+
+    moves = rng.integers(0, args.drivers, args.queries * 10)
+    started = time.perf_counter()
+    for driver_id in moves:
+        driver_id = int(driver_id)
+        index.update(driver_id, lats[driver_id] + rng.normal(0, 0.002), lngs[driver_id] + rng.normal(0, 0.002))
+    print(f"update: {len(moves) / (time.perf_counter() - started):,.0f} moves/s")
+    lats, lngs = index.lats[:args.drivers].copy(), index.lngs[:args.drivers].copy()
+
+    grid, scan, radius = [], [], []
+    for lat, lng in zip(q_lats, q_lngs):
+        started = time.perf_counter()
+        found = index.nearest(lat, lng, args.k)
+        grid.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        distances = haversine_km(lat, lng, lats, lngs)
+        expected = np.argpartition(distances, args.k)[:args.k]
+        expected = expected[np.argsort(distances[expected])]
+        scan.append(time.perf_counter() - started)
+        assert [driver_id for driver_id, _ in found] == expected.tolist()
+
+        started = time.perf_counter()
+        index.within(lat, lng, args.radius)
+        radius.append(time.perf_counter() - started)
+
+    print(f"{args.drivers:,} drivers, {args.queries:,} queries, k={args.k}")
+    print(f"  grid nearest:   {percentiles(grid)}")
+    print(f"  linear scan:    {percentiles(scan)}")
+    print(f"  grid within {args.radius}km: {percentiles(radius)}")
+
+
+if __name__ == '__main__':
+    main()
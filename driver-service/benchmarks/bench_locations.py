@@ -0,0 +1,87 @@
+"""Load generator for driver location ingestion.
+
+Measures the columnar store on its own and the full POST /locations path (JSON
+parsing, validation, ingest) in this process, and checks memory stays flat.
+
+    python benchmarks/bench_locations.py [--drivers 100000] [--seconds 5] [--batch 1000]
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from fastapi.testclient import TestClient
+
+from api import create_app
+from locations import LocationStore
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def batches(drivers, size, rng):
+    ids = [f"driver-{n}" for n in range(drivers)]
+    while True:
+        picks = rng.integers(0, drivers, size)
+        yield ([ids[n] for n in picks], rng.uniform(50.35, 50.55, size).tolist(),
+               rng.uniform(30.35, 30.70, size).tolist())
+
+
+def run(label, seconds, send, batch_size):
+    sent = 0
+    memory = []
+    started = time.perf_counter()
+    next_sample = started
+    while time.perf_counter() - started < seconds:
+        send()
+        sent += batch_size
+        if time.perf_counter() >= next_sample:
+            memory.append(rss_mb())
+            next_sample += seconds / 5
+    elapsed = time.perf_counter() - started
+    memory.append(rss_mb())
+    print(f"{label}: {sent / elapsed:,.0f} pings/s  rss samples (MB): {' '.join(f'{m:.0f}' for m in memory)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--drivers', type=int, default=100000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--ring', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(3)
+    store = LocationStore(capacity=args.ring)
+    source = batches(args.drivers, args.batch, rng)
+    prepared = [next(source) for _ in range(50)]
+
+    # Warm up so every driver has its slot before memory is sampled.
+    store.ingest([f"driver-{n}" for n in range(args.drivers)], [50.45] * args.drivers, [30.52] * args.drivers)
+    position = iter(range(10 ** 12))
+
+    def send_store():
+        ids, lats, lngs = prepared[next(position) % len(prepared)]
+        store.ingest(ids, lats, lngs)
+
+    run("store.ingest", args.seconds, send_store, args.batch)
+
+    client = TestClient(create_app(store))
+    bodies = [{'driver_ids': ids, 'lat': lats, 'lng': lngs} for ids, lats, lngs in prepared]
+
+    def send_http():
+        resp = client.post('/locations', json=bodies[next(position) % len(bodies)])
+        assert resp.status_code == 202
+
+    run("POST /locations", args.seconds, send_http, args.batch)
+    print(f"store: {store.stats()}")
+
+
+if __name__ == '__main__':
+    main()
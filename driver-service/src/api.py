@@ -0,0 +1,96 @@
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+
+class LocationBatch(BaseModel):
+    """Pings in columnar form: the i-th entries of every list belong together."""
+
+    driver_ids: list[str]
+    lat: list[float]
+    lng: list[float]
+    ts: Optional[list[float]] = None
+
+
+class Assignment(BaseModel):
+    """A driver who accepted a trip offer in the gateway."""
+
+    trip_id: str
+    driver_id: str
+    source: Optional[str] = None
+
+
+class TripEvent(BaseModel):
+    """An event in the trip event schema (trip-service/docs/trip-events.md)."""
+
+    event_id: str
+    event_type: str
+    event_version: str = '1.0'
+    correlation_id: Optional[str] = None
+    traceparent: Optional[str] = None
+    timestamp: Optional[str] = None
+    payload: dict
+
+
+def create_app(locations, stats=None, lifespan=None, matcher=None, broker=None, topics=()):
+    app = FastAPI(title="Driver Service", lifespan=lifespan)
+
+    # async handlers run on the event loop, so the location store is never written from two threads.
+    @app.post("/locations", status_code=202)
+    async def ingest_locations(batch: LocationBatch):
+        size = len(batch.driver_ids)
+        if len(batch.lat) != size or len(batch.lng) != size or (batch.ts is not None and len(batch.ts) != size):
+            raise HTTPException(status_code=422, detail="driver_ids, lat, lng and ts must have the same length")
+        return {'accepted': locations.ingest(batch.driver_ids, batch.lat, batch.lng, batch.ts)}
+
+    @app.get("/locations/{driver_id}")
+    async def get_location(driver_id: str):
+        latest = locations.latest(driver_id)
+        if latest is None:
+            raise HTTPException(status_code=404, detail="No fresh position for this driver")
+        lat, lng, ts = latest
+        return {'driver_id': driver_id, 'lat': lat, 'lng': lng, 'ts': ts}
+
+    @app.post("/assignments", status_code=202)
+    async def record_assignment(assignment: Assignment):
+        if matcher is None:
+            raise HTTPException(status_code=503, detail="Matching is not running")
+        released = matcher.assign(assignment.trip_id, assignment.driver_id)
+        return {'trip_id': assignment.trip_id, 'driver_id': assignment.driver_id, 'released': released}
+
+    @app.delete("/assignments/{trip_id}")
+    async def complete_assignment(trip_id: str):
+        if matcher is None:
+            raise HTTPException(status_code=503, detail="Matching is not running")
+        driver_id = matcher.complete(trip_id)
+        if driver_id is None:
+            raise HTTPException(status_code=404, detail="No active assignment for this trip")
+        return {'trip_id': trip_id, 'driver_id': driver_id}
+
+    # Until the Trip Service publishes to a shared broker, trip events are POSTed here and
+    # land in the in-process broker the consumer reads, keyed by trip_id like a real one.
+    @app.post("/events", status_code=202)
+    async def publish_event(event: TripEvent):
+        if broker is None:
+            raise HTTPException(status_code=503, detail="Event intake is not running")
+        if event.event_type not in topics:
+            raise HTTPException(status_code=422, detail=f"Unknown event type: {event.event_type}")
+        trip_id = event.payload.get('trip_id')
+        pickup = event.payload.get('pickup')
+        if not trip_id:
+            raise HTTPException(status_code=422, detail="payload.trip_id is required")
+        if event.event_type == 'trip.event.created' and not (isinstance(pickup, dict) and 'lat' in pickup and 'lng' in pickup):
+            raise HTTPException(status_code=422, detail="payload.pickup.lat and payload.pickup.lng are required")
+        message = broker.publish(event.event_type, trip_id, event.model_dump(exclude_none=True))
+        return {'topic': message.topic, 'partition': message.partition, 'offset': message.offset}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats() if stats is not None else {'locations': locations.stats()}
+
+    @app.get("/health")
+    async def health():
+        return {'status': 'ok'}
+
+    return app
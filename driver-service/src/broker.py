@@ -0,0 +1,123 @@
+import zlib
+import asyncio
+import logging
+
+logger = logging.getLogger('driver_service')
+
+
+class Message:
+    __slots__ = ('topic', 'partition', 'offset', 'key', 'value')
+
+    def __init__(self, topic, partition, offset, key, value):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.key = key
+        self.value = value
+
+
+def partition_for(key, partitions):
+    return zlib.crc32(str(key).encode()) % partitions
+
+
+class LocalBroker:
+    """In-process stand-in for a partitioned log broker (Kafka-style).
+
+    Each topic is split into partitions and messages with the same key land in the
+    same partition, so their order is kept. Consumer groups commit offsets; anything
+    fetched but not committed is delivered again after a rebalance or restart.
+
+    A partition keeps only what some group has not committed yet: on commit, messages
+    below the lowest committed offset of the groups reading it are dropped. A group
+    that starts after that reads from the oldest message still kept.
+    """
+
+    def __init__(self, partitions=8):
+        self.partitions = partitions
+        self._logs = {}
+        self._bases = {}
+        self._committed = {}
+        self._positions = {}
+        self._cursors = {}
+        self._available = asyncio.Event()
+
+    def _log(self, topic):
+        log = self._logs.get(topic)
+        if log is None:
+            log = self._logs[topic] = [[] for _ in range(self.partitions)]
+        return log
+
+    def publish(self, topic, key, value):
+        partition = partition_for(key, self.partitions)
+        log = self._log(topic)[partition]
+        offset = self._bases.get((topic, partition), 0) + len(log)
+        message = Message(topic, partition, offset, key, value)
+        log.append(message)
+        self._available.set()
+        return message
+
+    async def fetch(self, group, topics, max_messages=100, timeout=1.0):
+        """Return up to max_messages not yet fetched by the group, waiting up to timeout for new ones."""
+        batch = self._take(group, topics, max_messages)
+        if not batch and timeout:
+            self._available.clear()
+            try:
+                await asyncio.wait_for(self._available.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            batch = self._take(group, topics, max_messages)
+        return batch
+
+    def _take(self, group, topics, max_messages):
+        # Start where the previous fetch stopped, so one busy partition cannot keep
+        # filling every batch while the others wait.
+        sources = [(topic, partition) for topic in topics for partition in range(self.partitions)]
+        start = self._cursors.get(group, 0) % len(sources) if sources else 0
+        batch = []
+        for step in range(len(sources)):
+            index = (start + step) % len(sources)
+            topic, partition = sources[index]
+            log = self._log(topic)[partition]
+            base = self._bases.get((topic, partition), 0)
+            position_key = (group, topic, partition)
+            position = max(self._positions.get(position_key, self._committed.get(position_key, 0)), base)
+            taken = log[position - base:position - base + max_messages - len(batch)]
+            batch.extend(taken)
+            self._positions[position_key] = position + len(taken)
+            if len(batch) >= max_messages:
+                self._cursors[group] = index + 1
+                return batch
+        self._cursors[group] = start + 1
+        return batch
+
+    def commit(self, group, offsets):
+        """offsets maps (topic, partition) to the next offset to read."""
+        for (topic, partition), offset in offsets.items():
+            key = (group, topic, partition)
+            self._committed[key] = max(self._committed.get(key, 0), offset)
+            self._trim(topic, partition)
+
+    def _trim(self, topic, partition):
+        groups = {key[0] for key in (*self._committed, *self._positions) if key[1:] == (topic, partition)}
+        floor = min(self._committed.get((group, topic, partition), 0) for group in groups)
+        base = self._bases.get((topic, partition), 0)
+        if floor > base:
+            del self._log(topic)[partition][:floor - base]
+            self._bases[(topic, partition)] = floor
+
+    def rewind(self, group):
+        """Forget fetch positions so uncommitted messages are redelivered, as after a consumer restart."""
+        for key in [k for k in self._positions if k[0] == group]:
+            del self._positions[key]
+
+    def retained(self, topics):
+        """Messages still held for the given topics."""
+        return sum(len(log) for topic in topics for log in self._log(topic))
+
+    def lag(self, group, topics):
+        total = 0
+        for topic in topics:
+            for partition, log in enumerate(self._log(topic)):
+                base = self._bases.get((topic, partition), 0)
+                total += base + len(log) - max(self._committed.get((group, topic, partition), 0), base)
+        return total
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import tracing
+
+logger = logging.getLogger('driver_service')
+
+SUPPORTED_MAJOR_VERSION = '1'
+
+
+class SeenSet:
+    """Bounded record of processed event_ids; the oldest ids are forgotten first."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+
+    def __contains__(self, event_id):
+        return event_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, event_id):
+        self._ids[event_id] = None
+        self._ids.move_to_end(event_id)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+
+class Consumer:
+    """Batched event consumer with per-trip ordering and idempotent handling.
+
+    Each fetched batch is split by message key (trip_id). Keys are processed
+    concurrently under a semaphore, while the events of one key run one after another
+    in offset order. Offsets are committed once per batch, after every event in it has
+    been handled, so a crash redelivers the batch and the seen-set filters repeats.
+    """
+
+    def __init__(self, broker, group, topics, concurrency=16, batch_size=100, max_retries=3,
+                 retry_delay=0.1, seen_size=100000, fetch_timeout=1.0, clock=time.monotonic, tracer=None):
+        self.broker = broker
+        self.tracer = tracer or tracing.tracer
+        self.group = group
+        self.topics = list(topics)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.fetch_timeout = fetch_timeout
+        self.clock = clock
+        self.seen = SeenSet(seen_size)
+        self.handlers = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._running = False
+        self._started_at = clock()
+        self.processed = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def on(self, event_type, handler=None):
+        """Register handler for event_type; without a handler, works as a decorator."""
+        if handler is None:
+            return lambda handler: self.on(event_type, handler)
+        self.handlers[event_type] = handler
+        return handler
+
+    async def _handle(self, message):
+        event = message.value
+        event_id = event.get('event_id')
+        if event_id is not None and event_id in self.seen:
+            self.duplicates += 1
+            return
+
+        version = str(event.get('event_version', ''))
+        handler = self.handlers.get(event.get('event_type', message.topic))
+        if handler is None or version.split('.')[0] != SUPPORTED_MAJOR_VERSION:
+            self.skipped += 1
+            logger.warning("Skipping event %s (%s v%s)", event_id, event.get('event_type'), version)
+        else:
+            # Continue the trace the event was published in; the handler runs inside this span.
+            with self.tracer.span(
+                f"consume {event.get('event_type', message.topic)}",
+                tracing.SpanContext.from_traceparent(event.get('traceparent')),
+                event_id=event_id, correlation_id=event.get('correlation_id'),
+            ) as span:
+                for attempt in range(1, self.max_retries + 1):
+                    try:
+                        await handler(event)
+                        break
+                    except Exception as e:
+                        if attempt == self.max_retries:
+                            self.failed += 1
+                            span.error = f"{type(e).__name__}: {e}"
+                            logger.exception(
+                                "Giving up on event %s correlation_id=%s after %s attempts: %s",
+                                event_id, event.get('correlation_id'), attempt, e
+                            )
+                        else:
+                            await asyncio.sleep(self.retry_delay * attempt)
+                span.set('attempts', attempt)
+            self.processed += 1
+
+        if event_id is not None:
+            self.seen.add(event_id)
+
+    async def _handle_key(self, messages):
+        async with self._semaphore:
+            for message in messages:
+                await self._handle(message)
+
+    async def poll_once(self):
+        batch = await self.broker.fetch(self.group, self.topics, self.batch_size, self.fetch_timeout)
+        if not batch:
+            return 0
+
+        by_key = OrderedDict()
+        offsets = {}
+        for message in batch:
+            by_key.setdefault(message.key, []).append(message)
+            position = (message.topic, message.partition)
+            offsets[position] = max(offsets.get(position, 0), message.offset + 1)
+
+        await asyncio.gather(*(self._handle_key(messages) for messages in by_key.values()))
+        self.broker.commit(self.group, offsets)
+        self.batches += 1
+        return len(batch)
+
+    async def run(self):
+        self._running = True
+        logger.info("Consumer %s started on %s", self.group, ', '.join(self.topics))
+        while self._running:
+            await self.poll_once()
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        uptime = max(self.clock() - self._started_at, 1e-9)
+        return {
+            'group': self.group,
+            'lag': self.broker.lag(self.group, self.topics),
+            'retained': self.broker.retained(self.topics),
+            'processed': self.processed,
+            'duplicates': self.duplicates,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'events_per_sec': self.processed / uptime,
+            'seen_ids': len(self.seen),
+        }
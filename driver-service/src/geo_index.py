@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Distance in km from one point to arrays of points."""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class DriverIndex:
+    """Grid index of available drivers for nearest-driver search.
+
+    Positions live in preallocated arrays addressed by slot. Every grid cell keeps an
+    array-backed bucket of slots, and each slot remembers its place in its bucket, so
+    moving a driver between cells is a swap-remove plus an append. Queries collect the
+    slots of nearby cells and rank them with vectorized haversine distances.
+    """
+
+    def __init__(self, cell_deg=0.01, capacity=1024):
+        self.cell_deg = cell_deg
+        self.lats = np.zeros(capacity)
+        self.lngs = np.zeros(capacity)
+        self._cells = np.zeros((capacity, 2), dtype=np.int64)
+        self._bucket_pos = np.zeros(capacity, dtype=np.int64)
+        self._driver_ids = [None] * capacity
+        self._slots = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._slots
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _grow(self):
+        old = len(self.lats)
+        new = old * 2
+        self.lats = np.resize(self.lats, new)
+        self.lngs = np.resize(self.lngs, new)
+        self._cells = np.resize(self._cells, (new, 2))
+        self._bucket_pos = np.resize(self._bucket_pos, new)
+        self._driver_ids.extend([None] * old)
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    def _bucket_add(self, cell, slot):
+        bucket = self._buckets.get(cell)
+        if bucket is None:
+            bucket = self._buckets[cell] = []
+        self._cells[slot] = cell
+        self._bucket_pos[slot] = len(bucket)
+        bucket.append(slot)
+
+    def _bucket_remove(self, slot):
+        cell = (int(self._cells[slot, 0]), int(self._cells[slot, 1]))
+        bucket = self._buckets[cell]
+        pos = self._bucket_pos[slot]
+        last = bucket.pop()
+        if last != slot:
+            bucket[pos] = last
+            self._bucket_pos[last] = pos
+        elif not bucket:
+            del self._buckets[cell]
+
+    def update(self, driver_id, lat, lng):
+        """Insert or move an available driver."""
+        cell = self._cell(lat, lng)
+        slot = self._slots.get(driver_id)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            self._slots[driver_id] = slot
+            self._driver_ids[slot] = driver_id
+            self._bucket_add(cell, slot)
+        elif (self._cells[slot, 0], self._cells[slot, 1]) != cell:
+            self._bucket_remove(slot)
+            self._bucket_add(cell, slot)
+        self.lats[slot] = lat
+        self.lngs[slot] = lng
+
+    def remove(self, driver_id):
+        """Drop a driver that went offline or took a trip."""
+        slot = self._slots.pop(driver_id, None)
+        if slot is None:
+            return False
+        self._bucket_remove(slot)
+        self._driver_ids[slot] = None
+        self._free.append(slot)
+        return True
+
+    def position(self, driver_id):
+        slot = self._slots[driver_id]
+        return float(self.lats[slot]), float(self.lngs[slot])
+
+    def positions(self, driver_ids):
+        """Latitude and longitude arrays for several drivers, in the given order."""
+        slots = np.fromiter((self._slots[d] for d in driver_ids), dtype=np.int64, count=len(driver_ids))
+        return self.lats[slots], self.lngs[slots]
+
+    def _ring(self, row, col, r):
+        if r == 0:
+            bucket = self._buckets.get((row, col))
+            return [bucket] if bucket else []
+        buckets = []
+        for c in range(col - r, col + r + 1):
+            for cell in ((row - r, c), (row + r, c)):
+                bucket = self._buckets.get(cell)
+                if bucket:
+                    buckets.append(bucket)
+        for rr in range(row - r + 1, row + r):
+            for cell in ((rr, col - r), (rr, col + r)):
+                bucket = self._buckets.get(cell)
+                if bucket:
+                    buckets.append(bucket)
+        return buckets
+
+    def _rank(self, lat, lng, slots):
+        slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+        return slots, haversine_km(lat, lng, self.lats[slots], self.lngs[slots])
+
+    def _result(self, slots, distances, order):
+        return [(self._driver_ids[s], float(d)) for s, d in zip(slots[order], distances[order])]
+
+    def nearest(self, lat, lng, k=10, max_km=50.0, exclude=()):
+        """The k closest drivers within max_km as (driver_id, km), closest first.
+
+        Drivers in exclude are skipped while cells are scanned, so they never take up
+        any of the k places.
+        """
+        if not self._slots:
+            return []
+        row, col = self._cell(lat, lng)
+        # A cell is at least this wide in km at the query latitude (longitude shrinks towards the poles).
+        cell_km = self.cell_deg * KM_PER_DEGREE * max(math.cos(math.radians(abs(lat) + self.cell_deg)), 1e-6)
+        max_rings = int(max_km / cell_km) + 1
+        candidates = []
+        scanned = 0
+        for r in range(max_rings + 1):
+            for bucket in self._ring(row, col, r):
+                scanned += len(bucket)
+                if exclude:
+                    candidates.extend(s for s in bucket if self._driver_ids[s] not in exclude)
+                else:
+                    candidates.extend(bucket)
+            everything = scanned == len(self._slots)
+            if candidates and (len(candidates) >= k or everything):
+                slots, distances = self._rank(lat, lng, candidates)
+                order = np.argsort(distances)[:k]
+                # Anything outside the rings searched so far is at least r * cell_km away.
+                if everything or distances[order[-1]] <= r * cell_km:
+                    order = order[distances[order] <= max_km]
+                    return self._result(slots, distances, order)
+            if everything:
+                break
+        if not candidates:
+            return []
+        slots, distances = self._rank(lat, lng, candidates)
+        order = np.argsort(distances)
+        order = order[distances[order] <= max_km][:k]
+        return self._result(slots, distances, order)
+
+    def within(self, lat, lng, radius_km):
+        """All drivers within radius_km as (driver_id, km), closest first."""
+        d_lat = radius_km / KM_PER_DEGREE
+        d_lng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + d_lat, 89.9))), 1e-6))
+        row_lo, col_lo = self._cell(lat - d_lat, lng - d_lng)
+        row_hi, col_hi = self._cell(lat + d_lat, lng + d_lng)
+        candidates = []
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self._buckets):
+            for (row, col), bucket in self._buckets.items():
+                if row_lo <= row <= row_hi and col_lo <= col <= col_hi:
+                    candidates.extend(bucket)
+        else:
+            for row in range(row_lo, row_hi + 1):
+                for col in range(col_lo, col_hi + 1):
+                    bucket = self._buckets.get((row, col))
+                    if bucket:
+                        candidates.extend(bucket)
+        if not candidates:
+            return []
+        slots, distances = self._rank(lat, lng, candidates)
+        order = np.argsort(distances)
+        order = order[distances[order] <= radius_km]
+        return self._result(slots, distances, order)
@@ -0,0 +1,143 @@
+import time
+
+import numpy as np
+
+
+class LocationStore:
+    """Driver position pings in preallocated columnar arrays.
+
+    Every ping is appended to a fixed-size ring (driver index, lat, lng, ts), so memory
+    stays flat however many pings arrive; the oldest history is overwritten. The latest
+    position per driver is kept in parallel arrays indexed by a dense driver index.
+    Nothing is swept on a timer: positions older than max_age are simply treated as
+    missing when read.
+    """
+
+    def __init__(self, capacity=1_000_000, max_drivers=1024, max_age=60.0, clock=time.time):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.clock = clock
+        self.ring_driver = np.zeros(capacity, dtype=np.int32)
+        self.ring_lat = np.zeros(capacity)
+        self.ring_lng = np.zeros(capacity)
+        self.ring_ts = np.zeros(capacity)
+        self.written = 0
+        self.last_lat = np.zeros(max_drivers)
+        self.last_lng = np.zeros(max_drivers)
+        self.last_ts = np.full(max_drivers, -np.inf)
+        self.last_seq = np.zeros(max_drivers, dtype=np.int64)
+        self.driver_ids = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.driver_ids)
+
+    def _grow_drivers(self, needed):
+        size = len(self.last_ts)
+        while size < needed:
+            size *= 2
+        self.last_lat = np.resize(self.last_lat, size)
+        self.last_lng = np.resize(self.last_lng, size)
+        self.last_ts = np.concatenate([self.last_ts, np.full(size - len(self.last_ts), -np.inf)])
+        self.last_seq = np.resize(self.last_seq, size)
+
+    def driver_index(self, driver_ids):
+        index = self._index
+        ids = self.driver_ids
+        idx = np.empty(len(driver_ids), dtype=np.int32)
+        for i, driver_id in enumerate(driver_ids):
+            n = index.get(driver_id)
+            if n is None:
+                n = index[driver_id] = len(ids)
+                ids.append(driver_id)
+            idx[i] = n
+        if len(ids) > len(self.last_ts):
+            self._grow_drivers(len(ids))
+        return idx
+
+    def ingest(self, driver_ids, lats, lngs, ts=None):
+        """Append a batch of pings; returns how many were accepted."""
+        count = len(driver_ids)
+        if not count:
+            return 0
+        idx = self.driver_index(driver_ids)
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        ts = np.full(count, self.clock()) if ts is None else np.asarray(ts, dtype=np.float64)
+
+        start = self.written % self.capacity
+        if count >= self.capacity:
+            positions = np.arange(self.written + count - self.capacity, self.written + count) % self.capacity
+            keep = slice(count - self.capacity, count)
+            self.ring_driver[positions] = idx[keep]
+            self.ring_lat[positions] = lats[keep]
+            self.ring_lng[positions] = lngs[keep]
+            self.ring_ts[positions] = ts[keep]
+        else:
+            end = start + count
+            head = min(end, self.capacity) - start
+            for column, values in ((self.ring_driver, idx), (self.ring_lat, lats),
+                                   (self.ring_lng, lngs), (self.ring_ts, ts)):
+                column[start:start + head] = values[:head]
+                column[:count - head] = values[head:]
+        self.written += count
+
+        # Later pings win, both within the batch and against what is stored: keep the
+        # newest ping per driver, then only where it is newer than the current position.
+        order = np.argsort(ts, kind='stable')[::-1]
+        _, first = np.unique(idx[order], return_index=True)
+        latest = order[first]
+        idx, lats, lngs, ts = idx[latest], lats[latest], lngs[latest], ts[latest]
+        newer = ts >= self.last_ts[idx]
+        idx, lats, lngs, ts = idx[newer], lats[newer], lngs[newer], ts[newer]
+        self.last_lat[idx] = lats
+        self.last_lng[idx] = lngs
+        self.last_ts[idx] = ts
+        self.last_seq[idx] = self.written
+        return count
+
+    def latest(self, driver_id):
+        n = self._index.get(driver_id)
+        if n is None or self.last_ts[n] < self.clock() - self.max_age:
+            return None
+        return float(self.last_lat[n]), float(self.last_lng[n]), float(self.last_ts[n])
+
+    def changes(self, seq, since):
+        """What an index needs to catch up since sequence seq and time since.
+
+        Returns (fresh, expired, seq, now): fresh is (driver_id, lat, lng) for drivers
+        with a new, still valid position; expired lists drivers whose latest position
+        became too old in the meantime or arrived already too old. Pass the returned seq
+        and now to the next call.
+        """
+        now = self.clock()
+        cutoff = now - self.max_age
+        drivers = len(self.driver_ids)
+        last_ts = self.last_ts[:drivers]
+        changed = self.last_seq[:drivers] > seq
+        fresh_mask = changed & (last_ts >= cutoff)
+        expired_mask = (changed & (last_ts < cutoff)) | ((last_ts >= since - self.max_age) & (last_ts < cutoff))
+        ids = self.driver_ids
+        fresh = [(ids[n], float(self.last_lat[n]), float(self.last_lng[n])) for n in np.nonzero(fresh_mask)[0]]
+        expired = [ids[n] for n in np.nonzero(expired_mask)[0]]
+        return fresh, expired, self.written, now
+
+    def history(self, driver_id, limit=100):
+        """The most recent pings of one driver still held in the ring, newest first."""
+        n = self._index.get(driver_id)
+        if n is None:
+            return []
+        size = min(self.written, self.capacity)
+        hits = np.nonzero(self.ring_driver[:size] == n)[0]
+        hits = hits[np.argsort(self.ring_ts[hits])[::-1][:limit]]
+        return [(float(self.ring_lat[i]), float(self.ring_lng[i]), float(self.ring_ts[i])) for i in hits]
+
+    def stats(self):
+        cutoff = self.clock() - self.max_age
+        return {
+            'pings_total': self.written,
+            'ring_capacity': self.capacity,
+            'ring_bytes': self.ring_driver.nbytes + self.ring_lat.nbytes + self.ring_lng.nbytes + self.ring_ts.nbytes,
+            'drivers_known': len(self.driver_ids),
+            'drivers_fresh': int(np.count_nonzero(self.last_ts[:len(self.driver_ids)] >= cutoff)),
+        }
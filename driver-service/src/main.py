@@ -1 +1,142 @@
-print("Hello, World!")
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from api import create_app
+from broker import LocalBroker
+from consumer import Consumer
+from geo_index import DriverIndex
+from locations import LocationStore
+from matching import MatchingEngine
+import tracing
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger('driver_service')
+
+TRIP_TOPICS = ('trip.event.created', 'trip.event.driver_assigned', 'trip.event.completed', 'trip.event.cancelled')
+
+
+def build_consumer(broker, matcher):
+    consumer = Consumer(
+        broker,
+        group=os.getenv('CONSUMER_GROUP', 'driver-service'),
+        topics=TRIP_TOPICS,
+        concurrency=int(os.getenv('CONSUMER_CONCURRENCY', 16)),
+        batch_size=int(os.getenv('CONSUMER_BATCH_SIZE', 100)),
+    )
+
+    @consumer.on('trip.event.created')
+    async def on_trip_created(event):
+        payload = event['payload']
+        pickup = payload['pickup']
+        matcher.submit(payload['trip_id'], pickup['lat'], pickup['lng'], event.get('correlation_id'),
+                       tracing.current_context())
+        logger.info("Trip %s created, pickup=%s correlation_id=%s",
+                    payload['trip_id'], pickup.get('address'), event.get('correlation_id'))
+
+    @consumer.on('trip.event.driver_assigned')
+    async def on_driver_assigned(event):
+        payload = event['payload']
+        logger.info("Trip %s assigned to driver %s correlation_id=%s",
+                    payload['trip_id'], payload['driver_id'], event.get('correlation_id'))
+
+    @consumer.on('trip.event.completed')
+    @consumer.on('trip.event.cancelled')
+    async def on_trip_ended(event):
+        trip_id = event['payload']['trip_id']
+        driver_id = matcher.complete(trip_id)
+        logger.info("Trip %s ended (%s), driver %s is free correlation_id=%s",
+                    trip_id, event['event_type'], driver_id, event.get('correlation_id'))
+
+    return consumer
+
+
+async def sync_index(locations, drivers, interval):
+    """Apply new positions to the driver index and drop drivers whose last ping went stale."""
+    seq, since = 0, locations.clock()
+    while True:
+        fresh, expired, seq, since = locations.changes(seq, since)
+        for driver_id, lat, lng in fresh:
+            drivers.update(driver_id, lat, lng)
+        for driver_id in expired:
+            drivers.remove(driver_id)
+        await asyncio.sleep(interval)
+
+
+# Matches are only logged for now: nothing offers them to the driver or tells the Trip
+# Service yet. Offers a driver accepts in the gateway come back via POST /assignments.
+async def on_match(trip_id, driver_id, pickup_km):
+    logger.info("Trip %s matched to driver %s, pickup %.2f km", trip_id, driver_id, pickup_km)
+
+
+async def report(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Driver service stats: %s", stats())
+
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
+span_collector = tracing.JsonlCollector(
+    os.getenv('TRACE_EXPORT_PATH', os.path.join(os.path.dirname(__file__), 'logs', 'spans.jsonl')),
+    maxsize=int(os.getenv('TRACE_QUEUE_SIZE', 10000)),
+) if TRACE_SAMPLE_RATE > 0 else None
+tracing.tracer.collector = span_collector
+tracing.tracer.sample_rate = TRACE_SAMPLE_RATE
+
+drivers = DriverIndex(cell_deg=float(os.getenv('DRIVER_INDEX_CELL_DEG', 0.01)))
+locations = LocationStore(
+    capacity=int(os.getenv('LOCATION_RING_SIZE', 1_000_000)),
+    max_age=float(os.getenv('LOCATION_MAX_AGE', 60)),
+)
+matcher = MatchingEngine(
+    drivers,
+    on_match,
+    window=float(os.getenv('MATCH_WINDOW', 0.5)),
+    max_batch=int(os.getenv('MATCH_MAX_BATCH', 500)),
+    exact_limit=int(os.getenv('MATCH_EXACT_LIMIT', 200)),
+    candidates=int(os.getenv('MATCH_CANDIDATES', 10)),
+    max_pickup_km=float(os.getenv('MATCH_MAX_PICKUP_KM', 5)),
+    assignment_ttl=float(os.getenv('MATCH_ASSIGNMENT_TTL', 3 * 3600)),
+)
+broker = LocalBroker(partitions=int(os.getenv('BROKER_PARTITIONS', 8)))
+consumer = build_consumer(broker, matcher)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    tasks = [
+        asyncio.create_task(consumer.run()),
+        asyncio.create_task(sync_index(locations, drivers, float(os.getenv('LOCATION_SYNC_INTERVAL', 1)))),
+        asyncio.create_task(matcher.run()),
+        asyncio.create_task(report(float(os.getenv('CONSUMER_STATS_INTERVAL', 30)))),
+    ]
+    try:
+        yield
+    finally:
+        consumer.stop()
+        matcher.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if span_collector is not None:
+            span_collector.close()
+
+
+def stats():
+    return {
+        'consumer': consumer.stats(),
+        'locations': locations.stats(),
+        'drivers_indexed': len(drivers),
+        'matching': matcher.stats(),
+        'tracing': tracing.tracer.stats(),
+    }
+
+
+app = create_app(locations, stats, lifespan, matcher, broker, TRIP_TOPICS)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', 8000)))
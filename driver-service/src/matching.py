@@ -0,0 +1,280 @@
+import time
+import asyncio
+import logging
+
+import numpy as np
+
+import tracing
+from geo_index import haversine_km
+
+logger = logging.getLogger('driver_service')
+
+INFEASIBLE = 1e9
+
+
+def solve_assignment(cost):
+    """Minimum-cost assignment of rows to columns (Hungarian method, shortest augmenting paths).
+
+    Works on rectangular matrices; returns (rows, cols) of the chosen pairs. Every row
+    is assigned when there are at least as many columns as rows, and vice versa.
+    """
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def solve_greedy(cost):
+    """Cheapest pairs first; a fast approximation for batches too large for the exact solver."""
+    flat = np.argsort(cost, axis=None)
+    n, m = cost.shape
+    row_used = np.zeros(n, dtype=bool)
+    col_used = np.zeros(m, dtype=bool)
+    rows, cols = [], []
+    for index in flat:
+        row, col = divmod(int(index), m)
+        if cost[row, col] >= INFEASIBLE:
+            break
+        if row_used[row] or col_used[col]:
+            continue
+        row_used[row] = col_used[col] = True
+        rows.append(row)
+        cols.append(col)
+        if len(rows) == min(n, m):
+            break
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+
+class PendingTrip:
+    __slots__ = ('trip_id', 'lat', 'lng', 'received_at', 'correlation_id', 'attempts', 'trace')
+
+    def __init__(self, trip_id, lat, lng, received_at, correlation_id=None, trace=None):
+        self.trip_id = trip_id
+        self.lat = lat
+        self.lng = lng
+        self.received_at = received_at
+        self.correlation_id = correlation_id
+        self.attempts = 0
+        self.trace = trace
+
+
+class MatchingEngine:
+    """Batches pending trips over a short window and assigns drivers to them jointly.
+
+    For each window the engine takes the pending trips, gathers the nearest available
+    drivers of every trip from the DriverIndex, builds a trips x drivers pickup-distance
+    matrix and solves it as one assignment problem: exactly up to exact_limit trips,
+    greedily beyond that. Matched drivers are reserved for reserve_ttl so the next
+    window does not offer them again; unmatched trips wait for up to max_attempts windows.
+    Trips a driver took outside the engine (an offer accepted in the gateway) are
+    recorded with assign(); that driver stays reserved until complete() or release(),
+    or for at most assignment_ttl if neither ever comes.
+    """
+
+    def __init__(self, drivers, on_match, window=0.5, max_batch=500, exact_limit=200, candidates=10,
+                 max_pickup_km=5.0, max_attempts=10, reserve_ttl=30.0, assignment_ttl=3 * 3600.0, clock=time.monotonic, tracer=None):
+        self.drivers = drivers
+        self.tracer = tracer or tracing.tracer
+        self.on_match = on_match
+        self.window = window
+        self.max_batch = max_batch
+        self.exact_limit = exact_limit
+        self.candidates = candidates
+        self.max_pickup_km = max_pickup_km
+        self.max_attempts = max_attempts
+        self.reserve_ttl = reserve_ttl
+        self.assignment_ttl = assignment_ttl
+        self.clock = clock
+        self.pending = []
+        self.reserved = {}
+        self.assignments = {}
+        self._full = asyncio.Event()
+        self._running = False
+        self.batches = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.assigned = 0
+        self.completed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.pickup_km_total = 0.0
+        self.solver_total = 0.0
+        self.solver_max = 0.0
+        self.last_batch = {}
+
+    def submit(self, trip_id, lat, lng, correlation_id=None, trace=None):
+        """Queue a trip for the next window; trace (a SpanContext) is continued by its 'driver.match' span."""
+        self.pending.append(PendingTrip(trip_id, lat, lng, self.clock(), correlation_id, trace))
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+
+    def release(self, driver_id):
+        self.reserved.pop(driver_id, None)
+
+    def assign(self, trip_id, driver_id):
+        """Record that driver_id took trip_id; returns the driver the engine had reserved for it, if another.
+
+        The trip leaves the pending queue, the driver is reserved until the trip is
+        completed and the driver the engine picked for the trip, if any, is released.
+        """
+        trip_id, driver_id = str(trip_id), str(driver_id)
+        self.pending = [trip for trip in self.pending if str(trip.trip_id) != trip_id]
+        previous = self.assignments.get(trip_id)
+        if previous == driver_id:
+            previous = None
+        elif previous is not None:
+            self.release(previous)
+        self.assignments[trip_id] = driver_id
+        self.reserved[driver_id] = self.clock() + self.assignment_ttl
+        self.assigned += 1
+        return previous
+
+    def complete(self, trip_id):
+        """The trip ended (finished or cancelled); its driver can be matched again. Returns that driver."""
+        driver_id = self.assignments.pop(str(trip_id), None)
+        if driver_id is not None:
+            self.release(driver_id)
+            self.completed += 1
+        return driver_id
+
+    def _available_candidates(self, trip):
+        # match_batch drops expired reservations first, so every key here is still held.
+        found = self.drivers.nearest(trip.lat, trip.lng, k=self.candidates, max_km=self.max_pickup_km,
+                                     exclude=self.reserved)
+        return [driver_id for driver_id, _ in found]
+
+    def match_batch(self):
+        """Match what is pending now; returns [(trip_id, driver_id, pickup_km)]."""
+        if not self.pending:
+            return []
+        now = self.clock()
+        batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        for driver_id in [d for d, until in self.reserved.items() if until <= now]:
+            del self.reserved[driver_id]
+        for trip_id in [t for t, d in self.assignments.items() if d not in self.reserved]:
+            del self.assignments[trip_id]
+
+        driver_ids = list(dict.fromkeys(d for trip in batch for d in self._available_candidates(trip)))
+        matches = []
+        solver = 'none'
+        started = time.perf_counter()
+        if driver_ids:
+            d_lats, d_lngs = self.drivers.positions(driver_ids)
+            cost = np.vstack([haversine_km(trip.lat, trip.lng, d_lats, d_lngs) for trip in batch])
+            cost[cost > self.max_pickup_km] = INFEASIBLE
+            solver = 'exact' if len(batch) <= self.exact_limit else 'greedy'
+            rows, cols = solve_assignment(cost) if solver == 'exact' else solve_greedy(cost)
+            feasible = cost[rows, cols] < INFEASIBLE
+            matches = [(batch[r], driver_ids[c], float(cost[r, c])) for r, c in zip(rows[feasible], cols[feasible])]
+        solver_time = time.perf_counter() - started
+
+        matched_trips = set()
+        for trip, driver_id, pickup_km in matches:
+            matched_trips.add(trip.trip_id)
+            self.reserved[driver_id] = now + self.reserve_ttl
+            self.assignments[str(trip.trip_id)] = driver_id
+            latency = now - trip.received_at
+            self.matched += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.pickup_km_total += pickup_km
+            self.tracer.record('driver.match', trip.trace, latency, trip_id=trip.trip_id, driver_id=driver_id,
+                               correlation_id=trip.correlation_id, windows=trip.attempts + 1)
+
+        retry = []
+        for trip in batch:
+            if trip.trip_id in matched_trips:
+                continue
+            trip.attempts += 1
+            if trip.attempts < self.max_attempts:
+                retry.append(trip)
+            else:
+                self.unmatched += 1
+                logger.warning("No driver found for trip %s after %s windows correlation_id=%s",
+                               trip.trip_id, trip.attempts, trip.correlation_id)
+                self.tracer.record('driver.match', trip.trace, now - trip.received_at, error='no driver found',
+                                   trip_id=trip.trip_id, correlation_id=trip.correlation_id, windows=trip.attempts)
+        self.pending = retry + self.pending
+
+        self.batches += 1
+        self.solver_total += solver_time
+        self.solver_max = max(self.solver_max, solver_time)
+        self.last_batch = {
+            'trips': len(batch),
+            'drivers': len(driver_ids),
+            'matched': len(matches),
+            'solver': solver,
+            'solver_ms': solver_time * 1000,
+        }
+        return [(trip.trip_id, driver_id, pickup_km) for trip, driver_id, pickup_km in matches]
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            for trip_id, driver_id, pickup_km in self.match_batch():
+                try:
+                    await self.on_match(trip_id, driver_id, pickup_km)
+                except Exception as e:
+                    logger.exception("Failed to dispatch trip %s to driver %s: %s", trip_id, driver_id, e)
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'reserved_drivers': len(self.reserved),
+            'batches': self.batches,
+            'matched': self.matched,
+            'unmatched': self.unmatched,
+            'assigned': self.assigned,
+            'completed': self.completed,
+            'match_latency_avg_ms': (self.latency_total / self.matched * 1000) if self.matched else 0.0,
+            'match_latency_max_ms': self.latency_max * 1000,
+            'pickup_km_avg': self.pickup_km_total / self.matched if self.matched else 0.0,
+            'solver_avg_ms': (self.solver_total / self.batches * 1000) if self.batches else 0.0,
+            'solver_max_ms': self.solver_max * 1000,
+            'last_batch': self.last_batch,
+        }
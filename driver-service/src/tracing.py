@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanContext:
+    """Trace and span id plus the sampled flag, as carried by a W3C traceparent."""
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, header):
+        """The SpanContext in a traceparent value, or None if it is missing or malformed."""
+        parts = (header or '').strip().split('-')
+        if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            flags = int(parts[3], 16)
+            if not int(parts[1], 16) or not int(parts[2], 16):
+                return None
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], bool(flags & 1))
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'service', 'start', 'duration', 'attributes', 'error')
+
+    def __init__(self, name, context, parent_id, service, attributes, start=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.service = service
+        self.start = time.time() if start is None else start
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': self.service,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class JsonlCollector:
+    """Appends finished spans as JSON lines to path from a writer thread; drops them when the queue is full.
+
+    Same line format as the gateway's collector, so scripts/trace_report.py reads both.
+    """
+
+    def __init__(self, path, maxsize=10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize)
+        self.exported = 0
+        self.dropped = 0
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, span):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, name='span-collector', daemon=True)
+            self._thread.start()
+        try:
+            self.queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+                self.exported += 1
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'exported': self.exported, 'dropped': self.dropped}
+
+
+class Tracer:
+    """Continues traces from incoming events and exports the sampled spans.
+
+    A span with a parent takes the parent's sampling decision; only traces that start
+    here (events without a traceparent) are sampled at sample_rate.
+    """
+
+    def __init__(self, service, collector=None, sample_rate=0.0, rng=random):
+        self.service = service
+        self.collector = collector
+        self.sample_rate = sample_rate
+        self.rng = rng
+        self.started = 0
+        self.sampled = 0
+
+    def start_span(self, name, parent=None, start=None, **attributes):
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            trace_id = f"{self.rng.getrandbits(128):032x}"
+            sampled = self.collector is not None and self.rng.random() < self.sample_rate
+        else:
+            trace_id, sampled = parent.trace_id, parent.sampled
+        self.started += 1
+        context = SpanContext(trace_id, f"{self.rng.getrandbits(64):016x}", sampled)
+        return Span(name, context, parent.span_id if parent is not None else None, self.service, attributes, start)
+
+    def end_span(self, span, duration=None):
+        span.duration = time.time() - span.start if duration is None else duration
+        if span.context.sampled and self.collector is not None:
+            self.sampled += 1
+            self.collector.export(span)
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Run the block inside a new current span; an exception is recorded on it and re-raised."""
+        span = self.start_span(name, parent, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(span)
+
+    def record(self, name, parent, duration, error=None, **attributes):
+        """Export a span that ended now and lasted duration seconds (e.g. time a trip waited for a match)."""
+        span = self.start_span(name, parent, time.time() - duration, **attributes)
+        span.error = error
+        self.end_span(span, duration)
+
+    def stats(self):
+        stats = {'spans_started': self.started, 'spans_sampled': self.sampled, 'sample_rate': self.sample_rate}
+        if self.collector is not None:
+            stats['collector'] = self.collector.stats()
+        return stats
+
+
+tracer = Tracer('driver-service')
+
+
+def current_context():
+    """SpanContext of the current span, to continue the trace later (e.g. from the matcher)."""
+    span = _current.get()
+    return span.context if span is not None else None
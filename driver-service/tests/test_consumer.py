@@ -0,0 +1,198 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+import tracing
+from api import create_app
+from broker import LocalBroker
+from consumer import Consumer, SeenSet
+from geo_index import DriverIndex
+from locations import LocationStore
+from matching import MatchingEngine
+
+
+def trip_event(event_id, trip_id, event_type='trip.event.created', version='1.0'):
+    return {
+        'event_id': event_id,
+        'event_type': event_type,
+        'event_version': version,
+        'correlation_id': f"corr-{trip_id}",
+        'payload': {'trip_id': trip_id},
+    }
+
+
+def publish(broker, event):
+    broker.publish(event['event_type'], event['payload']['trip_id'], event)
+
+
+def test_seen_set_is_bounded():
+    seen = SeenSet(maxsize=2)
+    for event_id in ('a', 'b', 'c'):
+        seen.add(event_id)
+    assert 'a' not in seen and 'c' in seen
+    assert len(seen) == 2
+
+
+def test_events_of_one_trip_stay_ordered_while_trips_run_concurrently():
+    async def scenario():
+        broker = LocalBroker(partitions=4)
+        consumer = Consumer(broker, 'g', ['trip.event.created', 'trip.event.driver_assigned'], concurrency=8)
+        log = []
+        active = {'now': 0, 'max': 0}
+
+        async def handler(event):
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+            await asyncio.sleep(0.01)
+            log.append((event['payload']['trip_id'], event['event_type']))
+            active['now'] -= 1
+
+        consumer.on('trip.event.created', handler)
+        consumer.on('trip.event.driver_assigned', handler)
+        for n in range(10):
+            publish(broker, trip_event(f"c{n}", f"t{n}"))
+            publish(broker, trip_event(f"a{n}", f"t{n}", 'trip.event.driver_assigned'))
+        while await consumer.poll_once():
+            pass
+        return consumer, log, active['max']
+
+    consumer, log, max_active = asyncio.run(scenario())
+    for n in range(10):
+        events = [event_type for trip_id, event_type in log if trip_id == f"t{n}"]
+        assert events == ['trip.event.created', 'trip.event.driver_assigned']
+    assert max_active > 1
+    assert consumer.stats()['lag'] == 0
+    assert consumer.stats()['processed'] == 20
+
+
+def test_duplicate_events_are_handled_once():
+    async def scenario():
+        broker = LocalBroker(partitions=2)
+        consumer = Consumer(broker, 'g', ['trip.event.created'], fetch_timeout=0)
+        handled = []
+
+        async def handler(event):
+            handled.append(event['event_id'])
+
+        consumer.on('trip.event.created', handler)
+        publish(broker, trip_event('e1', 't1'))
+        publish(broker, trip_event('e1', 't1'))
+        publish(broker, trip_event('e2', 't2', version='2.0'))
+        await consumer.poll_once()
+        publish(broker, trip_event('e1', 't1'))
+        await consumer.poll_once()
+        return consumer, handled
+
+    consumer, handled = asyncio.run(scenario())
+    assert handled == ['e1']
+    assert consumer.duplicates == 2
+    assert consumer.skipped == 1
+
+
+def test_failing_handler_is_retried_then_committed():
+    async def scenario():
+        broker = LocalBroker(partitions=1)
+        consumer = Consumer(broker, 'g', ['trip.event.created'], max_retries=3, retry_delay=0, fetch_timeout=0)
+        calls = []
+
+        async def handler(event):
+            calls.append(event['event_id'])
+            raise RuntimeError("driver_db unavailable")
+
+        consumer.on('trip.event.created', handler)
+        publish(broker, trip_event('e1', 't1'))
+        await consumer.poll_once()
+        return consumer, calls, broker.lag('g', ['trip.event.created'])
+
+    consumer, calls, lag = asyncio.run(scenario())
+    assert calls == ['e1', 'e1', 'e1']
+    assert consumer.failed == 1
+    assert lag == 0
+
+
+def test_broker_drops_messages_every_group_has_committed():
+    async def scenario():
+        broker = LocalBroker(partitions=1)
+        for n in range(5):
+            publish(broker, trip_event(f"e{n}", f"t{n}"))
+        topics = ['trip.event.created']
+        await broker.fetch('b', topics, timeout=0)
+        first = await broker.fetch('a', topics, max_messages=3, timeout=0)
+        broker.commit('a', {('trip.event.created', 0): first[-1].offset + 1})
+        broker.commit('b', {('trip.event.created', 0): 2})
+        after_two = broker.retained(topics)
+        broker.commit('b', {('trip.event.created', 0): 5})
+        after_all = broker.retained(topics)
+        broker.rewind('a')
+        rest = await broker.fetch('a', topics, timeout=0)
+        publish(broker, trip_event('e5', 't5'))
+        return after_two, after_all, [m.offset for m in rest], broker.lag('a', topics), broker.lag('b', topics)
+
+    after_two, after_all, rest, lag_a, lag_b = asyncio.run(scenario())
+    assert after_two == 3
+    assert after_all == 2
+    assert rest == [3, 4]
+    assert (lag_a, lag_b) == (3, 1)
+
+
+def test_fetch_rotates_over_partitions():
+    async def scenario():
+        broker = LocalBroker(partitions=2)
+        for n in range(4):
+            broker.publish('trips', 't4', n)  # partition 0
+        broker.publish('trips', 't1', 'quiet')  # partition 1
+        return [[m.value for m in await broker.fetch('g', ['trips'], max_messages=2, timeout=0)]
+                for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [[0, 1], ['quiet', 2], [3]]
+
+
+class ListCollector:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+
+def test_handler_continues_the_trace_of_the_event():
+    collector = ListCollector()
+    tracer = tracing.Tracer('driver-service', collector)
+    parent = tracing.SpanContext('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', True)
+
+    async def scenario():
+        broker = LocalBroker(partitions=1)
+        consumer = Consumer(broker, 'g', ['trip.event.created'], fetch_timeout=0, tracer=tracer)
+        seen = []
+
+        async def handler(event):
+            seen.append(tracing.current_context())
+
+        consumer.on('trip.event.created', handler)
+        publish(broker, {**trip_event('e1', 't1'), 'traceparent': parent.traceparent()})
+        await consumer.poll_once()
+        return seen
+
+    seen = asyncio.run(scenario())
+    span, = collector.spans
+    assert span['name'] == 'consume trip.event.created'
+    assert span['trace_id'] == parent.trace_id and span['parent_id'] == parent.span_id
+    assert span['attributes']['correlation_id'] == 'corr-t1'
+    assert seen[0].span_id == span['span_id']
+
+
+def test_posted_trip_events_reach_the_matcher():
+    broker = LocalBroker(partitions=2)
+    client = TestClient(create_app(LocationStore(capacity=16), broker=broker, topics=main.TRIP_TOPICS))
+    event = trip_event('e1', 't1')
+    event['payload']['pickup'] = {'address': 'вул. Хрещатик, 1', 'lat': 50.45, 'lng': 30.52}
+    resp = client.post('/events', json=event)
+    assert resp.status_code == 202 and resp.json()['topic'] == 'trip.event.created'
+    assert client.post('/events', json={**event, 'event_type': 'trip.event.unknown'}).status_code == 422
+    assert client.post('/events', json=trip_event('e2', 't2')).status_code == 422
+    assert TestClient(create_app(LocationStore(capacity=16))).post('/events', json=event).status_code == 503
+
+    matcher = MatchingEngine(DriverIndex(), on_match=None)
+    assert asyncio.run(main.build_consumer(broker, matcher).poll_once()) == 1
+    assert [(trip.trip_id, trip.correlation_id) for trip in matcher.pending] == [('t1', 'corr-t1')]
@@ -0,0 +1,56 @@
+import numpy as np
+
+from geo_index import DriverIndex, haversine_km
+
+
+def brute_nearest(drivers, lat, lng, k):
+    ids = list(drivers)
+    positions = np.array([drivers[i] for i in ids])
+    distances = haversine_km(lat, lng, positions[:, 0], positions[:, 1])
+    return [ids[i] for i in np.argsort(distances)[:k]]
+
+
+def test_haversine_known_distance():
+    # Kyiv centre to Boryspil airport is about 29 km in a straight line.
+    assert 28 < float(haversine_km(50.4501, 30.5234, np.array([50.3450]), np.array([30.8947]))[0]) < 30
+
+
+def test_nearest_matches_brute_force_after_moves_and_removals():
+    rng = np.random.default_rng(1)
+    index = DriverIndex(cell_deg=0.01, capacity=16)
+    drivers = {}
+    for driver_id in range(2000):
+        drivers[driver_id] = (rng.uniform(50.35, 50.55), rng.uniform(30.35, 30.70))
+        index.update(driver_id, *drivers[driver_id])
+    for driver_id in rng.integers(0, 2000, 500):
+        drivers[int(driver_id)] = (rng.uniform(50.35, 50.55), rng.uniform(30.35, 30.70))
+        index.update(int(driver_id), *drivers[int(driver_id)])
+    for driver_id in range(0, 2000, 7):
+        assert index.remove(driver_id)
+        del drivers[driver_id]
+
+    assert len(index) == len(drivers)
+    for lat, lng in zip(rng.uniform(50.3, 50.6, 50), rng.uniform(30.3, 30.75, 50)):
+        found = [driver_id for driver_id, _ in index.nearest(lat, lng, k=5)]
+        assert found == brute_nearest(drivers, lat, lng, 5)
+
+    busy = set(list(drivers)[::3])
+    free = {d: p for d, p in drivers.items() if d not in busy}
+    for lat, lng in zip(rng.uniform(50.3, 50.6, 20), rng.uniform(30.3, 30.75, 20)):
+        found = [driver_id for driver_id, _ in index.nearest(lat, lng, k=5, exclude=busy)]
+        assert found == brute_nearest(free, lat, lng, 5)
+
+
+def test_within_radius_and_max_distance():
+    index = DriverIndex()
+    index.update('near', 50.4501, 30.5234)
+    index.update('mid', 50.4601, 30.5234)
+    index.update('far', 50.3450, 30.8947)
+
+    assert [d for d, _ in index.within(50.4501, 30.5234, 2.0)] == ['near', 'mid']
+    assert [d for d, _ in index.nearest(50.4501, 30.5234, k=3, max_km=5)] == ['near', 'mid']
+    assert index.nearest(0.0, 0.0, k=1, max_km=1) == []
+
+    index.update('far', 50.4502, 30.5235)
+    assert index.position('far') == (50.4502, 30.5235)
+    assert len(index.within(50.4501, 30.5234, 0.1)) == 2
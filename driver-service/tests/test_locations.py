@@ -0,0 +1,59 @@
+from fastapi.testclient import TestClient
+
+from api import create_app
+from locations import LocationStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_newest_ping_wins_within_and_across_batches():
+    store = LocationStore(capacity=8, clock=FakeClock())
+    store.ingest(['a', 'b', 'a'], [1.0, 2.0, 3.0], [1.0, 2.0, 3.0], [10.0, 10.0, 5.0])
+    assert store.latest('a') is None
+    store.clock.now = 20.0
+    assert store.latest('a') == (1.0, 1.0, 10.0)
+    store.ingest(['a'], [9.0], [9.0], [4.0])
+    assert store.latest('a') == (1.0, 1.0, 10.0)
+    assert len(store) == 2
+
+
+def test_ring_keeps_only_the_newest_pings():
+    store = LocationStore(capacity=4, max_drivers=1)
+    store.ingest(['a'] * 3, [1, 2, 3], [0, 0, 0], [1, 2, 3])
+    store.ingest(['a', 'b', 'c'], [4, 5, 6], [0, 0, 0], [4, 5, 6])
+    assert [lat for lat, _, _ in store.history('a')] == [4.0, 3.0]
+    store.ingest(['a'] * 10, list(range(10, 20)), [0] * 10, list(range(10, 20)))
+    assert [lat for lat, _, _ in store.history('a')] == [19.0, 18.0, 17.0, 16.0]
+    assert store.stats()['pings_total'] == 16
+
+
+def test_changes_report_fresh_and_expired_drivers():
+    clock = FakeClock()
+    store = LocationStore(capacity=16, max_age=60, clock=clock)
+    store.ingest(['a', 'b'], [1, 2], [1, 2])
+    fresh, expired, seq, since = store.changes(0, clock.now)
+    assert sorted(d for d, _, _ in fresh) == ['a', 'b'] and expired == []
+
+    clock.now += 30
+    store.ingest(['b'], [3], [3])
+    clock.now += 40
+    fresh, expired, seq, since = store.changes(seq, since)
+    assert fresh == [('b', 3.0, 3.0)] and expired == ['a']
+    assert store.changes(seq, since)[:2] == ([], [])
+
+
+def test_ingest_endpoint():
+    store = LocationStore(capacity=16)
+    client = TestClient(create_app(store))
+    resp = client.post('/locations', json={'driver_ids': ['d1', 'd2'], 'lat': [50.45, 50.46], 'lng': [30.52, 30.53]})
+    assert resp.status_code == 202 and resp.json() == {'accepted': 2}
+    assert client.get('/locations/d2').json()['lat'] == 50.46
+    assert client.get('/locations/nobody').status_code == 404
+    assert client.post('/locations', json={'driver_ids': ['d1'], 'lat': [], 'lng': [1.0]}).status_code == 422
+    assert client.get('/stats').json()['locations']['drivers_known'] == 2
@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+
+import numpy as np
+
+from fastapi.testclient import TestClient
+
+import main
+import tracing
+from api import create_app
+from geo_index import DriverIndex
+from locations import LocationStore
+from matching import INFEASIBLE, MatchingEngine, solve_assignment, solve_greedy
+
+
+def brute_force(cost):
+    n, m = cost.shape
+    if n <= m:
+        return min(sum(cost[r, c] for r, c in zip(range(n), cols)) for cols in itertools.permutations(range(m), n))
+    return brute_force(cost.T)
+
+
+def test_assignment_is_optimal_on_small_matrices():
+    rng = np.random.default_rng(5)
+    for n, m in [(3, 3), (4, 6), (6, 4), (5, 5)]:
+        cost = rng.uniform(0, 10, (n, m))
+        rows, cols = solve_assignment(cost)
+        assert len(rows) == min(n, m)
+        assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+        assert np.isclose(cost[rows, cols].sum(), brute_force(cost))
+
+
+def test_batch_beats_greedy_on_crossing_trips():
+    # Greedy takes the globally cheapest pair (0, 0) and leaves trip 1 with a long pickup.
+    cost = np.array([[1.0, 2.0], [2.0, 9.0]])
+    rows, cols = solve_assignment(cost)
+    assert cost[rows, cols].sum() == 4.0
+    rows, cols = solve_greedy(cost)
+    assert cost[rows, cols].sum() == 10.0
+
+
+def test_infeasible_pairs_are_not_matched():
+    cost = np.array([[1.0, INFEASIBLE], [INFEASIBLE, INFEASIBLE]])
+    rows, cols = solve_greedy(cost)
+    assert list(zip(rows, cols)) == [(0, 0)]
+
+
+def make_engine(**kwargs):
+    now = [0.0]
+    index = DriverIndex()
+    index.update('d1', 50.450, 30.520)
+    index.update('d2', 50.460, 30.520)
+    index.update('far', 50.900, 30.520)
+    engine = MatchingEngine(index, on_match=None, clock=lambda: now[0], **kwargs)
+    return engine, now
+
+
+def test_engine_matches_batch_and_reserves_drivers():
+    engine, now = make_engine(max_pickup_km=5.0, max_attempts=2)
+    engine.submit('t1', 50.451, 30.520)
+    engine.submit('t2', 50.459, 30.520)
+    engine.submit('t3', 50.455, 30.520)
+    now[0] = 0.5
+    matches = engine.match_batch()
+    assert sorted((t, d) for t, d, _ in matches) == [('t1', 'd1'), ('t2', 'd2')]
+    assert [t.trip_id for t in engine.pending] == ['t3']
+    assert engine.stats()['last_batch']['solver'] == 'exact'
+
+    assert engine.match_batch() == []
+    assert engine.pending == []
+    stats = engine.stats()
+    assert stats['matched'] == 2 and stats['unmatched'] == 1
+    assert stats['match_latency_avg_ms'] == 500.0
+
+
+def test_assignment_from_the_gateway_releases_the_engines_pick():
+    engine, now = make_engine()
+    engine.submit('t1', 50.451, 30.520)
+    engine.submit('t2', 50.459, 30.520)
+    assert [m[:2] for m in engine.match_batch()] == [('t1', 'd1'), ('t2', 'd2')]
+    engine.submit('t3', 50.455, 30.520)
+
+    # d2 accepted t1's offer in the gateway, so the engine's pick for t1 (d1) is free again.
+    assert engine.assign('t1', 'd2') == 'd1'
+    assert engine.assign('t1', 'd2') is None
+    assert set(engine.reserved) == {'d2'}
+    engine.submit('t4', 50.451, 30.520)
+    assert engine.assign('t4', 'far') is None
+    assert [t.trip_id for t in engine.pending] == ['t3']
+    assert [m[:2] for m in engine.match_batch()] == [('t3', 'd1')]
+    assert engine.stats()['assigned'] == 3
+
+
+def test_accepted_driver_stays_reserved_until_the_trip_ends():
+    engine, now = make_engine(reserve_ttl=30.0)
+    engine.assign('t1', 'd1')
+    now[0] = 600.0
+    engine.submit('t2', 50.451, 30.520)
+    assert [m[:2] for m in engine.match_batch()] == [('t2', 'd2')]
+
+    assert engine.complete('t1') == 'd1'
+    assert engine.complete('t1') is None
+    engine.submit('t3', 50.451, 30.520)
+    assert [m[:2] for m in engine.match_batch()] == [('t3', 'd1')]
+
+
+def test_reserved_drivers_do_not_take_candidate_places():
+    engine, _ = make_engine(candidates=1)
+    engine.submit('t1', 50.451, 30.520)
+    engine.match_batch()
+    engine.submit('t2', 50.451, 30.520)
+    assert [m[:2] for m in engine.match_batch()] == [('t2', 'd2')]
+
+
+def test_assignments_endpoint():
+    client = TestClient(create_app(LocationStore(capacity=16)))
+    assert client.post('/assignments', json={'trip_id': 't1', 'driver_id': '7'}).status_code == 503
+
+    engine, _ = make_engine()
+    client = TestClient(create_app(LocationStore(capacity=16), matcher=engine))
+    resp = client.post('/assignments', json={'trip_id': 't1', 'driver_id': '7', 'source': 'telegram_bot'})
+    assert resp.status_code == 202
+    assert resp.json() == {'trip_id': 't1', 'driver_id': '7', 'released': None}
+    assert '7' in engine.reserved
+    assert client.delete('/assignments/t1').json() == {'trip_id': 't1', 'driver_id': '7'}
+    assert '7' not in engine.reserved
+    assert client.delete('/assignments/t1').status_code == 404
+
+
+def test_engine_switches_to_greedy_for_large_batches():
+    engine, _ = make_engine(exact_limit=1)
+    engine.submit('t1', 50.451, 30.520)
+    engine.submit('t2', 50.459, 30.520)
+    assert len(engine.match_batch()) == 2
+    assert engine.stats()['last_batch']['solver'] == 'greedy'
+
+
+def test_match_span_continues_the_trip_trace():
+    spans = []
+
+    class Collector:
+        def export(self, span):
+            spans.append(span.to_dict())
+
+    trace = tracing.SpanContext('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', True)
+    engine, now = make_engine(tracer=tracing.Tracer('driver-service', Collector()))
+    engine.submit('t1', 50.451, 30.520, correlation_id='REQ-1', trace=trace)
+    now[0] = 0.25
+    engine.match_batch()
+    span, = spans
+    assert span['name'] == 'driver.match' and span['duration_ms'] == 250.0
+    assert span['trace_id'] == trace.trace_id and span['parent_id'] == trace.span_id
+    assert span['attributes']['driver_id'] == 'd1' and span['attributes']['correlation_id'] == 'REQ-1'
+
+
+def test_service_dispatches_created_trips_through_the_matcher():
+    main.drivers.update('d-main', 50.45, 30.52)
+    event = {'event_id': 'e-main', 'event_type': 'trip.event.created', 'event_version': '1.0',
+             'payload': {'trip_id': 't-main', 'pickup': {'address': 'вул. Хрещатик, 1', 'lat': 50.4501, 'lng': 30.5234}}}
+    asyncio.run(main.consumer.handlers['trip.event.created'](event))
+    assert [m[:2] for m in main.matcher.match_batch()] == [('t-main', 'd-main')]
+    ended = dict(event, event_id='e-main-done', event_type='trip.event.completed', payload={'trip_id': 't-main'})
+    asyncio.run(main.consumer.handlers['trip.event.completed'](ended))
+    assert 'd-main' not in main.matcher.reserved
@@ -0,0 +1,113 @@
+"""Per-stage latency breakdown from the span files written by the gateway and driver-service.
+
+Reads one or more JSONL span files (TRACE_EXPORT_PATH of each service), prints per
+stage (service + span name) count, p50/p99 duration and self time (duration minus
+child spans), the share of all root-span time each stage accounts for, and the
+end-to-end latency of orders grouped by correlation_id across services.
+
+    python scripts/trace_report.py client-gateway/bot/logs/spans.jsonl driver-service/spans.jsonl [--json]
+"""
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+    return spans
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def breakdown(spans):
+    by_id = {span['span_id']: span for span in spans}
+    child_time = defaultdict(float)
+    for span in spans:
+        if span.get('parent_id') in by_id:
+            child_time[span['parent_id']] += span['duration_ms']
+
+    stages = defaultdict(lambda: {'durations': [], 'self': []})
+    root_total = 0.0
+    for span in spans:
+        stage = stages[f"{span['service']}:{span['name']}"]
+        stage['durations'].append(span['duration_ms'])
+        stage['self'].append(max(0.0, span['duration_ms'] - child_time[span['span_id']]))
+        if span.get('parent_id') not in by_id:
+            root_total += span['duration_ms']
+
+    # A trace belongs to the order whose correlation_id any of its spans carries (the
+    # confirm update's trace holds the Trip Service call and, downstream, matching).
+    trace_orders = {}
+    for span in spans:
+        correlation_id = (span.get('attributes') or {}).get('correlation_id')
+        if correlation_id:
+            trace_orders.setdefault(span['trace_id'], correlation_id)
+    orders = defaultdict(list)
+    for span in spans:
+        correlation_id = trace_orders.get(span['trace_id'])
+        if correlation_id:
+            orders[correlation_id].append(span)
+    end_to_end = []
+    for order_spans in orders.values():
+        start = min(span['start'] for span in order_spans)
+        end = max(span['start'] + span['duration_ms'] / 1000 for span in order_spans)
+        end_to_end.append((end - start) * 1000)
+
+    return {
+        'spans': len(spans),
+        'traces': len({span['trace_id'] for span in spans}),
+        'stages': {
+            name: {
+                'count': len(stage['durations']),
+                'p50_ms': round(percentile(stage['durations'], 0.5), 3),
+                'p99_ms': round(percentile(stage['durations'], 0.99), 3),
+                'self_p50_ms': round(percentile(stage['self'], 0.5), 3),
+                'self_share': round(sum(stage['self']) / root_total, 4) if root_total else 0.0,
+            }
+            for name, stage in sorted(stages.items(), key=lambda item: -sum(item[1]['self']))
+        },
+        'orders': {
+            'count': len(end_to_end),
+            'services': sorted({span['service'] for spans_ in orders.values() for span in spans_}),
+            'p50_ms': round(percentile(end_to_end, 0.5), 3),
+            'p99_ms': round(percentile(end_to_end, 0.99), 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = breakdown(load_spans(args.paths))
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+
+    print(f"{report['spans']} spans in {report['traces']} traces")
+    print(f"{'stage':<48} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'self p50':>9} {'self %':>7}")
+    for name, stage in report['stages'].items():
+        print(f"{name:<48} {stage['count']:>7} {stage['p50_ms']:>9.2f} {stage['p99_ms']:>9.2f}"
+              f" {stage['self_p50_ms']:>9.2f} {stage['self_share'] * 100:>6.1f}%")
+    orders = report['orders']
+    print(f"orders by correlation_id: {orders['count']} across {', '.join(orders['services']) or '-'}"
+          f"  end-to-end p50 {orders['p50_ms']:.2f} ms  p99 {orders['p99_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -62,6 +62,7 @@ func main() {
 	r.Use(middleware.Logger)
 	r.Use(middleware.Recoverer)
 	r.Use(middleware.RequestID)
+	r.Use(api.TraceContext)
 	r.Use(middleware.Timeout(60 * time.Second))
 
 	r.Get("/health", handler.HealthCheck)
@@ -1,9 +1,12 @@
 package http
 
 import (
+	"crypto/sha256"
+	"encoding/hex"
 	"encoding/json"
 	"errors"
 	"net/http"
+	"strings"
 	"trip-service/internal/domain"
 	"trip-service/internal/service"
 
@@ -59,8 +62,38 @@ func (h *TripHandler) GetTrip(w http.ResponseWriter, r *http.Request) {
 		}
 		return
 	}
+	body, err := json.Marshal(trip)
+	if err != nil {
+		http.Error(w, "Internal server error", http.StatusInternalServerError)
+		return
+	}
+	// Клієнти опитують статус поїздки; незмінна поїздка коштує 304 без тіла.
+	etag := tripETag(body)
+	w.Header().Set("ETag", etag)
+	w.Header().Set("Cache-Control", "no-cache")
+	if etagMatches(r.Header.Get("If-None-Match"), etag) {
+		w.WriteHeader(http.StatusNotModified)
+		return
+	}
 	w.Header().Set("Content-Type", "application/json")
-	json.NewEncoder(w).Encode(trip)
+	w.Write(append(body, '\n'))
+}
+
+// tripETag - сильний ETag представлення поїздки: змінюється разом з будь-яким її полем.
+func tripETag(body []byte) string {
+	sum := sha256.Sum256(body)
+	return `"` + hex.EncodeToString(sum[:16]) + `"`
+}
+
+// etagMatches перевіряє If-None-Match (список ETag через кому або "*").
+func etagMatches(header, etag string) bool {
+	for _, candidate := range strings.Split(header, ",") {
+		candidate = strings.TrimPrefix(strings.TrimSpace(candidate), "W/")
+		if candidate == etag || candidate == "*" {
+			return true
+		}
+	}
+	return false
 }
 
 // GET /health
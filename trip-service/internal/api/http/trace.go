@@ -0,0 +1,29 @@
+package http
+
+import (
+	"net/http"
+	"trip-service/internal/domain"
+
+	"github.com/go-chi/chi/middleware"
+)
+
+const (
+	CorrelationHeader = "X-Correlation-ID"
+	TraceParentHeader = "traceparent"
+)
+
+// TraceContext кладе X-Correlation-ID і traceparent запиту в контекст (див. domain.TraceFromContext).
+// Без X-Correlation-ID використовується request id від middleware.RequestID; id повертається у відповіді.
+func TraceContext(next http.Handler) http.Handler {
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		tc := domain.TraceContext{
+			CorrelationID: r.Header.Get(CorrelationHeader),
+			TraceParent:   r.Header.Get(TraceParentHeader),
+		}
+		if tc.CorrelationID == "" {
+			tc.CorrelationID = middleware.GetReqID(r.Context())
+		}
+		w.Header().Set(CorrelationHeader, tc.CorrelationID)
+		next.ServeHTTP(w, r.WithContext(domain.WithTrace(r.Context(), tc)))
+	})
+}
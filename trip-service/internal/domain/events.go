@@ -14,9 +14,10 @@ type Location struct {
 // BaseEvent містить метадані, спільні для всіх подій
 type BaseEvent struct {
 	EventID       string    `json:"event_id"`
-	EventType     string    `json:"event_type"`    // Напр. trip.event.created
+	EventType     string    `json:"event_type"` // Напр. trip.event.created
 	EventVersion  string    `json:"event_version"`
 	CorrelationID string    `json:"correlation_id"`
+	TraceParent   string    `json:"traceparent,omitempty"` // W3C traceparent запиту, з якого виникла подія
 	Timestamp     time.Time `json:"timestamp"`
 }
 
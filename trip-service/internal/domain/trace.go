@@ -0,0 +1,22 @@
+package domain
+
+import "context"
+
+type traceKey struct{}
+
+// TraceContext — ідентифікатори, що пов'язують запит із замовленням у боті та подіями в інших сервісах
+type TraceContext struct {
+	CorrelationID string // заголовок X-Correlation-ID (request_id замовлення)
+	TraceParent   string // заголовок W3C traceparent
+}
+
+// WithTrace зберігає TraceContext запиту в контексті
+func WithTrace(ctx context.Context, tc TraceContext) context.Context {
+	return context.WithValue(ctx, traceKey{}, tc)
+}
+
+// TraceFromContext повертає TraceContext запиту або порожній, якщо його немає
+func TraceFromContext(ctx context.Context) TraceContext {
+	tc, _ := ctx.Value(traceKey{}).(TraceContext)
+	return tc
+}